@@ -0,0 +1,43 @@
+# Exercise the glue code with typical inputs so PackageCompiler bakes the compiled methods into the
+# code runner's Julia sysimage.
+
+using LovelaceGlue
+
+echo(x) = x
+add_one(x) = x .+ 1
+swap(a, b) = (b, a)
+
+# The inputs are written with the same wire_format.py the engine encodes test cases with. It sits
+# next to this package both in the repo and in the code runner image.
+const WIRE_FORMAT_DIR = normpath(joinpath(@__DIR__, ".."))
+
+function write_inputs(path, input_tuples)
+    script = """
+    import sys
+    sys.path.insert(0, $(repr(WIRE_FORMAT_DIR)))
+    import numpy as np
+    from wire_format import write_file
+    write_file($(repr(path)), $input_tuples)
+    """
+    run(`python3 -c $script`)
+end
+
+cd(mktempdir()) do
+    # Numbers, lists and 1-D and 2-D arrays of ints and floats.
+    write_inputs("precompile.input.bin", """[
+        (1,), (2.5,), ([1, 2, 3],), ([1.0, 2.0],), ([[1, 2], [3, 4]],),
+        (np.array([1, 2, 3]),), (np.array([1.5, 2.5]),),
+        (np.array([[1, 2], [3, 4]]),), (np.array([[1.0, 2.0], [3.0, 4.0]]),),
+    ]""")
+    run_test_cases(add_one, "precompile.input.bin", "precompile")
+
+    # Strings, lists of strings and dicts.
+    write_inputs("precompile.input.bin", """[("abc",), (["a", "b"],), ({"a": 1},)]""")
+    run_test_cases(echo, "precompile.input.bin", "precompile")
+
+    # Multiple inputs and outputs.
+    write_inputs("precompile.input.bin", """[
+        (1, 2.0), ("a", "b"), (np.array([1.0, 2.0]), "c"), (np.array([[1, 2], [3, 4]]), 1.5),
+    ]""")
+    run_test_cases(swap, "precompile.input.bin", "precompile")
+end
@@ -0,0 +1,146 @@
+module LovelaceGlue
+
+import JSON
+
+export run_test_cases
+
+timed_function_call(f, input) = @timed f(input...)
+
+# CPU time used by the process so far in seconds. CLOCKS_PER_SEC is always 10^6 on POSIX systems.
+cpu_time() = ccall(:clock, Clong, ()) / 1e6
+
+function json_array_dim(a)
+    if length(size(a)) > 0
+        return 1 + json_array_dim(a[1])
+    else
+        return 0
+    end
+end
+
+function json_array_eltype(a)
+    if eltype(a) == Any
+        return json_array_eltype(a[1])
+    else
+        return eltype(a)
+    end
+end
+
+juliafy_json(t) = t
+juliafy_json(a::Vector{Any}) = convert(Array{json_array_eltype(a), json_array_dim(a)}, hcat(a...))
+
+# Reader for the binary format the engine sends test case inputs in, see wire_format.py.
+const WIRE_MAGIC = b"LVLC"
+const WIRE_VERSION = 0x01
+
+const WIRE_DTYPES = Dict(
+    "|b1" => Bool,
+    "|i1" => Int8, "<i2" => Int16, "<i4" => Int32, "<i8" => Int64,
+    "|u1" => UInt8, "<u2" => UInt16, "<u4" => UInt32, "<u8" => UInt64,
+    "<f4" => Float32, "<f8" => Float64,
+    "<c8" => ComplexF32, "<c16" => ComplexF64
+)
+
+read_le(io, T) = ltoh(read(io, T))
+
+function read_wire(path)
+    io = IOBuffer(read(path))
+
+    read(io, 4) == WIRE_MAGIC || error("$path is not in the wire format")
+    read(io, UInt8) == WIRE_VERSION || error("$path has an unsupported wire format version")
+
+    return read_wire_value(io)
+end
+
+function read_wire_value(io)
+    tag = Char(read(io, UInt8))
+
+    if tag == 'N'
+        return nothing
+    elseif tag == 'T'
+        return true
+    elseif tag == 'F'
+        return false
+    elseif tag == 'i'
+        return read_le(io, Int64)
+    elseif tag == 'I'
+        return parse(BigInt, String(read(io, read_le(io, UInt32))))
+    elseif tag == 'f'
+        return read_le(io, Float64)
+    elseif tag == 'c'
+        return complex(read_le(io, Float64), read_le(io, Float64))
+    elseif tag == 's'
+        return String(read(io, read_le(io, UInt32)))
+    elseif tag == 'b'
+        return read(io, read_le(io, UInt32))
+    elseif tag == 'l' || tag == 't'
+        n = read_le(io, UInt32)
+        return Any[read_wire_value(io) for _ in 1:n]
+    elseif tag == 'd'
+        n = read_le(io, UInt32)
+        d = Dict{Any, Any}()
+        for _ in 1:n
+            k = read_wire_value(io)
+            d[k] = read_wire_value(io)
+        end
+        return d
+    elseif tag == 'a'
+        dtype = String(read(io, read(io, UInt8)))
+        ndim = read(io, UInt8)
+        shape = [Int(read_le(io, UInt64)) for _ in 1:ndim]
+        nbytes = Int(read_le(io, UInt64))
+        skip(io, mod(-position(io), 8))
+
+        haskey(WIRE_DTYPES, dtype) || error("Unsupported array dtype $dtype")
+        data = reinterpret(WIRE_DTYPES[dtype], read(io, nbytes))
+
+        # numpy arrays are row-major and Julia arrays are column-major, so reversing the dimensions
+        # reads the same memory as the transpose, like the hcat of the rows juliafy_json does.
+        return ndim == 0 ? data[1] : collect(reshape(data, Tuple(reverse(shape))))
+    else
+        error("Unknown wire format type tag $tag")
+    end
+end
+
+tupleit(t) = tuple(t)
+tupleit(t::Tuple) = t
+
+function run_test_cases(f, input_file, run_id)
+    input_tuples = read_wire(input_file)
+
+    # run_jl.py passes us a pipe to write the (0-based) index of each finished test case to.
+    notify_fd = get(ENV, "LOVELACE_NOTIFY_FD", "")
+    notify_io = isempty(notify_fd) ? nothing : fdio(parse(Int, notify_fd))
+
+    # Each julia process only runs its share of the test cases, see run_sharded in harness.py.
+    start_index = parse(Int, get(ENV, "LOVELACE_START_INDEX", "0"))
+    step = parse(Int, get(ENV, "LOVELACE_STEP", "1"))
+
+    for (i, input_tuple) in enumerate(input_tuples)
+        (i - 1 >= start_index && (i - 1 - start_index) % step == 0) || continue
+
+        input_tuple = [juliafy_json(elem) for elem in input_tuple]
+
+        cpu_start = cpu_time()
+        output, runtime = timed_function_call(f, input_tuple)
+        cpu_end = cpu_time()
+
+        submission_data = Dict(
+            "userOutput" => tupleit(output),
+            "runTime" => runtime,
+            "cpuTime" => cpu_end - cpu_start,
+            # Peak resident set size of the julia process so far in kB.
+            "maxMemoryUsage" => Sys.maxrss() / 1024
+        )
+
+        open("$run_id.output$i.json", "w") do f
+           JSON.print(f, submission_data)
+        end
+
+        if notify_io !== nothing
+            println(notify_io, i - 1)
+            flush(notify_io)
+        end
+    end
+end
+
+end
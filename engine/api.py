@@ -1,12 +1,14 @@
 import atexit
 import base64
-import datetime
-import importlib
+import collections
+import concurrent.futures
+import itertools
 import json
 import logging
 import os
 import shutil
-import subprocess
+import tempfile
+import time
 import traceback
 import urllib
 
@@ -14,14 +16,25 @@ import falcon
 
 import engine.util as util
 
-from engine.code_runner import CodeRunner, FilePushError, FilePullError, EngineExecutionError
-from engine.docker_util import (
-    docker_init,
-    docker_file_push,
-    docker_file_pull,
-    create_docker_container,
-    remove_docker_container,
+from engine.code_runner import (
+    CodeRunner,
+    FilePushError,
+    FilePullError,
+    EngineExecutionError,
+    EngineTimeoutError,
 )
+from engine.compile_cache import CompileCache
+from engine.container_pool import ContainerPool, ContainerPoolTimeoutError
+from engine.docker_util import Symlink
+from engine.jobs import JobQueue, JobQueueFullError
+from engine.metrics import REGISTRY, SUBMISSIONS, STAGE_DURATION, time_stage
+from engine.problem_registry import ProblemRegistry
+from engine.resource_profiles import resource_profile
+from engine.resource_store import ResourceStore
+from engine.result_cache import ResultCache
+from engine.sandbox import sandbox_from_env, SandboxError
+from engine.test_case_cache import TestCaseCache
+from engine.verifier import verify_batch
 
 
 log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logging.ini")
@@ -29,162 +42,404 @@ logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
 logger = logging.getLogger(__name__)
 
 cwd = os.path.dirname(os.path.abspath(__file__))
+
+# Static resources are copied into a directory of each problem's own in here.
+STATIC_RESOURCE_DIR = os.path.join(cwd, "static_resources")
+
+# Each test case set's dynamic resources are kept in a directory of their own in here.
+DYNAMIC_RESOURCE_DIR = os.path.join(cwd, "dynamic_resources")
 os.chdir(cwd)
 
+# Seconds a submission will wait for a free code runner container before giving up.
+CONTAINER_CHECKOUT_TIMEOUT = int(os.environ.get("LOVELACE_CONTAINER_CHECKOUT_TIMEOUT", 300))
+
+# Longest a GET /jobs/{job_id}?wait=<seconds> request will wait for a job to finish.
+MAX_JOB_WAIT = 60
+
+# Most test cases a submission may run at the same time inside its container.
+MAX_TEST_CASE_PARALLELISM = int(os.environ.get("LOVELACE_MAX_TEST_CASE_PARALLELISM", 4))
+
+# Seconds each test case may run for before it's killed, unless the problem sets TEST_CASE_TIMEOUT.
+TEST_CASE_TIMEOUT = float(os.environ.get("LOVELACE_TEST_CASE_TIMEOUT", 10))
+
+# File extension of the code files written for each language the engine can run.
+LANGUAGE_EXTENSIONS = {"python": ".py", "javascript": ".js", "julia": ".jl", "c": ".c"}
+
 
 class SubmitResource:
-    def __init__(self):
-        self.pid = os.getpid()
-        # self.container_image = "lovelace-image"
-        container_name = "lovelace-{:d}-{:s}".format(
-            self.pid, datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    def __init__(self, job_queue):
+        # Every problem module is imported up front, before gunicorn forks its workers when it's
+        # started with --preload, and reloaded when its file changes.
+        self.problem_registry = ProblemRegistry(resource_dir=os.path.join(cwd, "..", "resources"))
+        self.problem_registry.load_all()
+
+        # Problem resources are shared with the containers through a read-only docker volume if the
+        # engine has been given one, otherwise they're pushed into the container for every run.
+        resource_dir = os.environ.get("LOVELACE_RESOURCE_DIR")
+        if resource_dir:
+            self.resource_store = ResourceStore(
+                resource_dir,
+                volume=os.environ.get("LOVELACE_RESOURCE_VOLUME", "lovelace-resources"),
+                max_bytes=int(os.environ.get("LOVELACE_RESOURCE_CACHE_MB", 256)) * 1024 * 1024,
+            )
+        else:
+            self.resource_store = None
+
+        # Submissions run in docker containers unless LOVELACE_SANDBOX=local, which runs trusted
+        # code like our own solutions and the tests as plain processes without needing docker.
+        self.sandbox = sandbox_from_env(self.resource_store)
+        self.sandbox.prepare()
+
+        # Start a pool of containers to share between all submissions. Each submission gets a
+        # container to itself so submissions can run concurrently.
+        self.container_pool = ContainerPool(
+            size=int(os.environ.get("LOVELACE_CONTAINER_POOL_SIZE", 2)),
+            max_runs=int(os.environ.get("LOVELACE_CONTAINER_MAX_RUNS", 100)),
+            max_age=int(os.environ.get("LOVELACE_CONTAINER_MAX_AGE", 3600)),
+            sandbox=self.sandbox,
+        )
+        self.container_pool.start()
+
+        atexit.register(self.container_pool.shutdown)
+
+        # C code is compiled for the compile cache in containers of its own that never run any
+        # submissions, so nothing a submission does can end up in a library cached for others.
+        self.compile_pool = ContainerPool(
+            size=int(os.environ.get("LOVELACE_COMPILE_POOL_SIZE", 1)),
+            max_runs=int(os.environ.get("LOVELACE_CONTAINER_MAX_RUNS", 100)),
+            max_age=int(os.environ.get("LOVELACE_CONTAINER_MAX_AGE", 3600)),
+            sandbox=self.sandbox,
+            name="lovelace-compile",
         )
+        self.compile_pool.start()
 
-        # Start a container to use for all submissions
-        # TODO this container_name might not be unique!
-        self.container_id, self.container_name = create_docker_container(name=container_name)
-        logger.debug(
-            "Docker container id: {}; name: {}".format(self.container_id, self.container_name)
+        atexit.register(self.compile_pool.shutdown)
+
+        # Test cases are pre-generated in the background so submissions rarely wait on them.
+        self.test_case_cache = TestCaseCache(
+            generate_test_cases,
+            sets_per_problem=int(os.environ.get("LOVELACE_TEST_CASE_SETS", 2)),
+            max_problems=int(os.environ.get("LOVELACE_TEST_CASE_CACHE_PROBLEMS", 64)),
+            discard=delete_dynamic_resources,
+            store_resources=store_dynamic_resources,
         )
 
-        atexit.register(remove_docker_container, self.container_id)
+        # Shared libraries compiled from C submissions are cached so resubmissions skip compiling.
+        self.compile_cache = CompileCache(
+            max_bytes=int(os.environ.get("LOVELACE_COMPILE_CACHE_MB", 64)) * 1024 * 1024
+        )
+
+        # Test cases are generated on these threads while the code is pushed into a container.
+        self.pipeline = concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.environ.get("LOVELACE_PIPELINE_THREADS", 4)),
+            thread_name_prefix="lovelace-pipeline",
+        )
+
+        # Results of identical resubmissions are returned without running the code again.
+        self.result_cache = ResultCache(
+            max_entries=int(os.environ.get("LOVELACE_RESULT_CACHE_SIZE", 1024)),
+            cache_dir=os.environ.get("LOVELACE_RESULT_CACHE_DIR"),
+        )
+
+        # Submissions made with ?async=true are queued up and run in the background.
+        self.job_queue = job_queue
 
     def on_post(self, req, resp):
         payload = req.media
 
+        if req.get_param_as_bool("async"):
+            try:
+                job = self.job_queue.submit(self.submit, payload)
+            except JobQueueFullError:
+                resp_dict = {"error": "Too many submissions are queued up. Please try again later."}
+                set_json_response(resp, falcon.HTTP_503, resp_dict)
+                return
+
+            set_json_response(resp, falcon.HTTP_202, job.to_dict())
+            return
+
+        status, resp_dict = self.submit(payload)
+        set_json_response(resp, status, resp_dict)
+
+    def submit(self, payload):
+        """
+        Run a submission through the whole pipeline: generate test cases, run the user's code in a
+        container and verify its output.
+
+        :param payload: dict with the problem name, the language and the base64 encoded code
+        :return: the falcon HTTP status and the response dict to send back to the user
+        """
+        test_case_details = []
+
+        for event in self.submit_events(payload):
+            if event["event"] == "error":
+                return event["httpStatus"], {"error": event["error"]}
+            elif event["event"] == "testCase":
+                test_case_details.append(event["testCase"])
+            elif event["event"] == "done":
+                resp_dict = {key: value for key, value in event.items() if key != "event"}
+                resp_dict["testCaseDetails"] = test_case_details
+                return falcon.HTTP_200, resp_dict
+
+    def submit_events(self, payload, stream=False):
+        """
+        Run a submission through the whole pipeline, yielding events as it goes: "start" once the test
+        cases are ready, "testCase" with the details of each test case once it's verified, then "done"
+        with the verdict. If anything goes wrong an "error" event is yielded and nothing follows it.
+
+        :param payload: dict with the problem name, the language and the base64 encoded code
+        :param stream: verify each test case as soon as the container reports its output rather than
+            once the whole run has finished
+        :return: a generator of event dicts
+        """
+        events = self._submit_events(payload, stream)
+        problem_name = None
+
+        try:
+            for event in events:
+                # The problem is only known to exist once the test cases are ready.
+                if event["event"] == "start":
+                    problem_name = payload["problem"].replace("-", "_")
+                elif event["event"] == "error":
+                    count_submission(payload["language"], problem_name, "error")
+                elif event["event"] == "done":
+                    outcome = "passed" if event["success"] else "failed"
+                    count_submission(payload["language"], problem_name, outcome)
+
+                yield event
+        finally:
+            events.close()
+
+    def _submit_events(self, payload, stream=False):
         code = payload["code"]
         language = payload["language"]
 
         if not code:
-            resp_dict = {"error": "No code provided!"}
-            resp.status = falcon.HTTP_400
-            resp.set_header("Access-Control-Allow-Origin", "*")
-            resp.body = json.dumps(resp_dict)
+            yield error_event(falcon.HTTP_400, {"error": "No code provided!"})
             return
 
         code_filename = write_code_to_file(code, language)
 
         try:
-            # Fetch problem ID and load the correct problem module.
-            problem_name = payload["problem"].replace("-", "_")
-            problem_module = "problems.{:s}".format(problem_name)
-
-            logger.debug(
-                "Importing problem_name={:s} problem_module={:s}...".format(
-                    problem_name, problem_module
-                )
-            )
-
-            problems = importlib.import_module("problems")
-            problem = importlib.import_module(problem_module)
+            with time_stage("problem_import"):
+                registered_problem = self.problem_registry.get(payload["problem"])
         except Exception:
             explanation = (
-                "Could not import module {:s}. "
+                "Could not import problem module for {:}. "
                 "Returning HTTP 400 Bad Request due to possibly invalid JSON.".format(
-                    problem_module
+                    payload.get("problem")
                 )
             )
-            add_error_to_response(
-                resp, explanation, traceback.format_exc(), falcon.HTTP_400, code_filename
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_400, code_filename)
             )
             return
 
-        function_name = problem.FUNCTION_NAME
-        problem_dir = problem_name
+        problem_name = registered_problem.name
+        problems = registered_problem.package
+        problem = registered_problem.module
+        function_name = registered_problem.function_name
 
-        # Copy static resources into engine directory and push them into the Linux container.
-        static_resources = []
-        for resource_file_name in problem.STATIC_RESOURCES:
-            from_path = os.path.join(cwd, "..", "resources", problem_dir, resource_file_name)
-            to_path = os.path.join(cwd, resource_file_name)
+        try:
+            parallelism = test_case_parallelism(payload, problem)
+        except (TypeError, ValueError):
+            explanation = "Invalid parallelism {!r}. Returning falcon HTTP 400.".format(
+                payload.get("parallelism")
+            )
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_400, code_filename)
+            )
+            return
 
-            logger.debug("Copying static resource from {:s} to {:s}".format(from_path, to_path))
+        try:
+            profile = resource_profile(problem, language)
+        except TypeError:
+            explanation = "Invalid resource profile for {:s}. Returning falcon HTTP 500.".format(
+                problem_name
+            )
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_500, code_filename)
+            )
+            return
 
-            try:
-                shutil.copyfile(from_path, to_path)
-            except Exception:
-                explanation = "Engine failed to copy a static resource. Returning falcon HTTP 500."
-                add_error_to_response(
-                    resp, explanation, traceback.format_exc(), falcon.HTTP_500, code_filename
+        # Generating the test cases doesn't depend on the code, so it's done while the code and the
+        # static resources are pushed into a container. Only the test case files are pushed last.
+        test_case_set_future = self.pipeline.submit(
+            self.generate_test_case_set, problem_name, problem, registered_problem.hash
+        )
+
+        try:
+            with time_stage("copy_resources"):
+                static_resources = copy_static_resources(
+                    problem_name, registered_problem.static_resource_paths, self.resource_store
                 )
-                return
+        except Exception:
+            discard_test_case_set(problem_name, test_case_set_future)
+            explanation = "Engine failed to copy a static resource. Returning falcon HTTP 500."
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_500, code_filename)
+            )
+            return
 
-            static_resources.append(to_path)
+        # The test case cache usually has a set ready, so an identical resubmission can often be
+        # answered without checking out a container at all.
+        if test_case_set_future.done() and test_case_set_future.exception() is None:
+            test_case_set = test_case_set_future.result()
+            result_key = self.result_cache.key(problem_name, language, code, test_case_set.id)
+            resp_dict = self.result_cache.get(result_key)
+            if resp_dict is not None:
+                yield {"event": "start", "numTestCases": len(test_case_set.test_cases)}
+                yield from memoized_events(problem_name, test_case_set, resp_dict, code_filename)
+                return
 
-            container_path = "/root/{:}".format(resource_file_name)
-            logger.debug(
-                "Pushing static resource to container {:}{:}".format(
-                    self.container_id, container_path
+        try:
+            with time_stage("checkout"):
+                container = self.container_pool.checkout(
+                    timeout=CONTAINER_CHECKOUT_TIMEOUT, profile=profile
                 )
+        except ContainerPoolTimeoutError:
+            discard_test_case_set(problem_name, test_case_set_future)
+            explanation = "The engine is too busy to run your code right now. Returning falcon HTTP 503."
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_503, code_filename)
             )
-            _ = docker_file_push(self.container_id, from_path, container_path)
+            return
 
-        if not problem.STATIC_RESOURCES:
-            logger.debug("No static resources to push")
+        runner = CodeRunner(
+            language,
+            compile_cache=self.compile_cache,
+            compile_pool=self.compile_pool,
+            parallelism=parallelism,
+            test_case_timeout=test_case_timeout(problem),
+            profile=profile,
+            sandbox=self.sandbox,
+        )
 
-        logger.info("Generating test cases...")
-        test_cases = []
+        # The test case set whose dynamic resources the run is using, released once it's done.
+        used_test_case_set, digests = None, []
+
+        # If the run ends before the dynamic resources of the test case set are copied, they're
+        # cleaned up here instead.
+        discard_test_cases = True
+
+        # Dynamic resources and user generated files have the same names in every run of a problem,
+        # so each run keeps its own in a scratch directory.
+        work_dir = make_work_dir(code_filename)
 
         try:
-            for i, test_type in enumerate(problem.TestCaseType):
-                for j in range(test_type.multiplicity):
-                    logger.debug(
-                        "Generating test case {:d}: {:s} ({:d}/{:d})...".format(
-                            len(test_cases) + 1, str(test_type), j + 1, test_type.multiplicity
-                        )
-                    )
-                    test_cases.append(problem.generate_test_case(test_type))
-        except Exception:
-            explanation = "Engine failed to generate a test case. Returning falcon HTTP 500."
-            add_error_to_response(
-                resp, explanation, traceback.format_exc(), falcon.HTTP_500, code_filename
-            )
-            return
+            runner.push_code(container.id, code_filename, function_name, static_resources)
 
-        # Copy over all the dynamic resources generated by the test cases.
-        dynamic_resources = []
-        for i, tc in enumerate(test_cases):
-            if "DYNAMIC_RESOURCES" in tc.input:
-                for dynamic_resource_filename in tc.input["DYNAMIC_RESOURCES"]:
-                    resource_path = os.path.join(
-                        cwd, "..", "resources", problem_dir, dynamic_resource_filename
+            try:
+                test_case_set = test_case_set_future.result()
+            except Exception:
+                discard_test_cases = False
+                explanation = "Engine failed to generate a test case. Returning falcon HTTP 500."
+                yield error_event(
+                    *error_response(
+                        explanation, traceback.format_exc(), falcon.HTTP_500, code_filename
                     )
-                    destination_path = os.path.join(cwd, dynamic_resource_filename)
+                )
+                return
 
-                    logger.debug(
-                        "Copying test case resource from {:s} to {:s}...".format(
-                            resource_path, destination_path
-                        )
-                    )
+            test_cases = test_case_set.test_cases
+
+            yield {"event": "start", "numTestCases": len(test_cases)}
+
+            # Identical code already run against identical test cases gets the same verdict.
+            result_key = self.result_cache.key(problem_name, language, code, test_case_set.id)
+            resp_dict = self.result_cache.get(result_key)
+            if resp_dict is not None:
+                discard_test_cases = False
+                yield from memoized_events(problem_name, test_case_set, resp_dict, code_filename)
+                return
+
+            discard_test_cases = False
+            used_test_case_set = test_case_set
+            with time_stage("copy_resources"):
+                dynamic_resources_to_push, digests = copy_dynamic_resources(
+                    test_case_set, work_dir, self.resource_store
+                )
+
+            input_tuples = [tc.input_tuple() for tc in test_cases]
+            output_tuples = [tc.output_tuple() for tc in test_cases]
+
+            # User generated files can only be pulled out and checked once the code has finished
+            # running.
+            user_generates_files = any("USER_GENERATED_FILES" in tc.output for tc in test_cases)
+
+            test_case_details = [None] * len(test_cases)
+
+            # The code and static resources are already in the container, so only the test cases and
+            # dynamic resources are left to push.
+            if stream and not user_generates_files:
+                results = runner.run_stream(
+                    container.id,
+                    code_filename,
+                    function_name,
+                    input_tuples,
+                    output_tuples,
+                    resource_files=dynamic_resources_to_push,
+                    runner_address=container.runner_address,
+                    code_pushed=True,
+                )
+                # Each test case is verified as soon as its output comes in.
+                batches = (([i], [user_output], [p_info]) for i, user_output, p_info in results)
+            else:
+                user_outputs, p_infos = runner.run(
+                    container.id,
+                    code_filename,
+                    function_name,
+                    input_tuples,
+                    output_tuples,
+                    resource_files=dynamic_resources_to_push,
+                    runner_address=container.runner_address,
+                    code_pushed=True,
+                )
+
+                pull_user_generated_files(self.sandbox, container, test_cases, work_dir)
+
+                # Verifying the outputs doesn't need the container so let someone else have it.
+                self.container_pool.checkin(container)
+                container = None
 
-                    shutil.copyfile(resource_path, destination_path)
+                # All the outputs are in so they're verified together in one batch.
+                batches = [(list(range(len(test_cases))), user_outputs, p_infos)]
 
-                    dynamic_resources.append(resource_path)
-                    dynamic_resources.append(destination_path)
+            # Streamed test cases are verified one at a time as the run goes on, so the verify stage
+            # is the total time spent verifying them.
+            verify_time = 0
 
-                    container_path = "/root/{:}".format(dynamic_resource_filename)
-                    logger.debug(
-                        "Pushing dynamic resource to container {:}{:}".format(
-                            self.container_id, container_path
+            for indices, batch_outputs, batch_p_infos in batches:
+                t1 = time.perf_counter()
+                try:
+                    batch_details = verify_test_cases(
+                        problems,
+                        problem,
+                        [test_cases[i] for i in indices],
+                        batch_outputs,
+                        batch_p_infos,
+                        work_dir,
+                    )
+                except Exception:
+                    explanation = "Internal engine error during user test case verification. Returning falcon HTTP 500."
+                    yield error_event(
+                        *error_response(
+                            explanation, traceback.format_exc(), falcon.HTTP_500, code_filename
                         )
                     )
-                    _ = docker_file_push(self.container_id, resource_path, container_path)
+                    return
+                verify_time += time.perf_counter() - t1
 
-        if not dynamic_resources:
-            logger.debug("No dynamic resources to push")
+                for i, details in zip(indices, batch_details):
+                    test_case_details[i] = details
+                    yield {"event": "testCase", "index": i, "testCase": details}
 
-        runner = CodeRunner(language)
+            STAGE_DURATION.observe(verify_time, stage="verify")
 
-        input_tuples = [tc.input_tuple() for tc in test_cases]
-        output_tuples = [tc.output_tuple() for tc in test_cases]
-        try:
-            user_outputs, p_infos = runner.run(
-                self.container_name, code_filename, function_name, input_tuples, output_tuples
-            )
-        except (FilePushError, FilePullError):
+        except (FilePushError, FilePullError, SandboxError):
             explanation = "File could not be pushed to or pulled from docker container. Returning falcon HTTP 500."
-            add_error_to_response(
-                resp, explanation, traceback.format_exc(), falcon.HTTP_500, code_filename
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_500, code_filename)
             )
             return
 
@@ -193,112 +448,356 @@ class SubmitResource:
                 "Return code from executing user code in docker container is nonzero. "
                 "Returning falcon HTTP 400."
             )
-            add_error_to_response(
-                resp, explanation, traceback.format_exc(), falcon.HTTP_400, code_filename
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_400, code_filename)
             )
             return
 
-        # Pull any user generated files.
-        files_pulled = False
-        for i, tc in enumerate(test_cases):
-            if "USER_GENERATED_FILES" in tc.output:
-                for user_generated_filename in tc.output["USER_GENERATED_FILES"]:
-                    container_filepath = "/root/{:s}".format(user_generated_filename)
+        except EngineTimeoutError:
+            explanation = "User code took too long to run in docker container. Returning falcon HTTP 400."
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_400, code_filename)
+            )
+            return
 
-                    logger.debug(
-                        "Pulling user generated file from container {:s}{:s}".format(
-                            self.container_name, container_filepath
-                        )
-                    )
+        except ContainerPoolTimeoutError:
+            explanation = "The engine is too busy to compile your code right now. Returning falcon HTTP 503."
+            yield error_event(
+                *error_response(explanation, traceback.format_exc(), falcon.HTTP_503, code_filename)
+            )
+            return
+
+        except GeneratorExit:
+            # The client went away before we were done streaming results to them.
+            util.delete_file(code_filename)
+            raise
+
+        finally:
+            if container is not None:
+                self.container_pool.checkin(container)
+            if discard_test_cases:
+                discard_test_case_set(problem_name, test_case_set_future)
+            if used_test_case_set is not None:
+                self.release_dynamic_resources(problem_name, used_test_case_set, digests)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        resp_dict = summarize_test_cases(test_case_details)
+
+        util.delete_file(code_filename)
+        logger.debug("User code file deleted: {:s}".format(code_filename))
+
+        # How long test cases take depends on how busy the engine is, so timeouts aren't memoized.
+        if not any_timed_out(resp_dict):
+            self.result_cache.put(result_key, resp_dict)
+
+        yield done_event(resp_dict)
+
+    def generate_test_case_set(self, problem_name, problem, problem_hash):
+        with time_stage("generate_test_cases"):
+            return self.test_case_cache.get(problem_name, problem, problem_hash)
+
+    def release_dynamic_resources(self, problem_name, test_case_set, digests):
+        """Clean up the dynamic resources of a run's test case set once it's done with them."""
+        delete_dynamic_resources(problem_name, test_case_set)
+        if self.resource_store is not None:
+            self.resource_store.release_dynamic_resources(digests)
+
+    def submit_batch(self, payloads):
+        """
+        Run many submissions. Submissions are grouped by problem so test cases are generated once per
+        problem, and all the submissions in a language are run together in one container round trip.
 
-                    _ = docker_file_pull(
-                        self.container_id, container_filepath, user_generated_filename
+        :param payloads: list of dicts with the problem name, the language and the base64 encoded code
+        :return: list of (falcon HTTP status, response dict) tuples, one per submission
+        """
+        results = [None] * len(payloads)
+        problem_groups = collections.OrderedDict()
+
+        for i, payload in enumerate(payloads):
+            if not payload.get("code"):
+                results[i] = (falcon.HTTP_400, {"error": "No code provided!"})
+            else:
+                problem_groups.setdefault(payload["problem"], []).append(i)
+
+        for problem_name, indices in problem_groups.items():
+            group_results = self._submit_problem_group(problem_name, [payloads[i] for i in indices])
+            for i, result in zip(indices, group_results):
+                results[i] = result
+
+        for payload, (status, resp_dict) in zip(payloads, results):
+            if status == falcon.HTTP_200:
+                outcome = "passed" if resp_dict["success"] else "failed"
+                count_submission(payload["language"], payload["problem"].replace("-", "_"), outcome)
+            else:
+                count_submission(payload["language"], None, "error")
+
+        return results
+
+    def _submit_problem_group(self, problem_name, payloads):
+        code_filenames = [write_code_to_file(p["code"], p["language"]) for p in payloads]
+        results = [None] * len(payloads)
+
+        def fail_all(explanation, falcon_http_error_code, indices=range(len(payloads))):
+            tb = traceback.format_exc()
+            for i in indices:
+                if results[i] is None:
+                    results[i] = error_response(
+                        explanation, tb, falcon_http_error_code, code_filenames[i]
                     )
-                    files_pulled = True
-
-        if not files_pulled:
-            logger.debug("No user generated files to pull")
-
-        n_cases = len(test_cases)
-        n_passes = 0  # Number of test cases passed.
-        test_case_details = (
-            []
-        )  # List of dicts each containing the details of a particular test case.
-
-        # Verify that user outputs are all correct (i.e. check whether each test case passes or fails).
-        for input_tuple, user_output, p_info, tc in zip(
-            input_tuples, user_outputs, p_infos, test_cases
-        ):
-
-            if isinstance(user_output, list):
-                # user_output is a list. This could be a multiple-return, or a legitimate list return.
-                # Here we will disambiguate dependant on the output variables the problem requires
-                if len(problem.OUTPUT_VARS) == 1:
-                    # Only one variable should be returned; Thus, this is a "list return"
-                    user_output = (user_output,)
-                else:
-                    # More than one variable should be returned, so this is a multiple return
-                    user_output = tuple(user_output)
-
-            if user_output[0] is None:
-                logger.debug(
-                    "Looks like user's function returned None: output={:}".format(user_output)
+            return results
+
+        try:
+            with time_stage("problem_import"):
+                registered_problem = self.problem_registry.get(problem_name)
+        except Exception:
+            explanation = (
+                "Could not import problem module for {:}. "
+                "Returning HTTP 400 Bad Request due to possibly invalid JSON.".format(problem_name)
+            )
+            return fail_all(explanation, falcon.HTTP_400)
+
+        problem_name = registered_problem.name
+        problems = registered_problem.package
+        problem = registered_problem.module
+        function_name = registered_problem.function_name
+
+        try:
+            with time_stage("copy_resources"):
+                static_resources = copy_static_resources(
+                    problem_name, registered_problem.static_resource_paths, self.resource_store
+                )
+        except Exception:
+            explanation = "Engine failed to copy a static resource. Returning falcon HTTP 500."
+            return fail_all(explanation, falcon.HTTP_500)
+
+        try:
+            with time_stage("generate_test_cases"):
+                test_case_set = self.test_case_cache.get(
+                    problem_name, problem, registered_problem.hash
                 )
-                passed = False
-                expected_output = "Your function returned None. It shouldn't do that."
+        except Exception:
+            explanation = "Engine failed to generate a test case. Returning falcon HTTP 500."
+            return fail_all(explanation, falcon.HTTP_500)
+
+        test_cases = test_case_set.test_cases
+
+        result_keys = [
+            self.result_cache.key(problem_name, p["language"], p["code"], test_case_set.id)
+            for p in payloads
+        ]
+
+        language_groups = collections.OrderedDict()
+        for i, (payload, result_key) in enumerate(zip(payloads, result_keys)):
+            resp_dict = self.result_cache.get(result_key)
+            if resp_dict is not None:
+                util.delete_file(code_filenames[i])
+                results[i] = (falcon.HTTP_200, resp_dict)
             else:
+                language_groups.setdefault(payload["language"], []).append(i)
+
+        if not language_groups:
+            delete_dynamic_resources(problem_name, test_case_set)
+            return results
+
+        # The chunks below run one after the other, so they can share one scratch directory.
+        work_dir = make_work_dir(code_filenames[0])
+
+        try:
+            with time_stage("copy_resources"):
+                dynamic_resources_to_push, digests = copy_dynamic_resources(
+                    test_case_set, work_dir, self.resource_store
+                )
+        except Exception:
+            delete_dynamic_resources(problem_name, test_case_set)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+        input_tuples = [tc.input_tuple() for tc in test_cases]
+        output_tuples = [tc.output_tuple() for tc in test_cases]
+
+        # User generated files all have the same name so those submissions must be run and verified
+        # one at a time.
+        user_generated_files = sorted(
+            {f for tc in test_cases for f in tc.output.get("USER_GENERATED_FILES", [])}
+        )
+        user_generates_files = bool(user_generated_files)
+
+        chunks = []
+        for language, indices in language_groups.items():
+            if user_generates_files:
+                chunks += [(language, [i]) for i in indices]
+            else:
+                chunks.append((language, indices))
+
+        # Languages with the same resource profile share a container.
+        containers = {}
+
+        try:
+            for language, indices in chunks:
                 try:
-                    user_test_case = problem.ProblemTestCase(None, problem.INPUT_VARS, input_tuple, problem.OUTPUT_VARS, user_output)
-                    passed, correct_test_case = problems.test_case.test_case_solution_correct(tc, user_test_case, problem.ATOL, problem.RTOL)
-                    expected_output = correct_test_case.output_tuple()
-                except Exception:
-                    explanation = "Internal engine error during user test case verification. Returning falcon HTTP 500."
-                    add_error_to_response(
-                        resp, explanation, traceback.format_exc(), falcon.HTTP_500, code_filename
+                    profile = resource_profile(problem, language)
+                except TypeError:
+                    explanation = "Invalid resource profile for {:s}. Returning falcon HTTP 500.".format(
+                        problem_name
                     )
-                    return
+                    fail_all(explanation, falcon.HTTP_500, indices)
+                    continue
+
+                container = containers.get(profile.container_key)
+                if container is None:
+                    try:
+                        with time_stage("checkout"):
+                            container = self.container_pool.checkout(
+                                timeout=CONTAINER_CHECKOUT_TIMEOUT, profile=profile
+                            )
+                    except ContainerPoolTimeoutError:
+                        explanation = "The engine is too busy to run your code right now. Returning falcon HTTP 503."
+                        fail_all(explanation, falcon.HTTP_503, indices)
+                        continue
+                    containers[profile.container_key] = container
+
+                runner = CodeRunner(
+                    language,
+                    compile_cache=self.compile_cache,
+                    compile_pool=self.compile_pool,
+                    parallelism=test_case_parallelism({}, problem),
+                    test_case_timeout=test_case_timeout(problem),
+                    profile=profile,
+                    sandbox=self.sandbox,
+                )
 
-            if passed:
-                n_passes += 1
+                try:
+                    run_results = runner.run_batch(
+                        container.id,
+                        [code_filenames[i] for i in indices],
+                        function_name,
+                        input_tuples,
+                        output_tuples,
+                        resource_files=dict(static_resources, **dynamic_resources_to_push),
+                        runner_address=container.runner_address,
+                        user_generated_files=user_generated_files,
+                    )
 
-            test_case_details.append(
-                {
-                    "testCaseType": tc.test_type.test_name,
-                    "input": input_tuple,
-                    "output": user_output,
-                    "expected": expected_output,
-                    "inputString": str(input_tuple),
-                    "outputString": str(user_output),
-                    "expectedString": str(expected_output),
-                    "passed": passed,
-                    "processInfo": p_info,
-                }
-            )
+                    if user_generates_files:
+                        pull_user_generated_files(self.sandbox, container, test_cases, work_dir)
+
+                except (FilePushError, FilePullError, SandboxError):
+                    explanation = "File could not be pushed to or pulled from docker container. Returning falcon HTTP 500."
+                    fail_all(explanation, falcon.HTTP_500, indices)
+                    continue
 
-            if "DYNAMIC_RESOURCES" in tc.input:
-                for dynamic_resource_path in dynamic_resources:
-                    logger.debug("Deleting dynamic resource: {:s}".format(dynamic_resource_path))
-                    util.delete_file(dynamic_resource_path)
+                except (EngineExecutionError, EngineTimeoutError):
+                    explanation = "Engine failed to run the batch. Returning falcon HTTP 500."
+                    fail_all(explanation, falcon.HTTP_500, indices)
+                    continue
 
-        logger.info("Passed %d/%d test cases.", n_passes, n_cases)
+                for i, run_result in zip(indices, run_results):
+                    if isinstance(run_result, Exception):
+                        explanation = (
+                            "Return code from executing user code in docker container is nonzero. "
+                            "Returning falcon HTTP 400."
+                        )
+                        tb = "".join(traceback.format_exception_only(type(run_result), run_result))
+                        results[i] = error_response(
+                            explanation, tb, falcon.HTTP_400, code_filenames[i]
+                        )
+                        continue
+
+                    user_outputs, p_infos = run_result
+                    try:
+                        with time_stage("verify"):
+                            resp_dict = verify_user_outputs(
+                                problems, problem, test_cases, user_outputs, p_infos, work_dir
+                            )
+                    except Exception:
+                        explanation = "Internal engine error during user test case verification. Returning falcon HTTP 500."
+                        fail_all(explanation, falcon.HTTP_500, [i])
+                        continue
+
+                    util.delete_file(code_filenames[i])
+                    if not any_timed_out(resp_dict):
+                        self.result_cache.put(result_keys[i], resp_dict)
+                    results[i] = (falcon.HTTP_200, resp_dict)
+
+        finally:
+            for container in containers.values():
+                self.container_pool.checkin(container)
+            self.release_dynamic_resources(problem_name, test_case_set, digests)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return results
+
+
+class BatchSubmitResource:
+    def __init__(self, submit_resource):
+        self.submit_resource = submit_resource
+
+    def on_post(self, req, resp):
+        payloads = req.media
+
+        if not isinstance(payloads, list):
+            resp_dict = {"error": "Expected a list of submissions."}
+            set_json_response(resp, falcon.HTTP_400, resp_dict)
+            return
+
+        results = self.submit_resource.submit_batch(payloads)
 
         resp_dict = {
-            "success": True if n_passes == n_cases else False,
-            "numTestCases": n_cases,
-            "numTestCasesPassed": n_passes,
-            "testCaseDetails": test_case_details,
+            "results": [
+                {"httpStatus": status, "result": result_dict} for status, result_dict in results
+            ]
         }
+        set_json_response(resp, falcon.HTTP_200, resp_dict)
+
+
+class StreamSubmitResource:
+    """
+    Runs a submission and streams back the details of each test case as soon as it's verified.
+
+    Events are sent as newline-delimited JSON, or as server-sent events if the client asks for
+    text/event-stream. Errors that happen before the code runs get a normal JSON error response.
+    """
+
+    def __init__(self, submit_resource):
+        self.submit_resource = submit_resource
+
+    def on_post(self, req, resp):
+        events = self.submit_resource.submit_events(req.media, stream=True)
+
+        first_event = next(events)
+        if first_event["event"] == "error":
+            set_json_response(resp, first_event["httpStatus"], {"error": first_event["error"]})
+            return
+
+        sse = "text/event-stream" in (req.accept or "")
 
         resp.status = falcon.HTTP_200
         resp.set_header("Access-Control-Allow-Origin", "*")
-        resp.body = json.dumps(resp_dict)
+        resp.set_header("Cache-Control", "no-cache")
+        resp.content_type = "text/event-stream" if sse else "application/x-ndjson"
+        resp.stream = (
+            format_event(event, sse) for event in itertools.chain([first_event], events)
+        )
 
-        util.delete_file(code_filename)
-        logger.debug("User code file deleted: {:s}".format(code_filename))
 
-        for file_path in static_resources:
-            logging.debug("Deleting static resource {:s}".format(file_path))
-            util.delete_file(file_path)
+class JobResource:
+    def __init__(self, job_queue):
+        self.job_queue = job_queue
+
+    def on_get(self, req, resp, job_id):
+        job = self.job_queue.get(job_id)
+
+        if not job:
+            resp_dict = {"error": "No job with id {:s}. It may have expired.".format(job_id)}
+            set_json_response(resp, falcon.HTTP_404, resp_dict)
+            return
+
+        # Long-poll: optionally wait for the job to finish before responding.
+        wait = req.get_param_as_float("wait", min_value=0, max_value=MAX_JOB_WAIT)
+        if wait:
+            job.wait(timeout=wait)
+
+        set_json_response(resp, falcon.HTTP_200, job.to_dict())
 
 
 def parse_payload(http_request):
@@ -318,6 +817,411 @@ def parse_payload(http_request):
     return json_payload
 
 
+class ProblemsResource:
+    def __init__(self, submit_resource):
+        self.submit_resource = submit_resource
+
+    def on_get(self, req, resp):
+        problems = self.submit_resource.problem_registry.list()
+        resp_dict = {"problems": [problem.to_dict() for problem in problems]}
+        set_json_response(resp, falcon.HTTP_200, resp_dict)
+
+
+class StatsResource:
+    def __init__(self, submit_resource):
+        self.submit_resource = submit_resource
+
+    def on_get(self, req, resp):
+        resp_dict = {
+            "containerPool": self.submit_resource.container_pool.status(),
+            "compilePool": self.submit_resource.compile_pool.status(),
+            "testCaseCache": self.submit_resource.test_case_cache.stats(),
+            "compileCache": self.submit_resource.compile_cache.stats(),
+            "resultCache": self.submit_resource.result_cache.stats(),
+        }
+        if self.submit_resource.resource_store is not None:
+            resp_dict["resourceStore"] = self.submit_resource.resource_store.stats()
+        set_json_response(resp, falcon.HTTP_200, resp_dict)
+
+
+class MetricsResource:
+    """Serves the engine's metrics in the Prometheus text format for Prometheus to scrape."""
+
+    def __init__(self, submit_resource):
+        self.submit_resource = submit_resource
+        REGISTRY.add_collector(self.collect)
+
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+        resp.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        resp.body = REGISTRY.render()
+
+    def collect(self):
+        """Read the container pool and cache metrics off the stats they already keep."""
+        pool_status = self.submit_resource.container_pool.status()
+
+        caches = {
+            "test_case": self.submit_resource.test_case_cache.stats(),
+            "compile": self.submit_resource.compile_cache.stats(),
+            "result": self.submit_resource.result_cache.stats(),
+        }
+        if self.submit_resource.resource_store is not None:
+            caches["resource"] = self.submit_resource.resource_store.stats()
+
+        def hit_ratio(stats):
+            lookups = stats["hits"] + stats["misses"]
+            return stats["hits"] / lookups if lookups else 0.0
+
+        return [
+            (
+                "lovelace_container_pool_containers",
+                "gauge",
+                "Code runner containers in the pool by state.",
+                [({"state": state}, pool_status[state]) for state in ("idle", "busy")],
+            ),
+            (
+                "lovelace_cache_hits_total",
+                "counter",
+                "Cache lookups that found what they were looking for.",
+                [({"cache": name}, stats["hits"]) for name, stats in caches.items()],
+            ),
+            (
+                "lovelace_cache_misses_total",
+                "counter",
+                "Cache lookups that had to do the work themselves.",
+                [({"cache": name}, stats["misses"]) for name, stats in caches.items()],
+            ),
+            (
+                "lovelace_cache_hit_ratio",
+                "gauge",
+                "Fraction of cache lookups that were hits since the engine started.",
+                [({"cache": name}, hit_ratio(stats)) for name, stats in caches.items()],
+            ),
+        ]
+
+
+def count_submission(language, problem_name, outcome):
+    """
+    Count a finished submission. Anything that isn't a known language or problem is counted as
+    "unknown" so made up names can't blow up the number of metrics.
+    """
+    SUBMISSIONS.inc(
+        language=language if language in LANGUAGE_EXTENSIONS else "unknown",
+        problem=problem_name or "unknown",
+        outcome=outcome,
+    )
+
+
+def test_case_parallelism(payload, problem):
+    """
+    Decide how many test cases of a submission to run at the same time. Submissions can ask for it
+    with a "parallelism" field, otherwise the problem module can set TEST_CASE_PARALLELISM. Test
+    cases are run one at a time by default.
+
+    :raises ValueError, TypeError: if the submission asked for a parallelism that isn't a number
+    """
+    parallelism = payload.get("parallelism") or getattr(problem, "TEST_CASE_PARALLELISM", 1)
+    return max(1, min(int(parallelism), MAX_TEST_CASE_PARALLELISM))
+
+
+def test_case_timeout(problem):
+    """Seconds each test case of the problem may run for before it's killed."""
+    return getattr(problem, "TEST_CASE_TIMEOUT", TEST_CASE_TIMEOUT)
+
+
+def copy_static_resources(problem_name, static_resource_paths, resource_store=None):
+    """
+    Copy static resources into a directory of the problem's own in the engine directory. They are
+    shared by all submissions being run concurrently so they are never deleted, and only copied over
+    again when the problem's resource has been modified since.
+
+    :param static_resource_paths: dict mapping the file name of each static resource to its path
+    :param resource_store: optional ResourceStore to share the resources with the containers through
+    :return: dict of the static resources to push into the container, mapping each file name to
+        its path or to a Symlink to it in the resource store
+    """
+    static_resources = {}
+    for resource_file_name, from_path in static_resource_paths.items():
+        to_path = os.path.join(STATIC_RESOURCE_DIR, problem_name, resource_file_name)
+
+        if not os.path.isfile(to_path) or os.path.getmtime(from_path) > os.path.getmtime(to_path):
+            os.makedirs(os.path.dirname(to_path), exist_ok=True)
+            logger.debug("Copying static resource from {:s} to {:s}".format(from_path, to_path))
+            util.copy_file_atomic(from_path, to_path)
+
+        if resource_store is not None:
+            static_resources[resource_file_name] = Symlink(
+                resource_store.static_resource(problem_name, from_path)
+            )
+        else:
+            static_resources[resource_file_name] = from_path
+
+    return static_resources
+
+
+def make_work_dir(code_filename):
+    """
+    Make a scratch directory for one run, named after the user's code file. It's made in the engine
+    directory so resources can be hard linked into it.
+
+    :return: path of the new directory, to be removed once the run is done
+    """
+    run_id = os.path.splitext(os.path.basename(code_filename))[0]
+    return tempfile.mkdtemp(prefix="{:s}.".format(run_id), dir=cwd)
+
+
+def store_dynamic_resources(problem_name, test_cases):
+    """
+    Move the dynamic resources of a newly generated test case set out of the problem's resource
+    directory, where generating the next set would overwrite them, into a directory of its own.
+
+    :return: the set's resource directory, None if its test cases have no dynamic resources
+    """
+    file_names = {f for tc in test_cases for f in tc.input.get("DYNAMIC_RESOURCES", [])}
+    if not file_names:
+        return None
+
+    os.makedirs(DYNAMIC_RESOURCE_DIR, exist_ok=True)
+    resource_dir = tempfile.mkdtemp(prefix="{:s}.".format(problem_name), dir=DYNAMIC_RESOURCE_DIR)
+
+    for file_name in file_names:
+        resource_path = os.path.join(cwd, "..", "resources", problem_name, file_name)
+        logger.debug("Storing dynamic resource {:s} in {:s}".format(resource_path, resource_dir))
+        shutil.move(resource_path, os.path.join(resource_dir, file_name))
+
+    return resource_dir
+
+
+def copy_dynamic_resources(test_case_set, work_dir, resource_store=None):
+    """
+    Link all the dynamic resources of a test case set into the run's scratch directory.
+
+    :param work_dir: the run's scratch directory, see make_work_dir
+    :param resource_store: optional ResourceStore to share the resources with the containers through
+    :return: dict of the dynamic resources to push into the container like copy_static_resources
+        returns, and the digests of the resources acquired from the resource store
+    """
+    dynamic_resources_to_push = {}
+    digests = []
+    for tc in test_case_set.test_cases:
+        for dynamic_resource_filename in tc.input.get("DYNAMIC_RESOURCES", []):
+            resource_path = os.path.join(test_case_set.resource_dir, dynamic_resource_filename)
+            destination_path = os.path.join(work_dir, dynamic_resource_filename)
+
+            logger.debug(
+                "Linking test case resource from {:s} to {:s}...".format(
+                    resource_path, destination_path
+                )
+            )
+
+            util.link_file(resource_path, destination_path)
+
+            if resource_store is not None:
+                digest, store_path = resource_store.acquire_dynamic_resource(resource_path)
+                digests.append(digest)
+                dynamic_resources_to_push[dynamic_resource_filename] = Symlink(store_path)
+            else:
+                dynamic_resources_to_push[dynamic_resource_filename] = resource_path
+
+    return dynamic_resources_to_push, digests
+
+
+def pull_user_generated_files(sandbox, container, test_cases, work_dir):
+    """Pull any files the user's code was asked to generate out of the container into work_dir."""
+    files_pulled = False
+    for i, tc in enumerate(test_cases):
+        if "USER_GENERATED_FILES" in tc.output:
+            for user_generated_filename in tc.output["USER_GENERATED_FILES"]:
+                container_filepath = "/root/{:s}".format(user_generated_filename)
+
+                logger.debug(
+                    "Pulling user generated file from container {:s}{:s}".format(
+                        container.name, container_filepath
+                    )
+                )
+
+                sandbox.pull_file(
+                    container.id,
+                    container_filepath,
+                    os.path.join(work_dir, user_generated_filename),
+                )
+                files_pulled = True
+
+    if not files_pulled:
+        logger.debug("No user generated files to pull")
+
+
+def verify_user_outputs(problems, problem, test_cases, user_outputs, p_infos, work_dir=None):
+    """
+    Verify that user outputs are all correct (i.e. check whether each test case passes or fails).
+
+    :param work_dir: the run's scratch directory with its dynamic resources and user generated files
+    :return: the response dict with the details of every test case
+    """
+    return summarize_test_cases(
+        verify_test_cases(problems, problem, test_cases, user_outputs, p_infos, work_dir)
+    )
+
+
+def verify_test_cases(problems, problem, test_cases, user_outputs, p_infos, work_dir=None):
+    """
+    Check whether the user's outputs for some test cases are correct, all in one batch.
+
+    :param work_dir: the run's scratch directory with its dynamic resources and user generated files
+    :return: list with a dict with the details of each test case
+    """
+    user_outputs = [normalize_user_output(problem, user_output) for user_output in user_outputs]
+
+    # Test cases that timed out or returned None aren't worth checking.
+    to_verify = [
+        None if p_info["timed_out"] or user_output[0] is None else user_output
+        for user_output, p_info in zip(user_outputs, p_infos)
+    ]
+    verified = verify_batch(problems, problem, test_cases, to_verify, work_dir)
+
+    test_case_details = []
+    for tc, user_output, p_info, result in zip(test_cases, user_outputs, p_infos, verified):
+        input_tuple = tc.input_tuple()
+        max_error = None
+
+        if p_info["timed_out"]:
+            logger.debug("User's code timed out after {:}s".format(p_info["runtime"]))
+            expected_output = tc.output_tuple()
+            test_case_details.append(
+                {
+                    "testCaseType": tc.test_type.test_name,
+                    "input": input_tuple,
+                    "output": None,
+                    "expected": expected_output,
+                    "inputString": str(input_tuple),
+                    "outputString": "Your code took too long to run this test case.",
+                    "expectedString": str(expected_output),
+                    "passed": False,
+                    "timedOut": True,
+                    "maxError": None,
+                    "processInfo": p_info,
+                }
+            )
+            continue
+
+        if result is None:
+            logger.debug("Looks like user's function returned None: output={:}".format(user_output))
+            passed = False
+            expected_output = "Your function returned None. It shouldn't do that."
+        else:
+            passed, expected_output, max_error = result
+
+        test_case_details.append(
+            {
+                "testCaseType": tc.test_type.test_name,
+                "input": input_tuple,
+                "output": user_output,
+                "expected": expected_output,
+                "inputString": str(input_tuple),
+                "outputString": str(user_output),
+                "expectedString": str(expected_output),
+                "passed": passed,
+                "timedOut": False,
+                "maxError": max_error,
+                "processInfo": p_info,
+            }
+        )
+
+    return test_case_details
+
+
+def normalize_user_output(problem, user_output):
+    """Turn what the user's function returned into a tuple with a value for each output variable."""
+    if isinstance(user_output, list):
+        # user_output is a list. This could be a multiple-return, or a legitimate list return.
+        # Here we will disambiguate dependant on the output variables the problem requires
+        if len(problem.OUTPUT_VARS) == 1:
+            # Only one variable should be returned; Thus, this is a "list return"
+            return (user_output,)
+        else:
+            # More than one variable should be returned, so this is a multiple return
+            return tuple(user_output)
+    return user_output
+
+
+def memoized_events(problem_name, test_case_set, resp_dict, code_filename):
+    """Events for a submission whose result was memoized, following its "start" event."""
+    logger.info("Returning memoized result for test case set {:s}".format(test_case_set.id))
+    delete_dynamic_resources(problem_name, test_case_set)
+    util.delete_file(code_filename)
+    for i, details in enumerate(resp_dict["testCaseDetails"]):
+        yield {"event": "testCase", "index": i, "testCase": details}
+    yield done_event(resp_dict)
+
+
+def summarize_test_cases(test_case_details):
+    """Build the response dict for a submission from the details of each of its test cases."""
+    n_cases = len(test_case_details)
+    n_passes = sum(1 for details in test_case_details if details["passed"])
+
+    logger.info("Passed %d/%d test cases.", n_passes, n_cases)
+
+    return {
+        "success": True if n_passes == n_cases else False,
+        "numTestCases": n_cases,
+        "numTestCasesPassed": n_passes,
+        "testCaseDetails": test_case_details,
+    }
+
+
+def any_timed_out(resp_dict):
+    return any(details["timedOut"] for details in resp_dict["testCaseDetails"])
+
+
+def delete_files(file_paths):
+    for file_path in file_paths:
+        logger.debug("Deleting file: {:s}".format(file_path))
+        util.delete_file(file_path)
+
+
+def generate_test_cases(problem):
+    """Generate every test case for a problem module, multiplicity times for each test case type."""
+    logger.info("Generating test cases...")
+    test_cases = []
+
+    for i, test_type in enumerate(problem.TestCaseType):
+        for j in range(test_type.multiplicity):
+            logger.debug(
+                "Generating test case {:d}: {:s} ({:d}/{:d})...".format(
+                    len(test_cases) + 1, str(test_type), j + 1, test_type.multiplicity
+                )
+            )
+            test_cases.append(problem.generate_test_case(test_type))
+
+    return test_cases
+
+
+def delete_dynamic_resources(problem_name, test_case_set):
+    """Delete the dynamic resources of a test case set once it's been used or won't ever be."""
+    if test_case_set.resource_dir is not None:
+        logger.debug(
+            "Deleting dynamic resources of {:s}: {:s}".format(
+                problem_name, test_case_set.resource_dir
+            )
+        )
+        shutil.rmtree(test_case_set.resource_dir, ignore_errors=True)
+
+
+def discard_test_case_set(problem_name, test_case_set_future):
+    """
+    Clean up a test case set being generated for a run that ended before using it: it's cancelled if
+    generating it hasn't started yet, otherwise its dynamic resources are deleted once it's done.
+    """
+    if test_case_set_future.cancel():
+        return
+
+    def delete(future):
+        if future.exception() is None:
+            delete_dynamic_resources(problem_name, future.result())
+
+    test_case_set_future.add_done_callback(delete)
+
+
 def write_code_to_file(code, language):
     """
     Write code into a file with the appropriate file extension.
@@ -327,7 +1231,7 @@ def write_code_to_file(code, language):
     :return: the name of the file containing the user's code
     """
     decoded_code = str(base64.b64decode(code), "utf-8")
-    extension = {"python": ".py", "javascript": ".js", "julia": ".jl", "c": ".c"}.get(language)
+    extension = LANGUAGE_EXTENSIONS.get(language)
     code_filename = util.write_str_to_file(decoded_code, extension)
 
     logger.debug("User code saved in: {:s}".format(code_filename))
@@ -335,17 +1239,16 @@ def write_code_to_file(code, language):
     return code_filename
 
 
-def add_error_to_response(resp, explanation, tb, falcon_http_error_code, code_filename):
+def error_response(explanation, tb, falcon_http_error_code, code_filename):
     """
-    Modify the falcon HTTP response object with an error to be shown to the user. Also deletes the user's code as the
-    engine cannot run it.
+    Build an error response to be shown to the user. Also deletes the user's code as the engine cannot
+    run it.
 
-    :param resp: The falcon HTTP response object to be modified.
     :param explanation: A human-friendly explanation of the error.
     :param tb: Traceback string.
     :param falcon_http_error_code: Falcon HTTP error code to return.
     :param code_filename: Filepath to user code to be deleted.
-    :return: nothing
+    :return: the falcon HTTP error code and the response dict
     """
     logger.error(explanation)
     logger.error(tb)
@@ -372,13 +1275,49 @@ def add_error_to_response(resp, explanation, tb, falcon_http_error_code, code_fi
     error_message = "{:s}\n\n{:s}\n\nError: {:}".format(explanation, NOTICE, tb)
     resp_dict = {"error": error_message}
 
-    resp.status = falcon_http_error_code
+    return falcon_http_error_code, resp_dict
+
+
+def set_json_response(resp, falcon_http_code, resp_dict):
+    """Fill in the falcon HTTP response object with a JSON body."""
+    resp.status = falcon_http_code
     resp.set_header("Access-Control-Allow-Origin", "*")
     resp.body = json.dumps(resp_dict)
-    return
 
 
-docker_init()
+def error_event(falcon_http_error_code, resp_dict):
+    return {"event": "error", "httpStatus": falcon_http_error_code, "error": resp_dict["error"]}
+
+
+def done_event(resp_dict):
+    return {
+        "event": "done",
+        "success": resp_dict["success"],
+        "numTestCases": resp_dict["numTestCases"],
+        "numTestCasesPassed": resp_dict["numTestCasesPassed"],
+    }
+
+
+def format_event(event, sse=False):
+    """Encode an event as a server-sent event or as a line of newline-delimited JSON."""
+    if sse:
+        return "event: {:s}\ndata: {:s}\n\n".format(event["event"], json.dumps(event)).encode()
+    return (json.dumps(event) + "\n").encode()
+
+
+job_queue = JobQueue(
+    max_size=int(os.environ.get("LOVELACE_JOB_QUEUE_SIZE", 100)),
+    n_workers=int(
+        os.environ.get("LOVELACE_JOB_WORKERS", os.environ.get("LOVELACE_CONTAINER_POOL_SIZE", 2))
+    ),
+)
+submit_resource = SubmitResource(job_queue)
 app = falcon.API()
-app.add_route("/submit", SubmitResource())
+app.add_route("/submit", submit_resource)
+app.add_route("/submit/batch", BatchSubmitResource(submit_resource))
+app.add_route("/submit/stream", StreamSubmitResource(submit_resource))
+app.add_route("/jobs/{job_id}", JobResource(job_queue))
+app.add_route("/problems", ProblemsResource(submit_resource))
+app.add_route("/stats", StatsResource(submit_resource))
+app.add_route("/metrics", MetricsResource(submit_resource))
 app.add_error_handler(Exception, lambda ex, req, resp, params: logger.exception(ex))
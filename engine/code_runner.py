@@ -1,17 +1,16 @@
-import fileinput
 import json
 import logging
-import pickle
-import shutil
-import subprocess
-from subprocess import CalledProcessError
+import os
+import time
+import uuid
 from abc import ABCMeta, abstractmethod
 
-import docker
-import numpy as np
-
 import engine.util as util
-from engine.docker_util import docker_file_push, docker_file_pull, docker_execute
+from engine.metrics import STAGE_DURATION, time_stage
+from engine.resource_profiles import DEFAULT_PROFILE
+from engine.runner_client import runner_execute, runner_execute_stream, RunnerUnavailableError
+from engine.sandbox import DockerSandbox, SandboxError
+from engine.wire_format import encode, decode, WireFormatError
 
 
 logger = logging.getLogger(__name__)
@@ -39,155 +38,604 @@ class EngineTimeoutError(Exception):
 
 class AbstractRunner(metaclass=ABCMeta):
     @abstractmethod
-    def run(self, container_name, filename, function_name, input_tuples, output_tuples):
+    def run(
+        self,
+        container_name,
+        filename,
+        function_name,
+        input_tuples,
+        output_tuples,
+        resource_files=None,
+    ):
         """Execute the given file using input_str as input through stdin and return the program's output."""
 
 
-# In case we need to serialize a numpy.ndarray to JSON.
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
+# Compiler command used to build C submissions into a shared library, minus the output and input file.
+# -fPIC for position-independent code, needed for shared libraries to work no matter where in memory
+# they are loaded. run_c.py uses the same command when it has to compile the code itself.
+C_COMPILE_CMD = ["gcc", "-fPIC", "-shared"]
+
+# Seconds to wait for a container of the compile pool before giving up on compiling.
+COMPILE_CHECKOUT_TIMEOUT = 60
+
+
+def exec_error(exec_retval, exec_stdout):
+    """Build the exception to raise for a run script that exited with a nonzero return code."""
+    # The `timeout` Linux command exits with return code 124 if the command times out.
+    if exec_retval == 124:
+        return EngineTimeoutError("Your code took too long to run.")
+    else:
+        return EngineExecutionError(exec_stdout)
+
+
+def decode_output(data):
+    """
+    Decode the output file of a test case. The run script writing it ran alongside the user's code so
+    it can't be trusted to be well formed.
+
+    :raises EngineExecutionError: if it isn't
+    """
+    try:
+        output_dict = decode(data)
+        if not isinstance(output_dict, dict):
+            raise WireFormatError("Expected a dict, got {:}".format(type(output_dict)))
+    except WireFormatError as e:
+        raise EngineExecutionError("Could not read the output of your code: {}".format(e))
+
+    return output_dict
 
 
 class CodeRunner(AbstractRunner):
-    def __init__(self, language):
-        self.util_files = []
-        self.file_type = "pickle"
+    def __init__(
+        self,
+        language,
+        compile_cache=None,
+        parallelism=1,
+        test_case_timeout=None,
+        profile=None,
+        sandbox=None,
+        compile_pool=None,
+    ):
+        self.language = language
+        self.compile_cache = compile_cache
+        self.compile_pool = compile_pool
+        self.parallelism = parallelism
+        self.test_case_timeout = test_case_timeout
+        self.profile = profile or DEFAULT_PROFILE
+        self.sandbox = sandbox or DockerSandbox()
+        self.util_files = ["harness.py", "wire_format.py"]
         self.push_correct_output = False
 
         if language == "python":
             self.run_script_filename = "run_py.py"
         elif language == "javascript":
             self.run_script_filename = "run_js.py"
+            self.util_files.append("harness.js")
         elif language == "julia":
             self.run_script_filename = "run_jl.py"
-            self.file_type = "json"
         elif language == "c":
             self.run_script_filename = "run_c.py"
             self.push_correct_output = True
         else:
             raise ValueError("CodeRunner does not support language={:}".format(language))
 
-    def run(self, container_id, code_filename, function_name, input_tuples, correct_output_tuples):
+    def run(
+        self,
+        container_id,
+        code_filename,
+        function_name,
+        input_tuples,
+        correct_output_tuples,
+        resource_files=None,
+        runner_address=None,
+        code_pushed=False,
+    ):
+        """
+        Run the user's code on every test case.
+
+        :param code_pushed: whether push_code already pushed everything that doesn't depend on the
+            test cases, so only the test case files and resource_files are left to push
+        :return: the user's output and the process info for each test case
+        """
         logger.info("Running {:s} with {:d} inputs...".format(code_filename, len(input_tuples)))
 
         run_id = code_filename.split(".")[0]
 
-        # Pickle all the input tuples into one file.
-        if self.file_type == "pickle":
-            input_pickle = "{:s}.input.pickle".format(run_id)
-            with open(input_pickle, mode="wb") as f:
-                logger.debug("Pickling input tuples in {:s}...".format(input_pickle))
-                pickle.dump(input_tuples, file=f, protocol=pickle.HIGHEST_PROTOCOL)
-        elif self.file_type == "json":
-            input_pickle = "{:s}.input.json".format(run_id)
-            with open(input_pickle, mode="w") as f:
-                logger.debug("Pickling input tuples in {:s}...".format(input_pickle))
-                json.dump(input_tuples, f, cls=NumpyEncoder)
-
-        # Copy the relevant boilerplate run script into the current working directory.
-        runner_file = "{:s}.run.py".format(run_id)
-        shutil.copy(self.run_script_filename, runner_file)
+        self._push_run(
+            container_id, run_id, code_filename, function_name, input_tuples,
+            correct_output_tuples, resource_files, code_pushed
+        )
 
-        # Replace "$FUNCTION_NAME" in the run script with the actual function name to call
-        # (as defined in the problem module).
-        logger.debug("Replacing $FUNCTION_NAME->{:s} in {:s}...".format(function_name, runner_file))
-        with fileinput.FileInput(runner_file, inplace=True) as f:
-            for line in f:
-                print(line.replace("$FUNCTION_NAME", function_name), end="")
+        user_outputs, process_infos = self._execute_and_read(
+            container_id, run_id, code_filename, len(input_tuples), runner_address
+        )
+
+        logger.info("Finished running user code.")
+
+        return user_outputs, process_infos
+
+    def run_stream(
+        self,
+        container_id,
+        code_filename,
+        function_name,
+        input_tuples,
+        correct_output_tuples,
+        resource_files=None,
+        runner_address=None,
+        code_pushed=False,
+    ):
+        """
+        Like run, but yields (index, user_output, process_info) for each test case as soon as the run
+        script reports it, which may be out of order if test cases are run in parallel. Only the
+        runner daemon can stream results so without one they're all yielded once the run finishes.
+
+        The process info of each test case has the stdout produced up until it finished.
+        """
+        logger.info("Streaming {:s} with {:d} inputs...".format(code_filename, len(input_tuples)))
+
+        run_id = code_filename.split(".")[0]
+
+        self._push_run(
+            container_id, run_id, code_filename, function_name, input_tuples,
+            correct_output_tuples, resource_files, code_pushed
+        )
+
+        frames = None
+        if runner_address:
+            t_execute = time.perf_counter()
+            try:
+                frames = runner_execute_stream(
+                    runner_address,
+                    "/root/{:s}.run.py".format(run_id),
+                    timeout=self.profile.wall_time,
+                    max_output=self.profile.output_size,
+                )
+            except RunnerUnavailableError:
+                logger.warning("Runner daemon unavailable, falling back to executing the script.")
+
+        if frames is None:
+            user_outputs, process_infos = self._execute_and_read(
+                container_id, run_id, code_filename, len(input_tuples), runner_address=None
+            )
+            yield from zip(range(len(input_tuples)), user_outputs, process_infos)
+            return
+
+        output_indices = {
+            "{:s}.output{:d}.bin".format(run_id, i): i for i in range(len(input_tuples))
+        }
+
+        # Only the time spent waiting on the container counts towards the execute stage, not the
+        # time spent verifying each result in between.
+        execute_time = 0
+
+        try:
+            for frame in frames:
+                if frame[0] == "exit":
+                    _, exec_retval, exec_stdout = frame
+                    STAGE_DURATION.observe(
+                        execute_time + time.perf_counter() - t_execute, stage="execute"
+                    )
+                    if exec_retval not in (0, 124):
+                        raise exec_error(exec_retval, exec_stdout)
+                    break
+
+                _, output_file, output_data, exec_stdout = frame
+                if output_file not in output_indices:
+                    continue
+
+                i = output_indices.pop(output_file)
+
+                output_dict = decode_output(output_data)
+                p_info = {
+                    "return_value": 0,
+                    "stdout": exec_stdout,
+                    "runtime": output_dict["runtime"],
+                    "cpu_time": output_dict["cpu_time"],
+                    "max_mem_usage": output_dict["max_mem_usage"],
+                    "timed_out": output_dict["timed_out"],
+                }
+
+                execute_time += time.perf_counter() - t_execute
+                yield i, output_dict["user_output"], p_info
+                t_execute = time.perf_counter()
+
+        except RunnerUnavailableError as e:
+            raise EngineExecutionError(str(e))
+
+        finally:
+            frames.close()
+
+        # Pick up any outputs the run script didn't report the usual way, and the test cases it never
+        # got to if it ran out of time.
+        if output_indices:
+            output_files = self._pull_outputs(container_id, run_id, exec_retval)
+
+            user_outputs, process_infos = self._read_outputs(
+                run_id, output_files, len(input_tuples), exec_retval, exec_stdout
+            )
+            for i in sorted(output_indices.values()):
+                yield i, user_outputs[i], process_infos[i]
+
+        logger.info("Finished streaming user code.")
+
+    def run_batch(
+        self,
+        container_id,
+        code_filenames,
+        function_name,
+        input_tuples,
+        correct_output_tuples,
+        resource_files=None,
+        runner_address=None,
+        user_generated_files=None,
+    ):
+        """
+        Run several submissions to the same problem against the same test cases in a single container
+        round trip: one push, one execution of the batch run script and one pull. Each submission is
+        run as its own unprivileged user in its own directory, see run_batch.py.
+
+        :param user_generated_files: names of the files the user's code is asked to generate, which
+            are copied back to the working directory to be pulled. Only for a batch of one.
+        :return: a list with, for each code file, either (user_outputs, process_infos) or the
+            EngineExecutionError or EngineTimeoutError raised by running it
+        """
+        logger.info(
+            "Running batch of {:d} submissions with {:d} inputs...".format(
+                len(code_filenames), len(input_tuples)
+            )
+        )
+
+        batch_id = "batch{:s}".format(uuid.uuid4().hex)
+        run_ids = [code_filename.split(".")[0] for code_filename in code_filenames]
+
+        # Compiling and caching C code in the batch would cost a round trip per submission so only
+        # compile cache hits are used, the rest are compiled by the run script.
+        required_files = {}
+        for run_id, code_filename in zip(run_ids, code_filenames):
+            run_files, _ = self._run_files(
+                run_id, code_filename, function_name, input_tuples, correct_output_tuples
+            )
+            required_files.update(run_files)
+
+        # Resources are either pushed in or linked to where they already are in the container.
+        shared_files = list(resource_files or {})
+        required_files.update(resource_files or {})
+
+        for file_name in self.util_files:
+            shared_files.append(os.path.basename(file_name))
+            required_files[os.path.basename(file_name)] = file_name
+
+        batch_file = "{:s}.batch.json".format(batch_id)
+        batch = {
+            "run_ids": run_ids,
+            "timeout": self.profile.wall_time,
+            "max_output": self.profile.output_size,
+            "shared_files": shared_files,
+            "user_generated_files": list(user_generated_files or []),
+        }
+        required_files[batch_file] = json.dumps(batch).encode()
+
+        batch_runner_file = "{:s}.run.py".format(batch_id)
+        with open("run_batch.py", mode="rb") as f:
+            required_files[batch_runner_file] = f.read()
+
+        try:
+            with time_stage("push"):
+                self.sandbox.push_files(container_id, required_files)
+        except SandboxError:
+            raise FilePushError("Failed to push files for batch {:s}".format(batch_id))
+
+        try:
+            exec_retval, exec_stdout = self._execute(
+                container_id,
+                batch_runner_file,
+                runner_address,
+                self.profile.wall_time * len(run_ids) + 10,
+            )
+        except SandboxError as e:
+            raise EngineExecutionError(str(e))
+
+        if exec_retval != 0:
+            raise exec_error(exec_retval, exec_stdout)
+
+        output_dir = "/root/{:s}.outputs".format(batch_id)
+        try:
+            with time_stage("pull"):
+                output_files = self.sandbox.pull_files(container_id, output_dir)
+        except SandboxError:
+            raise FilePullError("Failed to pull output files for batch {:s}".format(batch_id))
+
+        run_results = json.loads(output_files["{:s}.results.json".format(batch_id)])
+
+        results = []
+        for run_id in run_ids:
+            run_result = run_results[run_id]
+            run_retval, run_stdout = run_result["exit_code"], run_result["stdout"]
+
+            if run_retval not in (0, 124):
+                results.append(exec_error(run_retval, run_stdout))
+                continue
+
+            results.append(
+                self._read_outputs(run_id, output_files, len(input_tuples), run_retval, run_stdout)
+            )
+
+        logger.info("Finished running batch {:s}.".format(batch_id))
+
+        return results
+
+    def _execute_and_read(self, container_id, run_id, code_filename, n_inputs, runner_address):
+        # Tell the Linux container to execute the run script that will run the user's code.
+        try:
+            exec_retval, exec_stdout = self._execute(
+                container_id, "{:s}.run.py".format(run_id), runner_address, self.profile.wall_time
+            )
+        except SandboxError as e:
+            # If we fail to reach the sandbox, clean up the files
+            util.delete_file(code_filename)
+            raise EngineExecutionError(str(e))
+
+        # Or if the code failed to run properly, clean up the files. If it ran out of time we still
+        # want the results of the test cases it got through.
+        if exec_retval not in (0, 124):
+            util.delete_file(code_filename)
+            raise exec_error(exec_retval, exec_stdout)
+
+        # Read all the output that the user produced. Each test case's output ends up in its own
+        # file in the run's output directory which we pull out all at once.
+        output_files = self._pull_outputs(container_id, run_id, exec_retval)
+
+        user_outputs, process_infos = self._read_outputs(
+            run_id, output_files, n_inputs, exec_retval, exec_stdout
+        )
+
+        return user_outputs, process_infos
+
+    def push_code(self, container_id, code_filename, function_name, resource_files=None):
+        """
+        Push everything a run needs that doesn't depend on the test cases into the container ahead
+        of time: the code, the run script and its options, the harness and resource_files, usually
+        the static resources. C code is compiled too. Running with code_pushed=True then only has to
+        push the test case files, so this can be done while the test cases are being generated.
+        """
+        run_id = code_filename.split(".")[0]
+
+        required_files, compile_key = self._code_files(run_id, code_filename, function_name)
+        required_files.update(resource_files or {})
+
+        for file_name in self.util_files:
+            required_files[os.path.basename(file_name)] = file_name
+
+        self._push(container_id, run_id, code_filename, required_files, compile_key)
+
+    def _push_run(
+        self, container_id, run_id, code_filename, function_name, input_tuples,
+        correct_output_tuples, resource_files, code_pushed=False
+    ):
+        # Everything the run needs is pushed into the container as one tar archive, so the input
+        # files are built in memory rather than written to disk first.
+        if code_pushed:
+            required_files = self._test_case_files(run_id, input_tuples, correct_output_tuples)
+            compile_key = None
+        else:
+            required_files, compile_key = self._run_files(
+                run_id, code_filename, function_name, input_tuples, correct_output_tuples
+            )
+
+            for file_name in self.util_files:
+                required_files[os.path.basename(file_name)] = file_name
+
+        # Resources are either pushed in or linked to where they already are in the container.
+        required_files.update(resource_files or {})
+
+        self._push(container_id, run_id, code_filename, required_files, compile_key)
+
+    def _push(self, container_id, run_id, code_filename, required_files, compile_key):
+        # C code that isn't in the compile cache is compiled elsewhere then pushed with the rest.
+        if compile_key:
+            lib_file = "{:s}.so".format(run_id)
+            with time_stage("compile"):
+                required_files[lib_file] = self._compile_and_cache(
+                    compile_key, code_filename, lib_file
+                )
 
         # Push all the files we need into the Linux container.
-        required_files = [code_filename, runner_file, input_pickle]
+        try:
+            with time_stage("push"):
+                self.sandbox.push_files(container_id, required_files)
+        except SandboxError:
+            util.delete_file(code_filename)
+            raise FilePushError("Failed to push files for run {:s}".format(run_id))
+
+    def _run_files(self, run_id, code_filename, function_name, input_tuples, correct_output_tuples):
+        """
+        Build all the files needed to run one submission.
+
+        :return: dict of files to push into the container and, for C code that isn't in the compile
+            cache, the compile cache key to store the compiled library under (None otherwise)
+        """
+        required_files, compile_key = self._code_files(run_id, code_filename, function_name)
+        required_files.update(self._test_case_files(run_id, input_tuples, correct_output_tuples))
+        return required_files, compile_key
+
+    def _test_case_files(self, run_id, input_tuples, correct_output_tuples):
+        """Build the files holding the test cases of one submission."""
+        # Encode all the input tuples into one file.
+        input_file = "{:s}.input.bin".format(run_id)
+        logger.debug("Encoding input tuples in {:s}...".format(input_file))
+        required_files = {input_file: encode(input_tuples)}
+
         if self.push_correct_output:
-            correct_output_pickle = "{:s}.correct.pickle".format(run_id)
-            with open(correct_output_pickle, mode="wb") as f:
-                logger.debug(
-                    "Pickling correct output tuples in {:s}...".format(correct_output_pickle)
+            correct_output_file = "{:s}.correct.bin".format(run_id)
+            logger.debug("Encoding correct output tuples in {:s}...".format(correct_output_file))
+            required_files[correct_output_file] = encode(correct_output_tuples)
+
+        return required_files
+
+    def _code_files(self, run_id, code_filename, function_name):
+        """
+        Build the files needed to run one submission that don't depend on the test cases.
+
+        :return: dict of files and the compile cache key like _run_files
+        """
+        required_files = {code_filename: code_filename}
+
+        # Copy the relevant boilerplate run script and replace "$FUNCTION_NAME" in it with the
+        # actual function name to call (as defined in the problem module).
+        runner_file = "{:s}.run.py".format(run_id)
+        logger.debug("Replacing $FUNCTION_NAME->{:s} in {:s}...".format(function_name, runner_file))
+        with open(self.run_script_filename, mode="r") as f:
+            required_files[runner_file] = f.read().replace("$FUNCTION_NAME", function_name).encode()
+
+        # Options the run script reads to decide how to run the test cases.
+        options_json = "{:s}.options.json".format(run_id)
+        options = {"parallelism": self.parallelism, "test_case_timeout": self.test_case_timeout}
+        required_files[options_json] = json.dumps(options).encode()
+
+        # Reuse the shared library compiled for an identical C submission if we have one. Libraries
+        # are only compiled for the cache in the compile pool's containers.
+        compile_key = None
+        if self.language == "c" and self.compile_cache and self.compile_pool:
+            with open(code_filename, mode="rb") as f:
+                compile_key = self.compile_cache.key(
+                    f.read(), C_COMPILE_CMD, self.compile_pool.sandbox.image_id()
                 )
-                pickle.dump(correct_output_tuples, file=f, protocol=pickle.HIGHEST_PROTOCOL)
 
-            required_files.append(correct_output_pickle)
+            lib = self.compile_cache.get(compile_key)
+            if lib is not None:
+                logger.debug("Compile cache hit for {:s}".format(code_filename))
+                required_files["{:s}.so".format(run_id)] = lib
+                compile_key = None
 
-        for file_name in required_files + self.util_files:
-            source_path = file_name
-            target_path = "/root/{:s}".format(file_name)
+        return required_files, compile_key
 
-            try:
-                push_stdout = docker_file_push(container_id, source_path, target_path)
-            except subprocess.CalledProcessError:
-                # If pushing a file fails then declutter remaining files and raise an exception.
-                for fn in required_files:
-                    util.delete_file(fn)
-                raise FilePushError()
+    def _execute(self, container_id, runner_file, runner_address, timeout):
+        with time_stage("execute"):
+            return self._execute_script(container_id, runner_file, runner_address, timeout)
 
-        # Tell the Linux container to execute the run script that will run the user's code.
+    def _execute_script(self, container_id, runner_file, runner_address, timeout):
         runner_path = "/root/{}".format(runner_file)
-        command = ["python3", runner_path]
 
-        logger.debug("Trying to execute function in docker...")
-        try:
-            exec_retval, exec_stdout = docker_execute(container_id, command)
-        except docker.errors.APIError:
-            # If we fail to connect through docker, clean up the files
-            for fn in required_files:
-                util.delete_file(fn)
-            raise EngineExecutionError(exec_stdout)
-
-        # Or if the code failed to run properly, clean up the files
-        if exec_retval != 0:
-            for fn in required_files:
-                util.delete_file(fn)
+        if runner_address:
+            logger.debug("Trying to execute function through the runner daemon...")
+            try:
+                return runner_execute(
+                    runner_address, runner_path, timeout=timeout, max_output=self.profile.output_size
+                )
+            except RunnerUnavailableError:
+                logger.warning("Runner daemon unavailable, falling back to executing the script.")
 
-            # The `timeout` Linux command exits with return code 124 if the command times out.
+        logger.debug("Trying to execute function in the sandbox...")
+        exec_retval, exec_stdout = self.sandbox.execute(
+            container_id, ["python3", runner_path], timeout=timeout
+        )
+        return exec_retval, exec_stdout[: self.profile.output_size]
+
+    def _pull_outputs(self, container_id, run_id, exec_retval):
+        output_dir = "/root/{:s}.outputs".format(run_id)
+        try:
+            with time_stage("pull"):
+                return self.sandbox.pull_files(container_id, output_dir)
+        except SandboxError:
+            # A run that timed out might not have gotten as far as creating its output directory.
             if exec_retval == 124:
-                raise EngineTimeoutError("Your code took too long to run.")
-            else:
-                raise EngineExecutionError(exec_stdout)
+                return {}
+            raise FilePullError("Failed to pull output files for run {:s}".format(run_id))
 
+    def _read_outputs(self, run_id, output_files, n_inputs, exec_retval, exec_stdout):
         user_outputs = []
         process_infos = []
 
-        # Read all the output that the user produced.
-        # Each test case's output will end up it one output pickle file.
-        for i, _ in enumerate(input_tuples):
-            output_pickle = "{:s}.output{:d}.pickle".format(run_id, i)
-            source_path = "/root/{:s}".format(output_pickle)
-            target_path = output_pickle
+        for i in range(n_inputs):
+            output_file = "{:s}.output{:d}.bin".format(run_id, i)
+
+            if exec_retval == 124 and output_file not in output_files:
+                # The whole run ran out of time before getting to this test case.
+                user_outputs.append(None)
+                process_infos.append(
+                    {
+                        "return_value": exec_retval,
+                        "stdout": exec_stdout,
+                        "runtime": 0,
+                        "cpu_time": 0,
+                        "max_mem_usage": 0,
+                        "timed_out": True,
+                    }
+                )
+                continue
 
-            try:
-                pull_stdout = docker_file_pull(container_id, source_path, target_path)
-            except CalledProcessError:
-                for fn in required_files:
-                    util.delete_file(fn)
-                raise FilePullError(pull_stdout)
+            if output_file not in output_files:
+                raise EngineExecutionError(
+                    "Your code exited without writing the output of test case {:d}:\n{:s}".format(
+                        i + 1, exec_stdout
+                    )
+                )
 
-            with open(output_pickle, mode="rb") as f:
-                output_dict = pickle.load(f)
+            output_dict = decode_output(output_files[output_file])
 
-            # TODO: exec_retval will always be zero here, so why return it?
             p_info = {
                 "return_value": exec_retval,
                 "stdout": exec_stdout,
                 "runtime": output_dict["runtime"],
+                "cpu_time": output_dict["cpu_time"],
                 "max_mem_usage": output_dict["max_mem_usage"],
+                "timed_out": output_dict["timed_out"],
             }
 
             user_outputs.append(output_dict["user_output"])
             process_infos.append(p_info)
 
             logger.debug(
-                "runtime: {:g} s, max_mem_usage: {:g} kB".format(
-                    p_info["runtime"], p_info["max_mem_usage"]
+                "runtime: {:g} s, cpu_time: {:g} s, max_mem_usage: {:g} kB".format(
+                    p_info["runtime"], p_info["cpu_time"], p_info["max_mem_usage"]
                 )
             )
 
-            util.delete_file(output_pickle)
+        return user_outputs, process_infos
 
-        logger.info("Finished running user code.")
+    def _compile_and_cache(self, compile_key, code_filename, lib_file):
+        """
+        Compile C code in a container of the compile pool and cache the shared library. Those
+        containers never run any submissions, so nothing a submission does can tamper with what ends
+        up in the cache.
 
-        for fn in required_files:
-            util.delete_file(fn)
+        :return: the compiled shared library
+        """
+        logger.debug("Compile cache miss for {:s}, compiling...".format(code_filename))
+        command = C_COMPILE_CMD + ["-o", lib_file, code_filename]
 
-        return user_outputs, process_infos
+        with self.compile_pool.container(timeout=COMPILE_CHECKOUT_TIMEOUT) as container:
+            try:
+                self.sandbox.push_files(container.id, {code_filename: code_filename})
+            except SandboxError:
+                util.delete_file(code_filename)
+                raise FilePushError("Failed to push {:s} to compile it".format(code_filename))
+
+            try:
+                try:
+                    exec_retval, exec_stdout = self.sandbox.execute(container.id, command)
+                except SandboxError as e:
+                    util.delete_file(code_filename)
+                    raise EngineExecutionError(str(e))
+
+                if exec_retval != 0:
+                    util.delete_file(code_filename)
+                    raise EngineExecutionError(exec_stdout)
+
+                try:
+                    lib_files = self.sandbox.pull_files(
+                        container.id, "/root/{:s}".format(lib_file)
+                    )
+                except SandboxError:
+                    util.delete_file(code_filename)
+                    raise FilePullError("Failed to pull compiled library {:s}".format(lib_file))
+            finally:
+                # Later code compiled in the container mustn't be able to #include this code.
+                try:
+                    self.sandbox.execute(container.id, ["rm", "-f", code_filename, lib_file])
+                except SandboxError:
+                    logger.warning("Failed to clean up after compiling {:s}".format(code_filename))
+
+        self.compile_cache.put(compile_key, lib_files[lib_file])
+        return lib_files[lib_file]
@@ -0,0 +1,79 @@
+import collections
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CompileCache:
+    """
+    An in-memory LRU cache of compiled artifacts (e.g. shared libraries built from C submissions).
+
+    Artifacts are keyed by a hash of the source code, the compiler command and the image the
+    compiler ran in so resubmitting the same code skips compilation, but a rebuilt image with a
+    different compiler or libraries doesn't get artifacts built by the old one. The least recently
+    used artifacts are evicted once the cache holds more than max_bytes.
+
+    :param max_bytes: maximum total size of the cached artifacts
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        self._artifacts = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source, compile_cmd, image_id=None):
+        """
+        Hash the source code (bytes) together with the compiler command used to build it and the ID
+        of the image the compiler is in, if it runs in one.
+        """
+        m = hashlib.sha256()
+        m.update(" ".join(compile_cmd).encode())
+        m.update(b"\0")
+        m.update((image_id or "").encode())
+        m.update(b"\0")
+        m.update(source)
+        return m.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._artifacts.move_to_end(key)
+            return artifact
+
+    def put(self, key, artifact):
+        if len(artifact) > self.max_bytes:
+            logger.debug("Not caching {:d} byte compiled artifact.".format(len(artifact)))
+            return
+
+        with self._lock:
+            if key in self._artifacts:
+                return
+
+            self._artifacts[key] = artifact
+            self._size += len(artifact)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._artifacts.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "artifacts": len(self._artifacts),
+                "bytes": self._size,
+            }
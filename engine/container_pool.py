@@ -0,0 +1,279 @@
+import collections
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from engine.resource_profiles import DEFAULT_PROFILE
+from engine.sandbox import DockerSandbox, SandboxError
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before trying again to replace a container that couldn't be started. The wait
+# doubles after every failed attempt, up to the maximum.
+REPLACE_RETRY_DELAY = 1
+REPLACE_RETRY_MAX_DELAY = 60
+
+
+class ContainerPoolTimeoutError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class PooledContainer:
+    """A code runner container owned by a ContainerPool."""
+
+    def __init__(self, container_id, container_name, runner_address=None, profile=DEFAULT_PROFILE):
+        self.id = container_id
+        self.name = container_name
+        self.runner_address = runner_address
+        self.profile = profile
+        self.created = time.monotonic()
+        self.runs = 0
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created
+
+    def __repr__(self):
+        return "PooledContainer(name={:s}, runs={:d}, age={:.0f}s)".format(
+            self.name, self.runs, self.age
+        )
+
+
+class ContainerPool:
+    """
+    A pool of pre-started code runner containers, or instances of whichever sandbox backend is used.
+
+    Each submission checks out a container, has it all to itself while its code runs, then returns it
+    to the pool. Containers are health checked on checkout and recycled (removed and replaced with a
+    fresh container) once they have served max_runs submissions or are older than max_age seconds.
+
+    Submissions are only run in containers started with the resource limits of their profile. The
+    pool starts off with containers for the default profile and starts containers for other profiles
+    the first time they're checked out, up to size containers per profile.
+
+    :param size: number of containers to keep running for each resource profile
+    :param max_runs: recycle a container after this many submissions (0 to never recycle)
+    :param max_age: recycle a container after this many seconds (0 to never recycle)
+    :param profile: ResourceProfile of the containers started up front
+    :param sandbox: Sandbox backend to start containers with, docker containers if not given
+    :param name: prefix of the names of the containers, which must differ between pools
+    """
+
+    def __init__(
+        self,
+        size=2,
+        max_runs=100,
+        max_age=3600,
+        profile=DEFAULT_PROFILE,
+        sandbox=None,
+        name="lovelace",
+    ):
+        self.size = size
+        self.max_runs = max_runs
+        self.max_age = max_age
+        self.profile = profile
+        self.sandbox = sandbox or DockerSandbox()
+        self.name = name
+
+        self._idle = collections.defaultdict(queue.Queue)  # container key -> idle containers
+        self._creating = collections.Counter()  # container key -> containers being created
+        self._lock = threading.Lock()
+        self._containers = {}
+        self._counter = 0
+        self._closed = False
+
+    def start(self):
+        logger.info("Starting container pool with {:d} containers...".format(self.size))
+        for _ in range(self.size):
+            self._idle[self.profile.container_key].put(self._create(self.profile))
+
+    def _create(self, profile):
+        with self._lock:
+            self._counter += 1
+            container_name = "{:s}-{:d}-{:d}-{:s}".format(
+                self.name,
+                os.getpid(),
+                self._counter,
+                datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+            )
+
+        container_id, container_name = self.sandbox.create(container_name, profile)
+        # Submissions are sent to the runner daemon in the container when we can reach it.
+        runner_address = self.sandbox.runner_address(container_id)
+
+        container = PooledContainer(container_id, container_name, runner_address, profile)
+
+        with self._lock:
+            self._containers[container.id] = container
+
+        logger.debug("Container pool: created {}".format(container))
+        return container
+
+    def _remove(self, container):
+        with self._lock:
+            self._containers.pop(container.id, None)
+
+        try:
+            self.sandbox.remove(container.id)
+        except SandboxError:
+            logger.exception("Container pool: failed to remove {}".format(container))
+
+    def _replace(self, container):
+        """
+        Remove a container and start a new one in its place in the background. Starting it is
+        retried with backoff until it works, so the pool doesn't shrink for good when the sandbox
+        backend has a hiccup. Its spot is held the whole time so checkouts don't start another
+        container in its place.
+        """
+        with self._lock:
+            self._creating[container.profile.container_key] += 1
+        threading.Thread(target=self._replace_reserved, args=(container,), daemon=True).start()
+
+    def _replace_reserved(self, container):
+        key = container.profile.container_key
+        try:
+            self._remove(container)
+
+            delay = REPLACE_RETRY_DELAY
+            while not self._closed:
+                try:
+                    new_container = self._create(container.profile)
+                except SandboxError:
+                    logger.exception(
+                        "Container pool: failed to replace {}, trying again in {:g}s".format(
+                            container, delay
+                        )
+                    )
+                    time.sleep(delay)
+                    delay = min(2 * delay, REPLACE_RETRY_MAX_DELAY)
+                    continue
+
+                if self._closed:
+                    self._remove(new_container)
+                else:
+                    self._idle[key].put(new_container)
+                return
+        finally:
+            with self._lock:
+                self._creating[key] -= 1
+
+    def _needs_recycling(self, container):
+        if self.max_runs and container.runs >= self.max_runs:
+            return True
+        if self.max_age and container.age >= self.max_age:
+            return True
+        return False
+
+    def _reserve(self, key):
+        """Reserve a spot for a new container with the given container key if there's room."""
+        with self._lock:
+            n_containers = sum(
+                1 for c in self._containers.values() if c.profile.container_key == key
+            )
+            if n_containers + self._creating[key] >= self.size:
+                return False
+            self._creating[key] += 1
+            return True
+
+    def _create_reserved(self, profile):
+        try:
+            return self._create(profile)
+        finally:
+            with self._lock:
+                self._creating[profile.container_key] -= 1
+
+    def checkout(self, timeout=None, profile=None):
+        """
+        Take an idle, healthy container out of the pool, blocking until one is available.
+
+        :param profile: ResourceProfile the container must have been started with, the pool's
+            profile if not given
+        """
+        if not profile:
+            profile = self.profile
+
+        idle = self._idle[profile.container_key]
+
+        while True:
+            if idle.empty() and self._reserve(profile.container_key):
+                try:
+                    container = self._create_reserved(profile)
+                except SandboxError:
+                    logger.exception("Container pool: failed to create a container")
+                    raise ContainerPoolTimeoutError(
+                        "Could not start a code runner container with {}.".format(profile)
+                    )
+            else:
+                try:
+                    container = idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise ContainerPoolTimeoutError(
+                        "No code runner container became available within {}s.".format(timeout)
+                    )
+
+            if self.sandbox.running(container.id):
+                logger.debug("Container pool: checked out {}".format(container))
+                return container
+
+            logger.warning("Container pool: {} failed health check, replacing it.".format(container))
+            self._replace(container)
+
+    def checkin(self, container):
+        """Return a container to the pool, recycling it in the background if it has served its time."""
+        container.runs += 1
+
+        if self._closed:
+            self._remove(container)
+        elif self._needs_recycling(container):
+            logger.info("Container pool: recycling {}".format(container))
+            self._replace(container)
+        else:
+            logger.debug("Container pool: checked in {}".format(container))
+            self._idle[container.profile.container_key].put(container)
+
+    @contextmanager
+    def container(self, timeout=None, profile=None):
+        container = self.checkout(timeout=timeout, profile=profile)
+        try:
+            yield container
+        finally:
+            self.checkin(container)
+
+    def status(self):
+        with self._lock:
+            total = len(self._containers)
+            profiles = collections.Counter(
+                c.profile.container_key for c in self._containers.values()
+            )
+
+        n_idle = sum(idle.qsize() for idle in list(self._idle.values()))
+
+        profile_status = []
+        for (cpus, memory, pids_limit), size in profiles.items():
+            idle = self._idle[(cpus, memory, pids_limit)].qsize()
+            profile_status.append(
+                {
+                    "cpus": cpus,
+                    "memory": memory,
+                    "pidsLimit": pids_limit,
+                    "size": size,
+                    "idle": idle,
+                }
+            )
+
+        return {"size": total, "idle": n_idle, "busy": total - n_idle, "profiles": profile_status}
+
+    def shutdown(self):
+        logger.info("Shutting down container pool...")
+        self._closed = True
+
+        with self._lock:
+            containers = list(self._containers.values())
+
+        for container in containers:
+            self._remove(container)
@@ -1,13 +1,56 @@
+import io
 import logging
 import os
-import subprocess
-from subprocess import CalledProcessError
+import tarfile
+import threading
+import time
 
 import docker
 
+from engine.resource_profiles import DEFAULT_PROFILE
+
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 logger = logging.getLogger(__name__)
 
+# Most commands executed in containers at once, and most other docker API calls (pushing and
+# pulling files, health checks, ...) at once. Commands run for as long as the code they run, so they
+# get their own limit and can't hold up other submissions' files being pushed and pulled.
+DOCKER_MAX_EXECS = int(os.environ.get("LOVELACE_DOCKER_MAX_EXECS", 8))
+DOCKER_MAX_CALLS = int(os.environ.get("LOVELACE_DOCKER_MAX_CALLS", 8))
+
+_exec_slots = threading.BoundedSemaphore(DOCKER_MAX_EXECS)
+_call_slots = threading.BoundedSemaphore(DOCKER_MAX_CALLS)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def docker_client():
+    """
+    The docker client shared by every thread in this process. Its connection pool has a connection
+    for every API call that may be in flight at once so connections are reused rather than opened
+    again for every call.
+    """
+    global _client, _client_pid
+
+    with _client_lock:
+        # Connections can't be shared with the gunicorn workers forked after the app was loaded.
+        if _client is None or _client_pid != os.getpid():
+            _client = docker.from_env(max_pool_size=DOCKER_MAX_EXECS + DOCKER_MAX_CALLS)
+            _client_pid = os.getpid()
+        return _client
+
+
+class Symlink:
+    """A symbolic link to create in a container with docker_files_push."""
+
+    def __init__(self, target):
+        self.target = target
+
+    def __repr__(self):
+        return "Symlink({:s})".format(self.target)
+
 
 def docker_init(client=None, image_name="lovelace-code-test"):
     """Build docker image for code test containers
@@ -17,10 +60,12 @@ def docker_init(client=None, image_name="lovelace-code-test"):
 
     Syntax to build docker image (from OUTSIDE Dockerfile dir):
     docker build -t <image_name> -f /path/to/Dockerfile /path/to/docker_dir
+
+    :return: the ID (digest) of the image
     """
 
     if not client:
-        client = docker.from_env()
+        client = docker_client()
 
     docker_dir = os.path.dirname(SCRIPT_DIR)
     logger.info(
@@ -38,31 +83,58 @@ def docker_init(client=None, image_name="lovelace-code-test"):
         )
         raise
 
+    return image.id
 
-def create_docker_container(client=None, name=None, image_name="lovelace-code-test", remove=False):
+
+def create_docker_container(
+    client=None,
+    name=None,
+    image_name="lovelace-code-test",
+    remove=False,
+    profile=None,
+    volumes=None,
+    environment=None,
+):
     """Create a docker container
 
     Syntax to create a docker container (as daemon):
     docker run -d --name <container_name> <image_name>
 
     Note: container name must be unique.
+
+    :param profile: ResourceProfile with the CPU, memory and process limits of the container
+    :param volumes: optional dict of volumes to mount in the container, in docker-py's format
+    :param environment: optional dict of environment variables to set in the container
     """
 
     if not client:
-        client = docker.from_env()
+        client = docker_client()
 
-    logger.info('Creating docker container "{}" from image "{}"'.format(name, image_name))
+    if not profile:
+        profile = DEFAULT_PROFILE
 
-    # Max 40% cpu usage
-    cpu_period = 100000
-    cpu_quota = 40000
+    logger.info(
+        'Creating docker container "{}" from image "{}" with {}'.format(name, image_name, profile)
+    )
 
-    # Max 512 MiB memory limit
-    mem_limit = "512m"
+    # Max 40% cpu usage and 512 MiB memory by default
+    cpu_period = 100000
+    cpu_quota = int(profile.cpus * cpu_period)
 
     try:
-        container = client.containers.run(image_name, detach=True, name=name, remove=remove,
-                                          cpu_period=cpu_period, cpu_quota=cpu_quota, mem_limit=mem_limit)
+        with _call_slots:
+            container = client.containers.run(
+                image_name,
+                detach=True,
+                name=name,
+                remove=remove,
+                cpu_period=cpu_period,
+                cpu_quota=cpu_quota,
+                mem_limit=profile.memory,
+                pids_limit=profile.pids_limit,
+                volumes=volumes,
+                environment=environment,
+            )
     except (docker.errors.ContainerError, docker.errors.ImageNotFound, docker.errors.APIError):
         logger.error(
             "Failed to start docker container! Please check that docker is installed and that "
@@ -73,85 +145,170 @@ def create_docker_container(client=None, name=None, image_name="lovelace-code-te
     return container.id, container.name
 
 
-def remove_docker_container(container_id):
+def remove_docker_container(container_id, client=None):
 
     # TODO: this is called TWICE when gunicorn shuts down. Maybe because of the way the reloader
     # works?
 
     logger.info("Clean up:  deleting container {}".format(container_id))
 
-    client = docker.from_env()
+    if not client:
+        client = docker_client()
 
+    # Nothing in the container needs to shut down cleanly, so it's killed and removed in one call
+    # rather than waiting for it to stop first.
     try:
-        container = client.containers.get(container_id)
+        with _call_slots:
+            client.api.remove_container(container_id, force=True)
     except docker.errors.NotFound:
         logger.info("Container {} already deleted!".format(container_id))
         return
-    container.stop()
-    container.remove()
     logger.info("Container deleted successfully")
 
 
-def docker_file_push(container_id, src_path, tgt_path, container_user="root", chown=True):
-    """Copy a file into a docker container"""
+def docker_container_ip(container_id, client=None):
+    """Get the IP address of a docker container on its network, or None if it has none"""
+
+    if not client:
+        client = docker_client()
 
-    cmd = ["docker", "cp", src_path, "{}:{}".format(container_id, tgt_path)]
-    copy_msg = "{}: {} -> {}".format(container_id, src_path, tgt_path)
-    logger.debug("Copying file into docker container: " + copy_msg)
+    with _call_slots:
+        attrs = client.api.inspect_container(container_id)
+    return attrs["NetworkSettings"]["IPAddress"] or None
+
+
+def docker_container_running(container_id, client=None):
+    """Check whether a docker container exists and is running"""
+
+    if not client:
+        client = docker_client()
 
     try:
-        ret = subprocess.run(cmd, check=True, stderr=subprocess.STDOUT, encoding="utf8")
-    except CalledProcessError as e:
-        logger.error("Failed to copy file into container " + copy_msg)
-        logger.error("Process return code: {}; stdout: {}".format(e.returncode, e.stdout))
-        raise
+        with _call_slots:
+            attrs = client.api.inspect_container(container_id)
+    except (docker.errors.NotFound, docker.errors.APIError):
+        logger.warning("Container {} could not be found.".format(container_id))
+        return False
+
+    return attrs["State"]["Status"] == "running"
 
-    # TODO chown?
 
-    return ret.stdout
+def docker_file_push(container_id, src_path, tgt_path, client=None):
+    """Copy a file into a docker container"""
+
+    docker_files_push(
+        container_id, {os.path.basename(tgt_path): src_path}, os.path.dirname(tgt_path), client
+    )
 
 
-def docker_file_pull(container_id, src_path, tgt_path):
+def docker_file_pull(container_id, src_path, tgt_path, client=None):
     """Copy a file out of a docker container"""
 
-    cmd = ["docker", "cp", "{}:{}".format(container_id, src_path), tgt_path]
-    copy_msg = "{}: {} -> {}".format(container_id, src_path, tgt_path)
-    logger.debug("Copying file out of docker container: " + copy_msg)
+    files = docker_files_pull(container_id, src_path, client)
+    if len(files) != 1:
+        raise docker.errors.NotFound(
+            "{} is not a file in container {}".format(src_path, container_id)
+        )
+
+    with open(tgt_path, mode="wb") as f:
+        f.write(next(iter(files.values())))
+
+
+def docker_files_push(container_id, files, tgt_dir="/root", client=None):
+    """
+    Copy many files into a docker container at once as a single in-memory tar archive.
+
+    :param container_id: container to copy the files into
+    :param files: dict mapping each file name (relative to tgt_dir) to either the path of a file on
+        the host, a bytes object holding the file contents or a Symlink to a path in the container
+    :param tgt_dir: directory inside the container to extract the files into
+    """
+
+    if not client:
+        client = docker_client()
+
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode="w") as tar:
+        for file_name, contents in files.items():
+            if isinstance(contents, bytes):
+                tar_info = tarfile.TarInfo(name=file_name)
+                tar_info.size = len(contents)
+                tar_info.mtime = int(time.time())
+                tar.addfile(tar_info, io.BytesIO(contents))
+            elif isinstance(contents, Symlink):
+                tar_info = tarfile.TarInfo(name=file_name)
+                tar_info.type = tarfile.SYMTYPE
+                tar_info.linkname = contents.target
+                tar_info.mtime = int(time.time())
+                tar.addfile(tar_info)
+            else:
+                tar.add(contents, arcname=file_name)
+
+    copy_msg = "{}: {:d} files -> {}".format(container_id, len(files), tgt_dir)
+    logger.debug("Copying files into docker container: " + copy_msg)
 
     try:
-        ret = subprocess.run(cmd, check=True, stderr=subprocess.STDOUT, encoding="utf8")
-    except CalledProcessError as e:
-        logger.error("Failed to copy file out of container " + copy_msg)
-        logger.error("Process return code: {}; stdout: {}".format(e.returncode, e.stdout))
+        with _call_slots:
+            client.api.put_archive(container_id, tgt_dir, tar_buffer.getvalue())
+    except docker.errors.APIError:
+        logger.error("Failed to copy files into container " + copy_msg)
         raise
 
-    return ret.stdout
 
+def docker_files_pull(container_id, src_path, client=None):
+    """
+    Copy a file or a whole directory out of a docker container at once as a single tar archive.
 
-def docker_execute(container_id, cmd, timeout=30, env=None, client=None):
-    """Execute a command in a docker container"""
+    :param container_id: container to copy the files out of
+    :param src_path: path of the file or directory inside the container
+    :return: dict mapping each file name to its contents as bytes
+    """
 
     if not client:
-        client = docker.from_env()
+        client = docker_client()
+
+    copy_msg = "{}: {}".format(container_id, src_path)
+    logger.debug("Copying files out of docker container: " + copy_msg)
 
     try:
-        container = client.containers.get(container_id)
-    except docker.errors.NotFound:
-        logger.error(f"Container {container_id} could not be found.")
+        with _call_slots:
+            tar_stream, _ = client.api.get_archive(container_id, src_path)
+            tar_buffer = io.BytesIO(b"".join(tar_stream))
+    except docker.errors.APIError:
+        logger.error("Failed to copy files out of container " + copy_msg)
         raise
 
+    files = {}
+    with tarfile.open(fileobj=tar_buffer, mode="r") as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                files[os.path.basename(member.name)] = tar.extractfile(member).read()
+
+    return files
+
+
+def docker_execute(container_id, cmd, timeout=30, env=None, client=None):
+    """Execute a command in a docker container"""
+
+    if not client:
+        client = docker_client()
+
     timeout_cmd = ["timeout", f"{timeout}"]
     full_cmd = timeout_cmd + cmd
 
     logger.debug(f"Running command {full_cmd} in container {container_id}.")
 
+    # Straight to the low level API so the container isn't looked up again before every command.
     try:
-        exit_code, std_out = container.exec_run(full_cmd, environment=env, workdir=None)
+        with _exec_slots:
+            exec_id = client.api.exec_create(container_id, full_cmd, environment=env)["Id"]
+            std_out = client.api.exec_start(exec_id)
+            exit_code = client.api.exec_inspect(exec_id)["ExitCode"]
+    except docker.errors.NotFound:
+        logger.error(f"Container {container_id} could not be found.")
+        raise
     except docker.errors.APIError:
-        logger.error(
-            f'Failed to run cmd {full_cmd} in container {container_id}.'
-            f'Exit code: {exit_code}; Stdout: {std_out.decode("utf8")}'
-        )
+        logger.error(f"Failed to run cmd {full_cmd} in container {container_id}.")
         raise
 
     return exit_code, std_out.decode("utf8")
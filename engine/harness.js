@@ -0,0 +1,208 @@
+// Test case harness for JavaScript submissions. It is pushed into the code runner container next to
+// run_js.py, which starts it as
+//
+//     node harness.js <code file>
+//
+// with the test case inputs in the wire format (see wire_format.py) on stdin. The user's code is
+// loaded once as a module exporting their function, then each test case is run and its result is
+// written down the pipe named by LOVELACE_NOTIFY_FD as one line: the (0-based) index of the test case,
+// a space, then the result as JSON.
+//
+// Each node process only runs its share of the test cases, see run_sharded in harness.py.
+
+"use strict";
+
+const fs = require("fs");
+const path = require("path");
+
+// Reader for the binary format the engine sends test case inputs in, see wire_format.py.
+const WIRE_MAGIC = "LVLC";
+const WIRE_VERSION = 1;
+
+const WIRE_DTYPES = {
+    "|b1": Uint8Array,
+    "|i1": Int8Array, "<i2": Int16Array, "<i4": Int32Array, "<i8": BigInt64Array,
+    "|u1": Uint8Array, "<u2": Uint16Array, "<u4": Uint32Array, "<u8": BigUint64Array,
+    "<f4": Float32Array, "<f8": Float64Array,
+};
+
+function readWire(buffer) {
+    if (buffer.toString("latin1", 0, 4) !== WIRE_MAGIC) {
+        throw new Error("Input is not in the wire format");
+    }
+    if (buffer[4] !== WIRE_VERSION) {
+        throw new Error("Input has an unsupported wire format version");
+    }
+
+    const reader = {
+        buffer: buffer,
+        view: new DataView(buffer.buffer, buffer.byteOffset, buffer.length),
+        offset: 5,
+    };
+    return readWireValue(reader);
+}
+
+function readUint32(reader) {
+    const value = reader.view.getUint32(reader.offset, true);
+    reader.offset += 4;
+    return value;
+}
+
+function readUint64(reader) {
+    const value = Number(reader.view.getBigUint64(reader.offset, true));
+    reader.offset += 8;
+    return value;
+}
+
+function readString(reader, encoding) {
+    const n = readUint32(reader);
+    const value = reader.buffer.toString(encoding, reader.offset, reader.offset + n);
+    reader.offset += n;
+    return value;
+}
+
+function readWireValue(reader) {
+    const tag = String.fromCharCode(reader.buffer[reader.offset++]);
+
+    if (tag === "N") {
+        return null;
+    } else if (tag === "T") {
+        return true;
+    } else if (tag === "F") {
+        return false;
+    } else if (tag === "i") {
+        const value = Number(reader.view.getBigInt64(reader.offset, true));
+        reader.offset += 8;
+        return value;
+    } else if (tag === "I") {
+        return Number(readString(reader, "latin1"));
+    } else if (tag === "f") {
+        const value = reader.view.getFloat64(reader.offset, true);
+        reader.offset += 8;
+        return value;
+    } else if (tag === "s") {
+        return readString(reader, "utf8");
+    } else if (tag === "b") {
+        const n = readUint32(reader);
+        const value = reader.buffer.slice(reader.offset, reader.offset + n);
+        reader.offset += n;
+        return value;
+    } else if (tag === "l" || tag === "t") {
+        const n = readUint32(reader);
+        const values = new Array(n);
+        for (let i = 0; i < n; i++) {
+            values[i] = readWireValue(reader);
+        }
+        return values;
+    } else if (tag === "d") {
+        const n = readUint32(reader);
+        const values = {};
+        for (let i = 0; i < n; i++) {
+            const key = readWireValue(reader);
+            values[key] = readWireValue(reader);
+        }
+        return values;
+    } else if (tag === "a") {
+        return readWireArray(reader);
+    } else {
+        throw new Error("Unknown wire format type tag " + tag);
+    }
+}
+
+function readWireArray(reader) {
+    const dtypeLength = reader.buffer[reader.offset++];
+    const dtype = reader.buffer.toString("latin1", reader.offset, reader.offset + dtypeLength);
+    reader.offset += dtypeLength;
+
+    const ndim = reader.buffer[reader.offset++];
+    const shape = [];
+    for (let i = 0; i < ndim; i++) {
+        shape.push(readUint64(reader));
+    }
+    const nbytes = readUint64(reader);
+    reader.offset += (8 - reader.offset % 8) % 8;
+
+    const TypedArray = WIRE_DTYPES[dtype];
+    if (TypedArray === undefined) {
+        throw new Error("Unsupported array dtype " + dtype);
+    }
+
+    // The array is copied into its own ArrayBuffer as the input buffer may not be aligned for it.
+    const start = reader.buffer.byteOffset + reader.offset;
+    const data = new TypedArray(reader.buffer.buffer.slice(start, start + nbytes));
+    reader.offset += nbytes;
+
+    // Submissions get the same plain (nested) arrays of numbers they would get from JSON.
+    const convert = dtype === "|b1" ? Boolean : Number;
+    const values = Array.from(data, convert);
+    return ndim === 0 ? values[0] : reshape(values, shape, 0, 0);
+}
+
+function reshape(values, shape, dim, start) {
+    if (dim === shape.length - 1) {
+        return values.slice(start, start + shape[dim]);
+    }
+
+    let stride = 1;
+    for (let d = dim + 1; d < shape.length; d++) {
+        stride *= shape[d];
+    }
+
+    const rows = new Array(shape[dim]);
+    for (let i = 0; i < shape[dim]; i++) {
+        rows[i] = reshape(values, shape, dim + 1, start + i * stride);
+    }
+    return rows;
+}
+
+function writeAll(fd, data) {
+    const buffer = Buffer.from(data);
+    let written = 0;
+    while (written < buffer.length) {
+        written += fs.writeSync(fd, buffer, written, buffer.length - written);
+    }
+}
+
+function runTestCases(userFunction, inputTuples, notifyFd, startIndex, step) {
+    for (let i = startIndex; i < inputTuples.length; i += step) {
+        const cpuStart = process.cpuUsage();
+        const timeStart = process.hrtime.bigint();
+        const userOutput = userFunction(...inputTuples[i]);
+        const runTime = Number(process.hrtime.bigint() - timeStart) / 1e9;
+        const cpuDiff = process.cpuUsage(cpuStart);
+
+        // Peak resident set size of the node process so far in kB. Older versions of node can only
+        // tell us the current resident set size.
+        const maxMemoryUsage = process.resourceUsage
+            ? process.resourceUsage().maxRSS
+            : process.memoryUsage().rss / 1024;
+
+        const submissionData = {
+            // JSON has no undefined, so a function that returns nothing is reported as returning null.
+            "userOutput": userOutput === undefined ? null : userOutput,
+            "runTime": runTime,
+            "cpuTime": (cpuDiff.user + cpuDiff.system) / 1e6,
+            "maxMemoryUsage": maxMemoryUsage,
+        };
+
+        writeAll(notifyFd, i + " " + JSON.stringify(submissionData) + "\n");
+    }
+}
+
+function main() {
+    const codeFile = path.resolve(process.argv[2]);
+    const inputTuples = readWire(fs.readFileSync(0));
+
+    // run_js.py appends a line to the user's code exporting their function.
+    const userFunction = require(codeFile);
+
+    runTestCases(
+        userFunction,
+        inputTuples,
+        Number(process.env.LOVELACE_NOTIFY_FD || 1),
+        Number(process.env.LOVELACE_START_INDEX || 0),
+        Number(process.env.LOVELACE_STEP || 1)
+    );
+}
+
+main();
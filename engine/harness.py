@@ -0,0 +1,249 @@
+"""
+Test case harness shared by the run scripts. It is pushed into the code runner container next to them.
+
+Python and C test cases each run in their own forked child so their CPU time and peak memory usage
+can be measured with getrusage, without instrumenting (and slowing down) the user's code. JavaScript
+and Julia test cases run inside node and julia processes which are supervised from here.
+
+Several test cases can be run at the same time when the problem or submission asks for it, and any
+test case that runs for longer than its time budget is killed and recorded as timed out while the
+remaining test cases keep running.
+"""
+
+import os
+import pickle
+import select
+import signal
+import sys
+import time
+import traceback
+
+
+class TestCaseCrashedError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def run_all_measured(func, args_iter, parallelism=1, timeout=None):
+    """
+    Call func(*args) for every args in args_iter, each in its own forked child process, with up to
+    parallelism of them running at the same time.
+
+    args_iter is only advanced right before each child is started, so it can prepare state that
+    the child inherits.
+
+    :param timeout: seconds each call may run for before it's killed
+    :return: a generator yielding (index, value, measurements) for every call, in order.
+        measurements is a dict with the wall time in seconds ("runtime"), the CPU time in seconds
+        ("cpu_time"), the peak resident set size in kB ("max_mem_usage") and whether the call was
+        killed for running out of time ("timed_out"), in which case value is None.
+    :raises TestCaseCrashedError: if any call raised an exception or was killed
+    """
+    pending = enumerate(args_iter)
+    running = {}  # read fd -> (index, pid, deadline, chunks read so far)
+    finished = {}
+    next_index = 0
+
+    try:
+        while pending or running:
+            while pending and len(running) < parallelism:
+                try:
+                    i, args = next(pending)
+                except StopIteration:
+                    pending = None
+                    break
+
+                pid, read_fd = _start_child(func, args)
+                deadline = time.monotonic() + timeout if timeout else None
+                running[read_fd] = (i, pid, deadline, [])
+
+            if not running:
+                break
+
+            deadlines = [deadline for _, _, deadline, _ in running.values() if deadline]
+            wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+
+            ready, _, _ = select.select(list(running), [], [], wait)
+            for read_fd in ready:
+                i, pid, _, chunks = running[read_fd]
+
+                chunk = os.read(read_fd, 65536)
+                if chunk:
+                    chunks.append(chunk)
+                    continue
+
+                os.close(read_fd)
+                del running[read_fd]
+                finished[i] = _finish_child(pid, b"".join(chunks))
+
+            now = time.monotonic()
+            for read_fd, (i, pid, deadline, _) in list(running.items()):
+                if deadline and now >= deadline:
+                    os.close(read_fd)
+                    del running[read_fd]
+                    finished[i] = _kill_child(pid, timeout)
+
+            # Hand back results in order, as soon as all the ones before them are done.
+            while next_index in finished:
+                value, measurements = finished.pop(next_index)
+                yield next_index, value, measurements
+                next_index += 1
+
+    finally:
+        for read_fd, (_, pid, _, _) in running.items():
+            os.close(read_fd)
+            _kill_child(pid, timeout)
+
+
+def run_sharded(start_process, n_tests, n_shards=1, timeout=None):
+    """
+    Supervise processes that run test cases themselves, like node or julia.
+
+    The test cases are split into n_shards shards, each run by its own process started with
+    start_process(start_index, step, notify_fd). It must return a subprocess.Popen running test
+    cases start_index, start_index + step, start_index + 2 * step and so on, writing a line to the
+    notify_fd file descriptor as soon as each one is done. The line is the index of the test case,
+    optionally followed by a space and its result.
+
+    A process that spends more than timeout seconds on one test case is killed and a new one is
+    started to run the rest of its shard.
+
+    :return: a generator yielding (index, timed_out, result) for each test case as it finishes, with
+        the result as bytes (empty if the process didn't send one). Test cases that never finish
+        because their process died are not yielded.
+    """
+    shards = {}  # notify read fd -> [process, index of the test case it's running, deadline, buffer]
+
+    def start(start_index):
+        if start_index >= n_tests:
+            return
+
+        read_fd, write_fd = os.pipe()
+        process = start_process(start_index, n_shards, write_fd)
+        os.close(write_fd)
+
+        deadline = time.monotonic() + timeout if timeout else None
+        shards[read_fd] = [process, start_index, deadline, bytearray()]
+
+    for shard in range(n_shards):
+        start(shard)
+
+    try:
+        while shards:
+            deadlines = [shard[2] for shard in shards.values() if shard[2]]
+            wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+
+            ready, _, _ = select.select(list(shards), [], [], wait)
+            for read_fd in ready:
+                shard = shards[read_fd]
+
+                chunk = os.read(read_fd, 65536)
+                if not chunk:
+                    # The process is done, or died in which case the caller notices the missing outputs.
+                    shard[0].wait()
+                    os.close(read_fd)
+                    del shards[read_fd]
+                    continue
+
+                # Results can be big, so the buffer is only split up once a line is complete.
+                shard[3] += chunk
+                if b"\n" not in chunk:
+                    continue
+
+                *lines, rest = shard[3].split(b"\n")
+                shard[3] = bytearray(rest)
+                for line in lines:
+                    index, _, result = line.partition(b" ")
+                    try:
+                        i = int(index)
+                    except ValueError:
+                        continue
+
+                    shard[1] = i + n_shards
+                    shard[2] = time.monotonic() + timeout if timeout else None
+                    yield i, False, bytes(result)
+
+            now = time.monotonic()
+            for read_fd, (process, i, deadline, _) in list(shards.items()):
+                if deadline and now >= deadline:
+                    process.kill()
+                    process.wait()
+                    os.close(read_fd)
+                    del shards[read_fd]
+
+                    if i < n_tests:
+                        yield i, True, b""
+                        start(i + n_shards)
+
+    finally:
+        for read_fd, (process, _, _, _) in shards.items():
+            process.kill()
+            process.wait()
+            os.close(read_fd)
+
+
+def timed_out_measurements(timeout):
+    return {"runtime": timeout, "cpu_time": 0, "max_mem_usage": 0, "timed_out": True}
+
+
+def _start_child(func, args):
+    read_fd, write_fd = os.pipe()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        exit_code = 0
+
+        try:
+            t1 = time.perf_counter()
+            value = func(*args)
+            t2 = time.perf_counter()
+
+            with os.fdopen(write_fd, mode="wb") as f:
+                pickle.dump((value, t2 - t1), file=f, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    os.close(write_fd)
+    return pid, read_fd
+
+
+def _finish_child(pid, result):
+    _, status, rusage = os.wait4(pid, 0)
+
+    if os.WIFSIGNALED(status):
+        raise TestCaseCrashedError(
+            "Your code was killed by signal {:d}.".format(os.WTERMSIG(status))
+        )
+    if os.WEXITSTATUS(status) != 0:
+        raise TestCaseCrashedError("Your code raised an exception.")
+
+    value, runtime = pickle.loads(result)
+
+    measurements = {
+        "runtime": runtime,
+        "cpu_time": rusage.ru_utime + rusage.ru_stime,
+        "max_mem_usage": rusage.ru_maxrss,
+        "timed_out": False,
+    }
+
+    return value, measurements
+
+
+def _kill_child(pid, timeout):
+    os.kill(pid, signal.SIGKILL)
+    _, _, rusage = os.wait4(pid, 0)
+
+    measurements = timed_out_measurements(timeout)
+    measurements["cpu_time"] = rusage.ru_utime + rusage.ru_stime
+    measurements["max_mem_usage"] = rusage.ru_maxrss
+
+    return None, measurements
@@ -0,0 +1,144 @@
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFullError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, func, args):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.status = Job.QUEUED
+        self.http_status = None
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def run(self):
+        self.status = Job.RUNNING
+        self.started = time.time()
+
+        try:
+            self.http_status, self.result = self.func(*self.args)
+            self.status = Job.DONE
+        except Exception:
+            logger.exception("Job {:s} failed.".format(self.id))
+            self.result = {"error": traceback.format_exc()}
+            self.status = Job.FAILED
+
+        self.finished = time.time()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished or timeout seconds have passed. Returns True if finished."""
+        return self._done.wait(timeout=timeout)
+
+    def to_dict(self):
+        job_dict = {
+            "jobId": self.id,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+        if self._done.is_set():
+            job_dict["httpStatus"] = self.http_status
+            job_dict["result"] = self.result
+
+        return job_dict
+
+
+class JobQueue:
+    """
+    A bounded in-process queue of jobs executed by a pool of worker threads.
+
+    Finished jobs are kept around so their results can be fetched, up to max_finished of them after
+    which the oldest are forgotten.
+
+    :param max_size: maximum number of jobs waiting to run before submit starts refusing new jobs
+    :param n_workers: number of worker threads running jobs
+    :param max_finished: maximum number of finished jobs to remember
+    """
+
+    def __init__(self, max_size=100, n_workers=2, max_finished=1000):
+        self.max_size = max_size
+        self.n_workers = n_workers
+        self.max_finished = max_finished
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._pid = None
+
+    def _start_workers(self):
+        # Workers are started lazily as the engine is loaded by gunicorn before it forks its workers
+        # and threads do not survive a fork.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            logger.info("Starting {:d} job queue workers...".format(self.n_workers))
+            self._pid = os.getpid()
+            self._workers = [
+                threading.Thread(target=self._work, daemon=True) for _ in range(self.n_workers)
+            ]
+            for worker in self._workers:
+                worker.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            logger.info("Running job {:s}...".format(job.id))
+            job.run()
+            self._queue.task_done()
+            self._forget_finished()
+
+    def _forget_finished(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+            for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+
+    def submit(self, func, *args):
+        """Queue up func(*args) to be run by a worker. func must return (http_status, result)."""
+        self._start_workers()
+
+        job = Job(func, args)
+
+        with self._lock:
+            self._jobs[job.id] = job
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise JobQueueFullError("Job queue is full ({:d} jobs).".format(self.max_size))
+
+        logger.info("Queued job {:s} ({:d} jobs waiting).".format(job.id, self._queue.qsize()))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
@@ -0,0 +1,178 @@
+"""
+In-process metrics exposed in the Prometheus text format on GET /metrics.
+
+Counters and histograms are updated as submissions go through the engine. Anything that already
+keeps its own numbers, like the container pool and the caches, is read when the metrics are scraped
+through collector functions registered with the registry.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, from a quick file push up to a whole run.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        return [
+            (self.name, dict(zip(self.label_names, key)), value)
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+
+        self._values = {}  # label values -> [count in each bucket, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+
+            values[0][i] += 1
+            values[1] += value
+            values[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the body of the with statement takes, even if it raises."""
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t1, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(v[0]), v[1], v[2]) for key, v in self._values.items()}
+
+        samples = []
+        for key, (buckets, total, count) in sorted(values.items()):
+            labels = dict(zip(self.label_names, key))
+
+            # Prometheus buckets are cumulative.
+            cumulative = 0
+            for upper_bound, n in zip(self.buckets + (float("inf"),), buckets):
+                cumulative += n
+                samples.append((self.name + "_bucket", dict(labels, le=upper_bound), cumulative))
+
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(("counter", metric))
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(("histogram", metric))
+        return metric
+
+    def add_collector(self, collect):
+        """
+        Register a function called on every scrape that returns a list of metrics to expose, each
+        one a (name, type, documentation, samples) tuple where samples is a list of (labels dict,
+        value) tuples.
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+
+        for metric_type, metric in self._metrics:
+            lines += _header(metric.name, metric_type, metric.documentation)
+            lines += [_sample(name, labels, value) for name, labels, value in metric.samples()]
+
+        for collect in self._collectors:
+            for name, metric_type, documentation, samples in collect():
+                lines += _header(name, metric_type, documentation)
+                lines += [_sample(name, labels, value) for labels, value in samples]
+
+        return "\n".join(lines) + "\n"
+
+
+def _header(name, metric_type, documentation):
+    return [
+        "# HELP {:s} {:s}".format(name, documentation),
+        "# TYPE {:s} {:s}".format(name, metric_type),
+    ]
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_str = ",".join(
+            '{:s}="{:s}"'.format(k, _escape(_format_value(v))) for k, v in labels.items()
+        )
+        name = "{:s}{{{:s}}}".format(name, label_str)
+    return "{:s} {:s}".format(name, _format_value(value))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "lovelace_stage_duration_seconds",
+    "Time spent in each stage of running a submission.",
+    ("stage",),
+)
+
+SUBMISSIONS = REGISTRY.counter(
+    "lovelace_submissions_total",
+    "Submissions by language, problem and outcome (passed, failed or error).",
+    ("language", "problem", "outcome"),
+)
+
+
+def time_stage(stage):
+    """Time a stage of running a submission, e.g. with time_stage("push"): ..."""
+    return STAGE_DURATION.time(stage=stage)
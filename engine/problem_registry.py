@@ -0,0 +1,188 @@
+import importlib
+import logging
+import os
+import pkgutil
+import sys
+import threading
+
+from engine.test_case_cache import problem_module_hash
+
+logger = logging.getLogger(__name__)
+
+
+class ProblemNotFoundError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class RegisteredProblem:
+    """
+    A problem module along with what the engine needs to know about it, looked up once when the
+    module is loaded.
+
+    :param name: name of the problem module
+    :param module: the imported problem module
+    :param package: the problems package the module is in
+    :param resource_dir: directory with a subdirectory of resources for each problem
+    """
+
+    def __init__(self, name, module, package, resource_dir):
+        self.name = name
+        self.module = module
+        self.package = package
+
+        self.path = module.__file__
+        self.mtime = os.path.getmtime(self.path)
+        self.hash = problem_module_hash(module)
+
+        self.function_name = module.FUNCTION_NAME
+        self.input_vars = list(module.INPUT_VARS)
+        self.output_vars = list(module.OUTPUT_VARS)
+        self.static_resources = list(getattr(module, "STATIC_RESOURCES", []))
+        self.static_resource_paths = {
+            file_name: os.path.join(resource_dir, name, file_name)
+            for file_name in self.static_resources
+        }
+        self.test_case_types = [
+            (test_type.test_name, test_type.multiplicity) for test_type in module.TestCaseType
+        ]
+
+    def changed(self):
+        """Check whether the module's file has been changed or deleted since it was loaded."""
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return True
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "functionName": self.function_name,
+            "inputVars": self.input_vars,
+            "outputVars": self.output_vars,
+            "staticResources": self.static_resources,
+            "testCaseTypes": [
+                {"name": test_name, "multiplicity": multiplicity}
+                for test_name, multiplicity in self.test_case_types
+            ],
+            "numTestCases": sum(multiplicity for _, multiplicity in self.test_case_types),
+        }
+
+
+class ProblemRegistry:
+    """
+    Every problem module in the problems package, imported up front so submissions don't have to
+    import them. Modules whose files change are reloaded the next time they're asked for, and
+    problems added after the registry was loaded are imported the first time they're asked for.
+
+    :param package_name: name of the package the problem modules are in
+    :param resource_dir: directory with a subdirectory of resources for each problem
+    """
+
+    def __init__(self, package_name="problems", resource_dir="resources"):
+        self.package_name = package_name
+        self.resource_dir = resource_dir
+        self.package = None
+
+        self._problems = {}
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        """Import every problem module in the package."""
+        self.package = importlib.import_module(self.package_name)
+
+        for module_info in pkgutil.iter_modules(self.package.__path__):
+            if module_info.ispkg:
+                continue
+            try:
+                with self._lock:
+                    self._load(module_info.name)
+            except ProblemNotFoundError:
+                # Not every module in the package is a problem, e.g. problems.test_case.
+                pass
+            except Exception:
+                logger.exception("Failed to load problem module {:s}".format(module_info.name))
+
+        logger.info("Loaded {:d} problems.".format(len(self._problems)))
+
+    def get(self, problem_name):
+        """
+        Look up a problem, reloading its module first if its file has changed.
+
+        :param problem_name: name of the problem as submitted, dashes are allowed
+        :raises ProblemNotFoundError: if there is no such problem
+        """
+        problem_name = problem_name.replace("-", "_")
+
+        problem = self._problems.get(problem_name)
+        if problem is not None and not problem.changed():
+            return problem
+
+        with self._lock:
+            # Another thread may have reloaded it while we were waiting for the lock.
+            problem = self._problems.get(problem_name)
+            if problem is not None and not problem.changed():
+                return problem
+            return self._load(problem_name)
+
+    def list(self):
+        """Every problem, picking up any problem modules that were added, changed or deleted."""
+        if self.package is None:
+            self.load_all()
+
+        problems = []
+        names = {m.name for m in pkgutil.iter_modules(self.package.__path__) if not m.ispkg}
+        for name in sorted(names | set(self._problems)):
+            try:
+                problems.append(self.get(name))
+            except ProblemNotFoundError:
+                pass
+            except Exception:
+                logger.exception("Failed to load problem module {:s}".format(name))
+        return problems
+
+    def _load(self, problem_name):
+        if not problem_name.isidentifier():
+            raise ProblemNotFoundError("Invalid problem name {!r}".format(problem_name))
+
+        if self.package is None:
+            self.package = importlib.import_module(self.package_name)
+
+        module_name = "{:s}.{:s}".format(self.package_name, problem_name)
+        old_problem = self._problems.pop(problem_name, None)
+
+        if old_problem is not None:
+            if not os.path.isfile(old_problem.path):
+                raise ProblemNotFoundError("Problem {:s} was deleted".format(problem_name))
+
+            logger.info("Reloading problem module {:s}...".format(module_name))
+            try:
+                module = importlib.reload(old_problem.module)
+            except Exception:
+                # Keep using the last version that worked until the module is fixed.
+                logger.exception("Failed to reload {:s}, keeping the old one".format(module_name))
+                old_problem.mtime = os.path.getmtime(old_problem.path)
+                self._problems[problem_name] = old_problem
+                return old_problem
+            return self._register(problem_name, module)
+
+        try:
+            if module_name in sys.modules:
+                module = sys.modules[module_name]
+            else:
+                logger.debug("Importing problem module {:s}...".format(module_name))
+                module = importlib.import_module(module_name)
+        except ModuleNotFoundError as e:
+            if e.name != module_name:
+                raise
+            raise ProblemNotFoundError("No problem module named {:s}".format(module_name))
+
+        return self._register(problem_name, module)
+
+    def _register(self, problem_name, module):
+        if not hasattr(module, "FUNCTION_NAME"):
+            raise ProblemNotFoundError("{:s} is not a problem module".format(module.__name__))
+
+        problem = RegisteredProblem(problem_name, module, self.package, self.resource_dir)
+        self._problems[problem_name] = problem
+        return problem
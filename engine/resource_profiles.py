@@ -0,0 +1,87 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceProfile:
+    """
+    Resource limits for running a submission.
+
+    The CPU, memory and process limits are applied to the code runner container itself so
+    submissions are only run in containers started with the same ones. The wall time and output size
+    limits are applied to each run.
+
+    :param cpus: how many CPUs worth of time the container may use, e.g. 0.4 for 40% of one CPU
+    :param memory: container memory limit in docker's format, e.g. "512m"
+    :param pids_limit: most processes and threads that may run in the container at the same time
+    :param wall_time: seconds a run script may take to run all the test cases before it is killed
+    :param output_size: most bytes of stdout kept from a run
+    """
+
+    def __init__(
+        self, cpus=0.4, memory="512m", pids_limit=256, wall_time=30, output_size=1024 * 1024
+    ):
+        self.cpus = cpus
+        self.memory = memory
+        self.pids_limit = pids_limit
+        self.wall_time = wall_time
+        self.output_size = output_size
+
+    @property
+    def container_key(self):
+        """Profiles with the same container key can share containers."""
+        return self.cpus, self.memory, self.pids_limit
+
+    def replace(self, **limits):
+        """
+        Return a copy of the profile with some of its limits changed.
+
+        :raises TypeError: if a limit isn't one of the profile's parameters
+        """
+        params = {
+            "cpus": self.cpus,
+            "memory": self.memory,
+            "pids_limit": self.pids_limit,
+            "wall_time": self.wall_time,
+            "output_size": self.output_size,
+        }
+        params.update(limits)
+        return ResourceProfile(**params)
+
+    def __repr__(self):
+        return (
+            "ResourceProfile(cpus={}, memory={}, pids_limit={}, "
+            "wall_time={}, output_size={})".format(
+                self.cpus, self.memory, self.pids_limit, self.wall_time, self.output_size
+            )
+        )
+
+
+DEFAULT_PROFILE = ResourceProfile(
+    cpus=float(os.environ.get("LOVELACE_CONTAINER_CPUS", 0.4)),
+    memory=os.environ.get("LOVELACE_CONTAINER_MEMORY", "512m"),
+)
+
+# Languages that need more than the default to run even trivial code.
+LANGUAGE_PROFILES = {
+    "julia": DEFAULT_PROFILE.replace(cpus=1.0, memory="1g", wall_time=60),
+}
+
+
+def resource_profile(problem, language):
+    """
+    Pick the resource profile to run a submission with. Each language starts off with its own
+    profile and problem modules can raise or lower any of its limits by setting RESOURCE_PROFILE to
+    a dict like {"memory": "1g", "wall_time": 60}.
+
+    :raises TypeError: if the problem's RESOURCE_PROFILE has a limit that doesn't exist
+    """
+    profile = LANGUAGE_PROFILES.get(language, DEFAULT_PROFILE)
+
+    limits = getattr(problem, "RESOURCE_PROFILE", None)
+    if limits:
+        profile = profile.replace(**limits)
+
+    logger.debug("Using {} for {:s} code".format(profile, language))
+    return profile
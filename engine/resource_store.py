@@ -0,0 +1,162 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+
+import engine.util as util
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceStore:
+    """
+    Problem resources shared with every code runner container through a docker volume, which the
+    containers mount read-only. Resources are copied into the volume once and linked into each run's
+    directory instead of being pushed into the container for every submission, so runs can also mmap
+    large data files straight out of it.
+
+    Static resources are stored by problem and file name. Dynamic resources are stored by a hash of
+    their contents so identical files are only ever stored once. Dynamic resources no run is using
+    are kept around for reuse until they add up to more than max_bytes, then the least recently used
+    ones are deleted.
+
+    :param directory: where the volume is mounted in the engine
+    :param volume: name of the docker volume
+    :param mount_point: where the volume is mounted in the code runner containers
+    :param max_bytes: maximum total size of the unused dynamic resources to keep
+    """
+
+    def __init__(
+        self,
+        directory,
+        volume="lovelace-resources",
+        mount_point="/resources",
+        max_bytes=256 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.volume = volume
+        self.mount_point = mount_point
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.join(directory, "static"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "dynamic"), exist_ok=True)
+
+        self._dynamic = collections.OrderedDict()  # digest -> [size, number of runs using it]
+        self._unused_size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        # Pick up the dynamic resources stored before the engine was restarted, but not any temporary
+        # files left behind by copies that never finished.
+        dynamic_dir = os.path.join(directory, "dynamic")
+        for digest in os.listdir(dynamic_dir):
+            if len(digest) != 64:
+                util.delete_file(os.path.join(dynamic_dir, digest))
+                continue
+
+            size = os.path.getsize(os.path.join(dynamic_dir, digest))
+            self._dynamic[digest] = [size, 0]
+            self._unused_size += size
+
+        with self._lock:
+            self._evict()
+
+    def container_volumes(self):
+        """Volumes to start code runner containers with, in the format docker-py expects."""
+        return {self.volume: {"bind": self.mount_point, "mode": "ro"}}
+
+    def static_resource(self, problem_name, path):
+        """
+        Store a static resource in the volume if it isn't already there.
+
+        :return: path of the resource inside the code runner containers
+        """
+        file_name = os.path.basename(path)
+        store_path = os.path.join(self.directory, "static", problem_name, file_name)
+
+        # Resources updated along with the problem replace the stored copy.
+        if not os.path.isfile(store_path) or os.path.getmtime(store_path) < os.path.getmtime(path):
+            logger.debug("Storing static resource {:s} in {:s}".format(path, store_path))
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            util.copy_file_atomic(path, store_path)
+
+        return "/".join([self.mount_point, "static", problem_name, file_name])
+
+    def acquire_dynamic_resource(self, path):
+        """
+        Store a dynamic resource in the volume unless an identical one already is. It's kept until
+        released with release_dynamic_resources.
+
+        :return: digest of the resource to release it with and its path inside the containers
+        """
+        digest = file_digest(path)
+        store_path = os.path.join(self.directory, "dynamic", digest)
+
+        with self._lock:
+            entry = self._dynamic.get(digest)
+            if entry is not None:
+                if entry[1] == 0:
+                    self._unused_size -= entry[0]
+                entry[1] += 1
+                self._dynamic.move_to_end(digest)
+                self.hits += 1
+            else:
+                self._dynamic[digest] = entry = [0, 1]
+                self.misses += 1
+                # Copied while holding the lock so no other thread sees it before it's complete.
+                logger.debug("Storing dynamic resource {:s} as {:s}".format(path, digest))
+                try:
+                    util.copy_file_atomic(path, store_path)
+                except Exception:
+                    del self._dynamic[digest]
+                    raise
+                entry[0] = os.path.getsize(store_path)
+
+        return digest, "/".join([self.mount_point, "dynamic", digest])
+
+    def release_dynamic_resources(self, digests):
+        """Let go of dynamic resources acquired by a run that's finished."""
+        with self._lock:
+            for digest in digests:
+                entry = self._dynamic.get(digest)
+                if entry is None:
+                    continue
+
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._unused_size += entry[0]
+
+            self._evict()
+
+    def _evict(self):
+        for digest, (size, users) in list(self._dynamic.items()):
+            if self._unused_size <= self.max_bytes:
+                break
+            if users > 0:
+                continue
+
+            logger.debug("Deleting unused dynamic resource {:s}".format(digest))
+            util.delete_file(os.path.join(self.directory, "dynamic", digest))
+            del self._dynamic[digest]
+            self._unused_size -= size
+
+    def stats(self):
+        with self._lock:
+            n_resources = len(self._dynamic)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "dynamicResources": n_resources,
+            "unusedBytes": self._unused_size,
+        }
+
+
+def file_digest(path):
+    m = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            m.update(chunk)
+    return m.hexdigest()
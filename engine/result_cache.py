@@ -0,0 +1,96 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import engine.util as util
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of submission results so identical resubmissions don't need to be run again.
+
+    Results are keyed by problem, language, a hash of the code and the ID of the test case set it was
+    run against. As test case set IDs are content hashes, only submissions to problems with
+    deterministic test cases will ever hit the cache.
+
+    If a directory is given, results are also written there as JSON files and looked up on a miss so
+    they survive engine restarts and are shared between workers. The directory is not size-bounded
+    and can be wiped at any time.
+
+    :param max_entries: maximum number of results to keep in memory
+    :param cache_dir: optional directory to persist results in
+    """
+
+    def __init__(self, max_entries=1024, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(problem_name, language, code, test_case_set_id):
+        m = hashlib.sha256()
+        for part in (problem_name, language, test_case_set_id, code):
+            m.update(part.encode())
+            m.update(b"\0")
+        return m.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "{:s}.json".format(key))
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+
+        if result is None and self.cache_dir:
+            try:
+                with open(self._path(key), mode="r") as f:
+                    result = json.load(f)
+                self._remember(key, result)
+            except (OSError, ValueError):
+                result = None
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return result
+
+    def put(self, key, result):
+        self._remember(key, result)
+
+        if self.cache_dir:
+            try:
+                util.write_file_atomic(self._path(key), json.dumps(result))
+            except (OSError, TypeError, ValueError):
+                logger.exception("Failed to persist result {:s}".format(key))
+
+    def _remember(self, key, result):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            n_results = len(self._results)
+        return {"hits": self.hits, "misses": self.misses, "results": n_results}
@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+import signal
+import subprocess
+import tempfile
+
+batch_id = os.path.basename(__file__).split('.')[0]
+batch_json = '{:s}.batch.json'.format(batch_id)
+output_dir = '{:s}.outputs'.format(batch_id)
+
+# Each submission runs as its own unprivileged user in a directory only that user can get into, so
+# one submission can't read or tamper with the files of another one in the same batch.
+RUN_UID_BASE = 20000
+
+# All output files from every run go into one directory so the engine can pull them out in one go.
+os.makedirs(output_dir, exist_ok=True)
+
+with open(batch_json, mode='r') as f:
+    batch = json.load(f)
+
+batch_dir = os.path.join(tempfile.gettempdir(), batch_id)
+os.mkdir(batch_dir, mode=0o711)
+
+
+def chown_tree(path, uid):
+    os.lchown(path, uid, uid)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            os.lchown(os.path.join(root, name), uid, uid)
+
+
+def demote(uid):
+    def set_ids():
+        os.setgroups([])
+        os.setgid(uid)
+        os.setuid(uid)
+        os.umask(0o077)
+    return set_ids
+
+
+# Every run's files are moved into its own directory before any of them runs. Files shared by all
+# the runs, like the harness and the resources, are copied in but stay owned by root.
+run_dirs = {}
+for k, run_id in enumerate(batch['run_ids']):
+    uid = RUN_UID_BASE + k
+    run_dir = os.path.join(batch_dir, run_id)
+    os.mkdir(run_dir, mode=0o700)
+
+    for file_name in os.listdir('.'):
+        if file_name.startswith(run_id + '.'):
+            os.replace(file_name, os.path.join(run_dir, file_name))
+
+    chown_tree(run_dir, uid)
+
+    for file_name in batch['shared_files']:
+        shutil.copy(file_name, os.path.join(run_dir, file_name), follow_symlinks=False)
+
+    run_dirs[run_id] = (uid, run_dir)
+
+results = {}
+
+for run_id in batch['run_ids']:
+    uid, run_dir = run_dirs[run_id]
+    runner_file = '{:s}.run.py'.format(run_id)
+    env = dict(os.environ, HOME=run_dir)
+
+    # Each run gets a session of its own so anything it spawned is killed with it when it times out.
+    proc = subprocess.Popen(['python3', runner_file], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, cwd=run_dir, env=env,
+                            preexec_fn=demote(uid), start_new_session=True)
+    try:
+        stdout, _ = proc.communicate(timeout=batch['timeout'])
+        exit_code = proc.returncode
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        stdout, _ = proc.communicate()
+        # Same exit code as the `timeout` command.
+        exit_code = 124
+
+    stdout = stdout[:batch['max_output']]
+    results[run_id] = {'exit_code': exit_code, 'stdout': stdout.decode('utf8', errors='replace')}
+
+    run_output_dir = os.path.join(run_dir, '{:s}.outputs'.format(run_id))
+    if os.path.isdir(run_output_dir):
+        for output_file in os.listdir(run_output_dir):
+            os.replace(os.path.join(run_output_dir, output_file), os.path.join(output_dir, output_file))
+
+    # The engine pulls user generated files from the working directory like it does for single runs.
+    for file_name in batch['user_generated_files']:
+        file_path = os.path.join(run_dir, file_name)
+        if os.path.isfile(file_path) and not os.path.islink(file_path):
+            shutil.copyfile(file_path, file_name)
+
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+shutil.rmtree(batch_dir, ignore_errors=True)
+
+with open(os.path.join(output_dir, '{:s}.results.json'.format(batch_id)), mode='w') as f:
+    json.dump(results, f)
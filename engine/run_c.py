@@ -1,12 +1,18 @@
 import os
-import pickle
+import sys
+import json
 import subprocess
 
 from ctypes import cdll, POINTER, c_int, c_double, c_bool, c_char_p, c_void_p
+from functools import lru_cache
 
-from numpy import array, ndarray, zeros, arange, issubdtype, integer, uintp, intc
+from numpy import array, ascontiguousarray, ndarray, zeros, arange, issubdtype, integer, uintp, intc, double, bool_
+from numpy import dtype as dtype_
 from numpy.ctypeslib import ndpointer
 
+from harness import run_all_measured
+from wire_format import read_file, write_file
+
 def infer_simple_ctype(var):
     if isinstance(var, int):
         return c_int
@@ -23,67 +29,94 @@ def infer_simple_ctype(var):
     else:
         raise NotImplementedError("Cannot infer ctype of type(var)={:}, var={:}".format(type(var), var))
 
-def preprocess_types(input_tuple, output_tuple):
+# numpy dtype of the C arrays that Python lists of each element ctype are converted to.
+LIST_DTYPES = {c_int: intc, c_double: double, c_bool: bool_}
+
+
+def list_array(var):
+    """
+    Convert a list of numbers or strings to a C array. The element type is inferred from the whole
+    list rather than its first element, so e.g. [1, 2.5] is an array of doubles rather than ints.
+
+    :return: the ctype of the elements and the C array
+    :raises TypeError: if the list mixes strings with other elements
+    """
+    if all(isinstance(s, str) for s in var):
+        return c_char_p, (c_char_p * len(var))(*[bytes(s, "utf-8") for s in var])
+
+    arr = array(var)
+
+    if arr.dtype.kind in "biu":
+        elem_ctype = c_int
+    elif arr.dtype.kind == "f":
+        elem_ctype = c_double
+    else:
+        raise TypeError("Cannot convert list to a C array of numbers or strings: var={:}".format(var))
+
+    return elem_ctype, ascontiguousarray(arr, dtype=LIST_DTYPES[elem_ctype])
+
+
+def marshal_types(input_tuple, output_tuple):
+    """
+    Convert a test case's inputs to arguments for the C function and allocate buffers for it to write
+    its outputs to.
+
+    Arrays whose dtype and memory layout are already what the C function expects are passed in as
+    they are rather than copied. Sizes are passed in as separate arguments, so the argument types
+    only depend on the types of the inputs and outputs, which is the returned signature key.
+
+    :return: signature key, list of arguments, list of the values the outputs are read from and list of
+        arrays the arguments point into, which have to be kept alive until the C function is called
+    """
+    input_kinds = []
     input_list = []
-    arg_ctypes = []
+    output_kinds = []
     output_list = []
+    keep_alive = []
 
     for var in input_tuple:
         if isinstance(var, str):
-            arg_ctypes.append(c_char_p)
+            input_kinds.append(("str",))
 
             # C wants bytes, not strings.
-            c_str = bytes(var, "utf-8")
-            input_list.append(c_char_p(c_str))
+            input_list.append(c_char_p(bytes(var, "utf-8")))
 
         elif isinstance(var, list):
             if isinstance(var[0], (list, tuple)):
                 raise NotImplementedError(f"Cannot infer ctype of a list containing lists or tuples: var={var}")
 
-            elem_ctype = infer_simple_ctype(var[0])
-            arr_ctype = elem_ctype * len(var)
-            arg_ctypes.append(arr_ctype)
-
-            if elem_ctype == c_char_p:
-                var = [bytes(s, "utf-8") for s in var]
-
-            arr = arr_ctype(*var)
+            elem_ctype, arr = list_array(var)
+            input_kinds.append(("list", elem_ctype))
             input_list.append(arr)
 
             # For a Python list, we add an extra argument for the size of the C array.
-            arg_ctypes.append(c_int)
             input_list.append(len(var))
 
         elif isinstance(var, ndarray):
-            if issubdtype(var.dtype, integer):
-                var = var.astype(intc)
+            if var.ndim not in (1, 2):
+                raise NotImplementedError("Cannot preprocess input numpy ndarray of shape {:}".format(var.shape))
 
-            if len(var.shape) == 1:
-                arr_ctype = ndpointer(dtype=var.dtype, ndim=len(var.shape), shape=var.shape, flags="C_CONTIGUOUS")
-                arg_ctypes.append(arr_ctype)
-                input_list.append(var)
+            # Only copies the array if it has to, e.g. to convert 64-bit integers to C ints.
+            dtype = intc if issubdtype(var.dtype, integer) else var.dtype
+            var = ascontiguousarray(var, dtype=dtype)
+            input_kinds.append(("ndarray", var.dtype, var.ndim))
 
-            elif len(var.shape) == 2:
+            if var.ndim == 1:
+                input_list.append(var)
+            else:
                 # If the numpy ndarray is two-dimensional then we want to pass in an array of pointers of type uintp
                 # which corresponds to a double** type. This enables the C function to index into the array as if it
                 # were a 2D array, e.g. like arr[i][j]. We could pass it in as we do for the 1D case but then the C
                 # function would be restricted to indexing the array linearly, e.g. arr[i].
-                var_pp = (var.ctypes.data + arange(var.shape[0]) * var.strides[0]).astype(uintp)
-                var_ptr_t = ndpointer(dtype=uintp)
-
-                arg_ctypes.append(var_ptr_t)
-                input_list.append(var_pp)
-
-            else:
-                raise NotImplementedError("Cannot preprocess input numpy ndarray of shape {:}".format(var.shape))
+                input_list.append(row_pointers(var))
+                keep_alive.append(var)
 
             # For a numpy ndarray, we add extra arguments for each dimension size of the input C array.
-            for s in var.shape:
-                arg_ctypes.append(c_int)
-                input_list.append(s)
+            input_list.extend(var.shape)
 
         else:
-            arg_ctypes.append(infer_simple_ctype(var))
+            ctype = infer_simple_ctype(var)
+            input_kinds.append(("scalar", ctype))
             input_list.append(var)
 
     if len(output_tuple) == 1:
@@ -94,67 +127,118 @@ def preprocess_types(input_tuple, output_tuple):
             # C function. So we add an extra argument for a pointer to the pre-allocated C array and set the return type
             # to void.
             if isinstance(rvar[0], (list, tuple)):
-                raise NotImplementedError(f"Cannot infer ctype of a list containing lists or tuples: var={var}")
+                raise NotImplementedError(f"Cannot infer ctype of a list containing lists or tuples: var={rvar}")
 
-            arr = array(rvar)
-
-            arr_ctype = ndpointer(dtype=arr.dtype, ndim=len(arr.shape), shape=arr.shape, flags="C_CONTIGUOUS")
-            arg_ctypes.append(arr_ctype)
-
-            input_list.append(arr)
-
-            res_ctype = c_void_p
+            dtype = array(rvar).dtype
+            output_kinds.append(("ndarray", dtype, 1))
 
+            arr, arg = output_buffer(dtype, (len(rvar),))
+            input_list.append(arg)
             output_list.append(arr)
 
         elif isinstance(rvar, ndarray):
-            new_dtype = intc if issubdtype(rvar.dtype, integer) else rvar.dtype
-
-            if len(rvar.shape) == 1:
-                arr_ctype = ndpointer(dtype=new_dtype, ndim=len(rvar.shape), shape=rvar.shape, flags="C_CONTIGUOUS")
-                arr = zeros(rvar.shape, dtype=new_dtype)
-
-                arg_ctypes.append(arr_ctype)
-                input_list.append(arr)
-                output_list.append(arr)
-
-            elif len(rvar.shape) == 2:
-                arr = zeros(rvar.shape, dtype=new_dtype)
-                arr_pp = (arr.ctypes.data + arange(arr.shape[0]) * arr.strides[0]).astype(uintp)
-                arr_ptr_t = ndpointer(dtype=uintp)
-
-                arg_ctypes.append(arr_ptr_t)
-                input_list.append(arr_pp)
-                output_list.append(arr)
-
-            else:
+            if rvar.ndim not in (1, 2):
                 raise NotImplementedError("Cannot preprocess output numpy ndarray of shape {:}".format(rvar.shape))
 
-            res_ctype = c_void_p
+            dtype = dtype_(intc) if issubdtype(rvar.dtype, integer) else rvar.dtype
+            output_kinds.append(("ndarray", dtype, rvar.ndim))
+
+            arr, arg = output_buffer(dtype, rvar.shape)
+            input_list.append(arg)
+            output_list.append(arr)
 
         else:
-            res_ctype = infer_simple_ctype(rvar)
+            output_kinds.append(("return", infer_simple_ctype(rvar)))
 
     else:
         # In the case of multiple return types, we add extra input arguments (one pointer per each return variable)
         # and the C function will mutate the values pointed to by the pointers. These arguments will always be at
         # the very end of the argument list. The return type is set to void.
         for var in output_tuple:
-            type = infer_simple_ctype(var)
-            ptype = POINTER(type)
-
-            arg_ctypes.append(ptype)
+            ctype = infer_simple_ctype(var)
+            output_kinds.append(("pointer", ctype))
 
-            val = type()  # Create a value, e.g. c_int or c_double, that will be mutated by the C function.
+            val = ctype()  # Create a value, e.g. c_int or c_double, that will be mutated by the C function.
             input_list.append(val)
             output_list.append(val)
 
-        res_ctype = c_void_p
+    return (tuple(input_kinds), tuple(output_kinds)), input_list, output_list, keep_alive
+
+
+@lru_cache(maxsize=None)
+def signature(key):
+    """The argument types and return type of the C function for a signature key."""
+    input_kinds, output_kinds = key
+
+    arg_ctypes = []
+    res_ctype = c_void_p
+
+    for kind, *details in input_kinds:
+        if kind == "str":
+            arg_ctypes.append(c_char_p)
+        elif kind == "list":
+            (elem_ctype,) = details
+            if elem_ctype == c_char_p:
+                arg_ctypes.append(POINTER(c_char_p))
+            else:
+                arg_ctypes.append(ndpointer(dtype=LIST_DTYPES[elem_ctype], ndim=1, flags="C_CONTIGUOUS"))
+            arg_ctypes.append(c_int)
+        elif kind == "ndarray":
+            dtype, ndim = details
+            arg_ctypes.append(array_ctype(dtype, ndim))
+            arg_ctypes.extend([c_int] * ndim)
+        else:
+            (ctype,) = details
+            arg_ctypes.append(ctype)
+
+    for kind, *details in output_kinds:
+        if kind == "ndarray":
+            dtype, ndim = details
+            arg_ctypes.append(array_ctype(dtype, ndim))
+        elif kind == "pointer":
+            (ctype,) = details
+            arg_ctypes.append(POINTER(ctype))
+        else:
+            (res_ctype,) = details
+
+    return arg_ctypes, res_ctype
+
+
+def array_ctype(dtype, ndim):
+    if ndim == 1:
+        return ndpointer(dtype=dtype, ndim=1, flags="C_CONTIGUOUS")
+    # Two-dimensional arrays are passed in as an array of pointers to their rows.
+    return ndpointer(dtype=uintp, ndim=1, flags="C_CONTIGUOUS")
+
+
+@lru_cache(maxsize=None)
+def row_offsets(n_rows, row_stride):
+    return arange(n_rows, dtype=uintp) * uintp(row_stride)
+
+
+def row_pointers(arr):
+    """Array with a pointer to the start of each row of a 2D array."""
+    return row_offsets(arr.shape[0], arr.strides[0]) + uintp(arr.ctypes.data)
+
+
+# Output buffers are reused from one test case to the next. Each test case runs in a forked child so the C function
+# only ever writes to the child's copy of a buffer, and the ones here stay zeroed.
+_output_buffers = {}
+
+
+def output_buffer(dtype, shape):
+    """
+    A zeroed array for the C function to write an output to, along with the argument to pass in for it.
+    """
+    key = (dtype, tuple(shape))
+    if key not in _output_buffers:
+        arr = zeros(shape, dtype=dtype)
+        _output_buffers[key] = (arr, arr if arr.ndim == 1 else row_pointers(arr))
+    return _output_buffers[key]
 
-    return arg_ctypes, res_ctype, input_list, output_list
 
 def ctype_output(var):
-    if isinstance(var, (c_int, c_double)):
+    if isinstance(var, (c_int, c_double, c_bool)):
         return var.value
     elif isinstance(var, bytes):
         return var.decode("utf-8")
@@ -164,35 +248,46 @@ def ctype_output(var):
         return var
 
 run_id = os.path.basename(__file__).split('.')[0]
-input_pickle = "{:s}.input.pickle".format(run_id)
-correct_pickle = "{:s}.correct.pickle".format(run_id)
+input_file = "{:s}.input.bin".format(run_id)
+correct_file = "{:s}.correct.bin".format(run_id)
+options_json = "{:s}.options.json".format(run_id)
 code_file = "{:s}.c".format(run_id)
 lib_file = "{:s}.so".format(run_id)
+output_dir = "{:s}.outputs".format(run_id)
+
+# All output files go into one directory so the engine can pull them out in one go.
+os.makedirs(output_dir, exist_ok=True)
+
+# When run by the runner daemon each output file is reported as soon as it's written, so results can
+# be streamed back one test case at a time.
+result_fd = int(os.environ.get("LOVELACE_RESULT_FD", -1))
+
+
+def report_output(output_file):
+    if result_fd >= 0:
+        sys.stdout.flush()
+        os.write(result_fd, (output_file + "\n").encode())
+
 
-with open(input_pickle, mode='rb') as f:
-    input_tuples = pickle.load(f)
+input_tuples = read_file(input_file)
+correct_output_tuples = read_file(correct_file)
 
-with open(correct_pickle, mode='rb') as f:
-    correct_output_tuples = pickle.load(f)
+with open(options_json, mode='r') as f:
+    options = json.load(f)
 
-# Compile the user's C code.
+# Compile the user's C code unless the engine already pushed in a compiled shared library for it.
 # -fPIC for position-independent code, needed for shared libraries to work no matter where in memory they are loaded.
 # check=True will raise a CalledProcessError for non-zero return codes (user code failed to compile.)
-subprocess.run(["gcc", "-fPIC", "-shared", "-o", lib_file, code_file], check=True)
+if not os.path.isfile(lib_file):
+    subprocess.run(["gcc", "-fPIC", "-shared", "-o", lib_file, code_file], check=True)
 
 # Load the compiled shared library. We use the absolute path as the cwd is not in LD_LIBRARY_PATH so cdll won't find
 # the .so file if we use a relative path or just a filename.
 cwd = os.path.dirname(os.path.realpath(__file__))
 _lib = cdll.LoadLibrary(os.path.join(cwd, lib_file))
 
-for i, (input_tuple, correct_output_tuple) in enumerate(zip(input_tuples, correct_output_tuples)):
-    # Use the input and output tuple to infer the type of input arguments and return value. We do this again for each
-    # test case in case outputs change type or arrays change size.
-    arg_ctypes, res_ctype, ctyped_input_list, output_list = preprocess_types(input_tuple, correct_output_tuple)
-
-    _lib.$FUNCTION_NAME.argtypes = arg_ctypes
-    _lib.$FUNCTION_NAME.restype = res_ctype
 
+def call_user_function(ctyped_input_list, res_ctype, output_list, keep_alive):
     # $FUNCTION_NAME will be replaced by the name of the user's function by the CodeRunner before this script is run.
     user_output = _lib.$FUNCTION_NAME(*ctyped_input_list)
 
@@ -202,16 +297,46 @@ for i, (input_tuple, correct_output_tuple) in enumerate(zip(input_tuples, correc
         user_output = []
         for var in output_list:
             user_output.append(ctype_output(var))
-        user_output = tuple(user_output)
+        return tuple(user_output)
     else:
-        user_output = ctype_output(user_output)
+        return ctype_output(user_output)
+
+
+def call_args():
+    key_in_use = None
+
+    for input_tuple, correct_output_tuple in zip(input_tuples, correct_output_tuples):
+        # Use the input and output tuple to infer the type of input arguments and return value. We do this again for
+        # each test case in case outputs change type, but the argument types are only worked out and set when they
+        # change. The child process running the test case inherits the argument types as they are when it's started.
+        key, ctyped_input_list, output_list, keep_alive = marshal_types(input_tuple, correct_output_tuple)
+        arg_ctypes, res_ctype = signature(key)
+
+        if key != key_in_use:
+            _lib.$FUNCTION_NAME.argtypes = arg_ctypes
+            _lib.$FUNCTION_NAME.restype = res_ctype
+            key_in_use = key
 
+        yield ctyped_input_list, res_ctype, output_list, keep_alive
+
+
+# Only the call itself is run in a child process and measured, not the type conversions. Several test cases can run
+# at the same time if the problem or submission asks for it, and a test case that runs out of time is killed without
+# losing the results of the other test cases.
+results = run_all_measured(
+    call_user_function, call_args(), options["parallelism"], options["test_case_timeout"]
+)
+
+for i, user_output, measurements in results:
     output_dict = {
         'user_output': user_output if isinstance(user_output, tuple) else (user_output,),
-        'runtime': 0,
-        'max_mem_usage': 0
+        'runtime': measurements['runtime'],
+        'cpu_time': measurements['cpu_time'],
+        'max_mem_usage': measurements['max_mem_usage'],
+        'timed_out': measurements['timed_out'],
     }
 
-    output_pickle = '{:s}.output{:d}.pickle'.format(run_id, i)
-    with open(output_pickle, mode='wb') as f:
-        pickle.dump(output_dict, file=f, protocol=pickle.HIGHEST_PROTOCOL)
+    output_file = os.path.join(output_dir, '{:s}.output{:d}.bin'.format(run_id, i))
+    write_file(output_file, output_dict)
+
+    report_output(output_file)
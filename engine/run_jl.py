@@ -1,83 +1,116 @@
 import os
+import sys
 import json
-import pickle
 import subprocess
 
+from harness import run_sharded, timed_out_measurements
+from wire_format import read_file, write_file
+
 run_id = os.path.basename(__file__).split('.')[0]
-input_json = '{:s}.input.json'.format(run_id)
+input_file = '{:s}.input.bin'.format(run_id)
+options_json = '{:s}.options.json'.format(run_id)
 code_file = '{:s}.jl'.format(run_id)
+driver_file = '{:s}.driver.jl'.format(run_id)
+output_dir = '{:s}.outputs'.format(run_id)
 
-glue_code = '''
-import JSON
+# All output files go into one directory so the engine can pull them out in one go.
+os.makedirs(output_dir, exist_ok=True)
 
-timed_function_call(f, input) = @timed f(input...)
+# When run by the runner daemon each output file is reported as soon as it's written, so results can
+# be streamed back one test case at a time.
+result_fd = int(os.environ.get('LOVELACE_RESULT_FD', -1))
+
+
+def report_output(output_file):
+    if result_fd >= 0:
+        sys.stdout.flush()
+        os.write(result_fd, (output_file + '\n').encode())
 
-function json_array_dim(a)
-    if length(size(a)) > 0
-        return 1 + json_array_dim(a[1])
-    else
-        return 0
-    end
-end
 
-function json_array_eltype(a)
-    if eltype(a) == Any
-        return json_array_eltype(a[1])
-    else
-        return eltype(a)
-    end
+# The glue code lives in the LovelaceGlue Julia package which is baked into a custom sysimage along
+# with JSON when the code runner image is built, so it isn't loaded and compiled again for every run.
+sysimage = '/usr/local/lib/lovelace/lovelace.so'
+
+# The user's code is evaluated in a fresh module so it can't clash with the glue code.
+driver_code = '''
+using LovelaceGlue
+
+module UserCode
+include("{:s}")
 end
 
-juliafy_json(t) = t
-juliafy_json(a::Array) = convert(Array{{json_array_eltype(a), json_array_dim(a)}}, hcat(a...))
+run_test_cases(UserCode.$FUNCTION_NAME, "{:s}", "{:s}")
+'''.format(code_file, input_file, run_id)
 
-tupleit(t) = tuple(t)
-tupleit(t::Tuple) = t
+with open(driver_file, mode='w') as f:
+    f.write(driver_code)
 
-input_tuples = JSON.Parser.parsefile("{:s}")
+julia_cmd = ["julia"]
+if os.path.isfile(sysimage):
+    julia_cmd.append("--sysimage={:s}".format(sysimage))
 
-for (i, input_tuple) in enumerate(input_tuples)
+input_tuples = read_file(input_file)
 
-    input_tuple = [juliafy_json(elem) for elem in input_tuple]
+with open(options_json, mode='r') as f:
+    options = json.load(f)
 
-    output_tuple = $FUNCTION_NAME(input_tuple...) |> tupleit
 
-    open("{:s}.output$i.json", "w") do f
-       JSON.print(f, output_tuple)
-    end
-end
-'''.format(input_json, run_id)
+def write_output(i, timed_out=False):
+    if timed_out:
+        output_dict = dict(timed_out_measurements(options['test_case_timeout']), user_output=None)
+    else:
+        output_json = "{:s}.output{:d}.json".format(run_id, i+1)
 
-# This will append glue code to the code file to run the test cases.
-with open(code_file, mode='a') as f:
-    f.write(glue_code)
+        with open(output_json, mode='r') as f:
+            submission_data = json.loads(f.read())
 
-subprocess.run(["julia", code_file])
+        user_output = submission_data['userOutput']
 
-with open(input_json, mode='rb') as f:
-    input_tuples = json.load(f)
+        if isinstance(user_output, list) and len(user_output) == 1 and isinstance(user_output[0], list):
+            user_output = (user_output[0],)  # Solution is a list
+        elif isinstance(user_output, list):
+            user_output = tuple(user_output)  # Solution is a "multiple return"
+        else:
+            user_output = (user_output,)  # Solution is a string or number
 
-for i, _ in enumerate(input_tuples):
-    output_json = "{:s}.output{:d}.json".format(run_id, i+1)
+        user_output = user_output if isinstance(user_output, tuple) else (user_output,)
 
-    with open(output_json, mode='r') as f:
-        user_output = json.loads(f.read())
+        output_dict = {
+            'user_output': user_output,
+            'runtime': submission_data['runTime'],
+            'cpu_time': submission_data['cpuTime'],
+            'max_mem_usage': submission_data['maxMemoryUsage'],
+            'timed_out': False,
+        }
+
+    output_file = os.path.join(output_dir, "{:s}.output{:d}.bin".format(run_id, i))
+    write_file(output_file, output_dict)
+
+    report_output(output_file)
 
-    if isinstance(user_output, list) and len(user_output) == 1 and isinstance(user_output[0], list):
-        user_output = (user_output[0],)  # Solution is a list
-    elif isinstance(user_output, list):
-        user_output = tuple(user_output)  # Solution is a "multiple return"
-    else:
-        user_output = (user_output,)  # Solution is a string or number
 
-    user_output = user_output if isinstance(user_output, tuple) else (user_output,)
+def start_julia(start_index, step, notify_fd):
+    julia_env = dict(
+        os.environ,
+        LOVELACE_NOTIFY_FD=str(notify_fd),
+        LOVELACE_START_INDEX=str(start_index),
+        LOVELACE_STEP=str(step),
+    )
+    return subprocess.Popen(julia_cmd + [driver_file], env=julia_env, pass_fds=(notify_fd,))
 
-    output_dict = {
-        'user_output': user_output,
-        'runtime': 0,
-        'max_mem_usage': 0,
-    }
 
-    output_pickle = "{:s}.output{:d}.pickle".format(run_id, i)
-    with open(output_pickle, mode='wb') as f:
-        pickle.dump(output_dict, file=f, protocol=pickle.HIGHEST_PROTOCOL)
+# Julia runs all the test cases, or each process runs one shard of them if they're run in parallel.
+# It writes the index of each test case down a pipe as soon as it's done so its output can be reported
+# without waiting for the rest, and so a test case that runs out of time can be killed and the rest of
+# the test cases run by a new julia process.
+n_shards = max(1, min(options['parallelism'], len(input_tuples)))
+results = run_sharded(start_julia, len(input_tuples), n_shards, options['test_case_timeout'])
+
+written = set()
+for i, timed_out, _ in results:
+    write_output(i, timed_out)
+    written.add(i)
+
+for i, _ in enumerate(input_tuples):
+    if i not in written:
+        write_output(i)
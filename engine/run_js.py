@@ -1,68 +1,96 @@
 import os
+import sys
 import json
-import pickle
 import subprocess
 
+from harness import run_sharded, timed_out_measurements, TestCaseCrashedError
+from wire_format import read_file, write_file
+
 run_id = os.path.basename(__file__).split('.')[0]
-input_pickle = "{:s}.input.pickle".format(run_id)
+input_file = "{:s}.input.bin".format(run_id)
+options_json = "{:s}.options.json".format(run_id)
 code_file = "{:s}.js".format(run_id)
+output_dir = "{:s}.outputs".format(run_id)
+
+# All output files go into one directory so the engine can pull them out in one go.
+os.makedirs(output_dir, exist_ok=True)
+
+# When run by the runner daemon each output file is reported as soon as it's written, so results can
+# be streamed back one test case at a time.
+result_fd = int(os.environ.get("LOVELACE_RESULT_FD", -1))
+
+
+def report_output(output_file):
+    if result_fd >= 0:
+        sys.stdout.flush()
+        os.write(result_fd, (output_file + "\n").encode())
+
+
+input_tuples = read_file(input_file)
+
+with open(options_json, mode='r') as f:
+    options = json.load(f)
+
+# The harness loads the user's code once as a module, so it has to export the user's function.
+# $FUNCTION_NAME will be replaced by the name of the user's function by the CodeRunner before this script is run.
+with open(code_file, mode='a') as f:
+    f.write("\nmodule.exports = $FUNCTION_NAME;\n")
+
+
+def write_output(i, timed_out=False, result=None):
+    if timed_out:
+        output_dict = dict(timed_out_measurements(options['test_case_timeout']), user_output=None)
+    else:
+        submission_data = json.loads(result)
+
+        user_output = submission_data['userOutput']
+        runtime = submission_data['runTime']
+        cpu_time = submission_data['cpuTime']
+        max_mem_usage = submission_data['maxMemoryUsage']
+
+        if not isinstance(user_output, list):
+            user_output = (user_output,)  # Solution is a string, number, or dict, meaning it is a single-value return.
+
+        output_dict = {
+            'user_output': user_output,
+            'runtime': runtime,
+            'cpu_time': cpu_time,
+            'max_mem_usage': max_mem_usage,
+            'timed_out': False,
+        }
+
+    output_file = os.path.join(output_dir, "{:s}.output{:d}.bin".format(run_id, i))
+    write_file(output_file, output_dict)
+
+    report_output(output_file)
+
+
+def start_node(start_index, step, notify_fd):
+    node_env = dict(
+        os.environ,
+        LOVELACE_NOTIFY_FD=str(notify_fd),
+        LOVELACE_START_INDEX=str(start_index),
+        LOVELACE_STEP=str(step),
+    )
+    # Node reads the inputs straight from the input file rather than having them pasted into the code.
+    with open(input_file, mode='rb') as stdin:
+        return subprocess.Popen(
+            ["node", "harness.js", code_file], env=node_env, stdin=stdin, pass_fds=(notify_fd,)
+        )
+
+
+# Run all test cases in one node process, or one per shard of the test cases if they're run in parallel.
+# Node sends each result back down a pipe as soon as the test case is done so it can be reported without
+# waiting for the rest, and so a test case that runs out of time can be killed and the rest of the test
+# cases run by a new node process.
+n_shards = max(1, min(options['parallelism'], len(input_tuples)))
+results = run_sharded(start_node, len(input_tuples), n_shards, options['test_case_timeout'])
+
+written = set()
+for i, timed_out, result in results:
+    write_output(i, timed_out, result)
+    written.add(i)
 
-with open(input_pickle, mode='rb') as f:
-    input_tuples = pickle.load(f)
-
-for i, input_tuple in enumerate(input_tuples):
-    output_json = "{:s}.output{:d}.json".format(run_id, i)
-
-    # $FUNCTION_NAME will be replaced by the name of the user's function by the CodeRunner
-    # before this script is run.
-    func_call_str = "$FUNCTION_NAME(" + ", ".join([json.dumps(arg) for arg in input_tuple]) + ")"
-
-    glue_code = """
-    (() => {{ // Double braces to avoid interfering with Python brace-based string formatting.
-        var timeStart = process.hrtime();
-        var userOutput = {:s};
-        var timeDiff = process.hrtime(timeStart);
-        var runTime = timeDiff[0] + (timeDiff[1] / 1e9);
-    
-        var maxMemoryUsage = 0;
-    
-        var submissionData = {{
-            "userOutput": userOutput,
-            "runTime": runTime,
-            "maxMemoryUsage": maxMemoryUsage
-        }};
-    
-        var fs = require('fs');
-        var data = JSON.stringify(submissionData);
-        fs.writeFileSync('{:s}', data);
-    }})();
-    """.format(func_call_str, output_json)
-
-    # This will append glue code to the code file for each test case.
-    with open(code_file, mode='a') as f:
-        f.write(glue_code)
-
-# Run all test cases at the same time so we only run `node` once.
-subprocess.run(["node", code_file])
-
-for i, _ in enumerate(input_tuples):
-    output_json = "{:s}.output{:d}.json".format(run_id, i)
-    with open(output_json, mode='r') as f:
-        submission_data = json.loads(f.read())
-
-    user_output = submission_data['userOutput']
-    runtime = submission_data['runTime']
-    max_mem_usage = submission_data['maxMemoryUsage']
-
-    if not isinstance(user_output, list):
-        user_output = (user_output,)  # Solution is a string, number, or dict, meaning it is a single-value return.
-
-    output_dict = {
-        'user_output': user_output,
-        'runtime': runtime,
-        'max_mem_usage': max_mem_usage,
-    }
-
-    output_pickle = "{:s}.output{:d}.pickle".format(run_id, i)
-    with open(output_pickle, mode='wb') as f:
-        pickle.dump(output_dict, file=f, protocol=pickle.HIGHEST_PROTOCOL)
+missing = [i for i, _ in enumerate(input_tuples) if i not in written]
+if missing:
+    raise TestCaseCrashedError("Your code crashed before finishing test case {:d}.".format(missing[0]))
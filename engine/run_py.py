@@ -1,37 +1,59 @@
 import os
-import time
-import pickle
+import sys
+import json
 import importlib
-import tracemalloc
+
+from harness import run_all_measured
+from wire_format import read_file, write_file
 
 run_id = os.path.basename(__file__).split('.')[0]
-input_pickle = '{:s}.input.pickle'.format(run_id)
+input_file = '{:s}.input.bin'.format(run_id)
+options_json = '{:s}.options.json'.format(run_id)
+output_dir = '{:s}.outputs'.format(run_id)
+
+# All output files go into one directory so the engine can pull them out in one go.
+os.makedirs(output_dir, exist_ok=True)
+
+# When run by the runner daemon each output file is reported as soon as it's written, so results can
+# be streamed back one test case at a time.
+result_fd = int(os.environ.get('LOVELACE_RESULT_FD', -1))
+
+
+def report_output(output_file):
+    if result_fd >= 0:
+        sys.stdout.flush()
+        os.write(result_fd, (output_file + '\n').encode())
+
 
 user_module = importlib.import_module(run_id)
 
-with open(input_pickle, mode='rb') as f:
-    input_tuples = pickle.load(f)
+input_tuples = read_file(input_file)
 
-for i, input_tuple in enumerate(input_tuples):
-    tracemalloc.start()
-    t1 = time.time()
+with open(options_json, mode='r') as f:
+    options = json.load(f)
 
-    # $FUNCTION_NAME will be replaced by the name of the user's function by the CodeRunner before this script is run.
-    user_output = user_module.$FUNCTION_NAME(*input_tuple)
+# Each test case is run in a child process so its CPU time and memory usage can be measured, so
+# several of them can run at the same time if the problem or submission asks for it, and so it can be
+# killed if it runs out of time without losing the results of the other test cases.
+# $FUNCTION_NAME will be replaced by the name of the user's function by the CodeRunner before this script is run.
+results = run_all_measured(
+    user_module.$FUNCTION_NAME, input_tuples, options['parallelism'], options['test_case_timeout']
+)
 
-    t2 = time.time()
-    _, max_mem_usage = tracemalloc.get_traced_memory()
-    tracemalloc.stop()
+for i, user_output, measurements in results:
 
     user_output = user_output if isinstance(user_output, tuple) else (user_output,)
-    runtime = t2 - t1
 
     output_dict = {
         'user_output': user_output,
-        'runtime': runtime,
-        'max_mem_usage': max_mem_usage
+        'runtime': measurements['runtime'],
+        'cpu_time': measurements['cpu_time'],
+        'max_mem_usage': measurements['max_mem_usage'],
+        'timed_out': measurements['timed_out'],
         }
 
-    output_pickle = '{:s}.output{:d}.pickle'.format(run_id, i)
-    with open(output_pickle, mode='wb') as f:
-        pickle.dump(output_dict, file=f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Anything the user returns that the wire format can't carry is sent back as its repr.
+    output_file = os.path.join(output_dir, '{:s}.output{:d}.bin'.format(run_id, i))
+    write_file(output_file, output_dict, default=repr)
+
+    report_output(output_file)
@@ -0,0 +1,125 @@
+import base64
+import collections
+import json
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+# Port the runner daemon listens on inside each code runner container (see runner_daemon.py).
+RUNNER_PORT = 14715
+
+
+class RunnerAddress(collections.namedtuple("RunnerAddress", ["host", "port", "token"])):
+    """
+    Where to reach the runner daemon of a container. Every request carries the container's token,
+    which only the engine and that container know, so nothing else on the network can run jobs
+    through the daemon.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        # Leaves out the token so addresses can be logged.
+        return "{}:{}".format(self.host, self.port)
+
+
+class RunnerUnavailableError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def runner_execute(address, script_path, timeout=30, connect_timeout=2, max_output=None):
+    """
+    Run a script through the runner daemon of a code runner container.
+
+    :param address: RunnerAddress of the runner daemon
+    :param script_path: path of the run script inside the container
+    :param timeout: seconds the script may run for before it is killed
+    :param connect_timeout: seconds to wait for the daemon to accept the connection
+    :param max_output: most bytes of stdout to send back, the daemon's default if not given
+    :return: the exit code and stdout of the script. The exit code is 124 if it timed out.
+    :raises RunnerUnavailableError: if the daemon could not be reached or did not reply
+    """
+    request = {"script": script_path, "timeout": timeout, "token": address.token}
+    if max_output:
+        request["max_output"] = max_output
+    logger.debug("Sending job {:s} to runner daemon at {}".format(script_path, address))
+
+    try:
+        with socket.create_connection(address[:2], timeout=connect_timeout) as conn:
+            # Leave the daemon some slack to kill the job and reply once it times out.
+            conn.settimeout(timeout + 10)
+            with conn.makefile(mode="rwb") as f:
+                f.write(json.dumps(request).encode() + b"\n")
+                f.flush()
+                reply = f.readline()
+    except OSError as e:
+        raise RunnerUnavailableError(
+            "Could not reach runner daemon at {}: {}".format(address, e)
+        )
+
+    try:
+        reply = json.loads(reply)
+        return reply["exit_code"], reply["stdout"]
+    except (ValueError, KeyError, TypeError):
+        raise RunnerUnavailableError("Bad reply from runner daemon at {}".format(address))
+
+
+def runner_execute_stream(address, script_path, timeout=30, connect_timeout=2, max_output=None):
+    """
+    Run a script through the runner daemon, getting output files back as soon as the script reports
+    them instead of pulling them out of the container once it's done.
+
+    The connection is made straight away so an unreachable daemon raises before anything is yielded.
+
+    :return: a generator yielding ("output", file name, file contents, stdout so far) for each output
+        file then finally ("exit", exit code, stdout)
+    :raises RunnerUnavailableError: if the daemon could not be reached or did not reply
+    """
+    request = {"script": script_path, "timeout": timeout, "stream": True, "token": address.token}
+    if max_output:
+        request["max_output"] = max_output
+    logger.debug(
+        "Sending streaming job {:s} to runner daemon at {}".format(script_path, address)
+    )
+
+    try:
+        conn = socket.create_connection(address[:2], timeout=connect_timeout)
+        conn.settimeout(timeout + 10)
+        f = conn.makefile(mode="rwb")
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+    except OSError as e:
+        raise RunnerUnavailableError(
+            "Could not reach runner daemon at {}: {}".format(address, e)
+        )
+
+    return _read_frames(conn, f, address)
+
+
+def _read_frames(conn, f, address):
+    with conn, f:
+        while True:
+            try:
+                frame = json.loads(f.readline())
+            except OSError as e:
+                raise RunnerUnavailableError(
+                    "Lost connection to runner daemon at {}: {}".format(address, e)
+                )
+            except ValueError:
+                raise RunnerUnavailableError("Bad reply from runner daemon at {}".format(address))
+
+            try:
+                if "exit_code" in frame:
+                    event = ("exit", frame["exit_code"], frame["stdout"])
+                else:
+                    data = base64.b64decode(frame["data"])
+                    event = ("output", frame["output"], data, frame["stdout"])
+            except (KeyError, TypeError, ValueError):
+                raise RunnerUnavailableError("Bad reply from runner daemon at {}".format(address))
+
+            yield event
+
+            if event[0] == "exit":
+                return
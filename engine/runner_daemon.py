@@ -0,0 +1,229 @@
+"""
+Long-lived supervisor that runs inside each code runner container.
+
+It imports everything the run scripts need once at startup then waits for jobs on a TCP socket. Each
+job names a run script to execute. The daemon forks a child per job which runs the script and exits,
+so every submission gets a clean process without paying for interpreter startup or imports.
+
+Protocol: the engine sends one JSON line {"script": <path>, "timeout": <seconds>, "token": <str>}
+and receives one JSON line {"exit_code": <int>, "stdout": <str>} back on the same connection. The
+token must match the LOVELACE_RUNNER_TOKEN environment variable the container was started with,
+otherwise the connection is closed without running anything. Like the `timeout`
+command, an exit code of 124 means the job took too long and was killed. The request may also set
+"max_output" to the most bytes of stdout to keep.
+
+If the request has "stream": true, run scripts may report each output file as soon as it's written by
+writing its path to the file descriptor named by the LOVELACE_RESULT_FD environment variable. The
+daemon sends each one straight back as a JSON line {"output": <file name>, "data": <base64>,
+"stdout": <output so far>} ahead of the final reply, so the engine gets results one test case at a
+time.
+"""
+
+import base64
+import hmac
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# Imported here so forked children get them for free.
+import ctypes  # noqa: F401
+import importlib  # noqa: F401
+import pickle  # noqa: F401
+import resource  # noqa: F401
+import subprocess  # noqa: F401
+
+import numpy  # noqa: F401
+import numpy.ctypeslib  # noqa: F401
+
+# Only the engine knows the token of each container, so the daemon can listen on the container's
+# network. Without a token it only takes jobs from inside the container.
+TOKEN = os.environ.pop("LOVELACE_RUNNER_TOKEN", "")
+HOST = "0.0.0.0" if TOKEN else "127.0.0.1"
+PORT = int(os.environ.get("LOVELACE_RUNNER_PORT", 14715))
+WORKDIR = "/root"
+MAX_OUTPUT_BYTES = 1024 * 1024
+
+
+def run_child(script_path, write_fd, result_fd=None):
+    """Run the script in the forked child with stdout and stderr sent down the pipe. Never returns."""
+    exit_code = 0
+
+    try:
+        # Start a new process group so the whole job, including any compilers or interpreters the
+        # run script starts, can be killed at once.
+        os.setsid()
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+
+        if result_fd is not None:
+            os.environ["LOVELACE_RESULT_FD"] = str(result_fd)
+
+        os.chdir(WORKDIR)
+        sys.argv = [script_path]
+        sys.path.insert(0, os.path.dirname(script_path))
+
+        runpy.run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def run_job(script_path, timeout, on_output=None, max_output=MAX_OUTPUT_BYTES, sockets=()):
+    """
+    Run a script in a forked child, killing it after timeout seconds.
+
+    :param max_output: most bytes of stdout to keep, the rest is thrown away
+    :param sockets: sockets of the daemon to close in the child so the script can't use them
+    :param on_output: optional function called with (path, stdout so far) for every output file the
+        script reports, as soon as it is reported
+    :return: the exit code and stdout of the script
+    """
+    read_fd, write_fd = os.pipe()
+    result_read_fd, result_write_fd = os.pipe() if on_output else (None, None)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        for sock in sockets:
+            os.close(sock.fileno())
+        os.close(read_fd)
+        if result_read_fd is not None:
+            os.close(result_read_fd)
+        run_child(script_path, write_fd, result_write_fd)
+
+    os.close(write_fd)
+    if result_write_fd is not None:
+        os.close(result_write_fd)
+
+    output = bytearray()
+    results = b""
+    timed_out = False
+    deadline = time.monotonic() + timeout
+
+    def read_output():
+        """Read whatever the script has written to stdout. Returns False once it has closed it."""
+        chunk = os.read(read_fd, 65536)
+        if len(output) < max_output:
+            output.extend(chunk[: max_output - len(output)])
+        return bool(chunk)
+
+    stdout_open = True
+    while stdout_open or result_read_fd is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+
+        fds = [read_fd] if stdout_open else []
+        if result_read_fd is not None:
+            fds.append(result_read_fd)
+        ready, _, _ = select.select(fds, [], [], remaining)
+
+        if read_fd in ready:
+            stdout_open = read_output()
+
+        if result_read_fd is None or result_read_fd not in ready:
+            continue
+
+        chunk = os.read(result_read_fd, 65536)
+        if not chunk:
+            os.close(result_read_fd)
+            result_read_fd = None
+            continue
+
+        *paths, rest = (results + chunk).split(b"\n")
+        results = rest
+
+        # Catch up on stdout first so the stdout sent along with each result is up to date.
+        while stdout_open and select.select([read_fd], [], [], 0)[0]:
+            stdout_open = read_output()
+
+        for path in paths:
+            try:
+                on_output(path.decode(), output.decode("utf8", errors="replace"))
+            except Exception:
+                traceback.print_exc()
+
+    if result_read_fd is not None:
+        os.close(result_read_fd)
+
+    if timed_out:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            os.kill(pid, signal.SIGKILL)
+
+    _, status = os.waitpid(pid, 0)
+    os.close(read_fd)
+
+    if timed_out:
+        exit_code = 124
+    elif os.WIFEXITED(status):
+        exit_code = os.WEXITSTATUS(status)
+    else:
+        exit_code = 128 + os.WTERMSIG(status)
+
+    return exit_code, output.decode("utf8", errors="replace")
+
+
+def handle_connection(conn, server):
+    with conn, conn.makefile(mode="rwb") as f:
+        request = json.loads(f.readline())
+
+        if not hmac.compare_digest(str(request.get("token", "")), TOKEN):
+            print("Rejected job with a bad token", flush=True)
+            return
+
+        def send_output(path, stdout):
+            with open(os.path.join(WORKDIR, path), mode="rb") as output_file:
+                data = base64.b64encode(output_file.read()).decode()
+            frame = {"output": os.path.basename(path), "data": data, "stdout": stdout}
+            f.write(json.dumps(frame).encode() + b"\n")
+            f.flush()
+
+        on_output = send_output if request.get("stream") else None
+        exit_code, stdout = run_job(
+            request["script"],
+            request.get("timeout", 30),
+            on_output,
+            request.get("max_output", MAX_OUTPUT_BYTES),
+            sockets=(server, conn),
+        )
+        f.write(json.dumps({"exit_code": exit_code, "stdout": stdout}).encode() + b"\n")
+        f.flush()
+
+
+def main():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((HOST, PORT))
+    server.listen()
+
+    print("Runner daemon listening on {:s}:{:d}".format(HOST, PORT), flush=True)
+
+    # The engine only sends one job at a time to each container so jobs are handled one by one.
+    while True:
+        conn, _ = server.accept()
+        try:
+            handle_connection(conn, server)
+        except Exception:
+            traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import logging
+import os
+import posixpath
+import resource
+import secrets
+import shutil
+import signal
+import subprocess
+import tempfile
+from abc import ABCMeta, abstractmethod
+
+import docker
+
+from engine.docker_util import (
+    Symlink,
+    create_docker_container,
+    remove_docker_container,
+    docker_container_ip,
+    docker_container_running,
+    docker_files_push,
+    docker_files_pull,
+    docker_file_pull,
+    docker_execute,
+    docker_init,
+)
+from engine.resource_profiles import DEFAULT_PROFILE
+from engine.runner_client import RUNNER_PORT, RunnerAddress
+
+logger = logging.getLogger(__name__)
+
+
+class SandboxError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class Sandbox(metaclass=ABCMeta):
+    """
+    Somewhere to run submissions. Each sandbox instance, called a container by the container pool,
+    has its own working directory at /root where files are pushed to, commands are executed in and
+    output files are pulled out of. Anything going wrong with the sandbox itself raises a
+    SandboxError.
+    """
+
+    def prepare(self):
+        """Get ready to create sandbox instances, e.g. by building the image to start them from."""
+
+    def image_id(self):
+        """ID of the image instances are started from, which decides what compilers they have."""
+        return None
+
+    @abstractmethod
+    def create(self, name, profile):
+        """
+        Start a sandbox instance with the CPU, memory and process limits of a resource profile.
+
+        :return: the ID and name of the new instance
+        """
+
+    @abstractmethod
+    def remove(self, sandbox_id):
+        """Stop a sandbox instance and delete everything in it."""
+
+    @abstractmethod
+    def running(self, sandbox_id):
+        """Check whether a sandbox instance is still usable."""
+
+    def runner_address(self, sandbox_id):
+        """RunnerAddress of the instance's runner daemon, or None to always execute commands."""
+        return None
+
+    @abstractmethod
+    def push_files(self, sandbox_id, files, tgt_dir="/root"):
+        """
+        Copy files into a sandbox instance.
+
+        :param files: dict mapping each file name (relative to tgt_dir) to either the path of a file
+            on the host, a bytes object holding the file contents or a Symlink to a path in the
+            instance
+        """
+
+    @abstractmethod
+    def pull_files(self, sandbox_id, src_path):
+        """
+        Copy a file or a whole directory out of a sandbox instance.
+
+        :return: dict mapping each file name to its contents as bytes
+        """
+
+    @abstractmethod
+    def pull_file(self, sandbox_id, src_path, tgt_path):
+        """Copy a file out of a sandbox instance to tgt_path on the host."""
+
+    @abstractmethod
+    def execute(self, sandbox_id, cmd, timeout=30, env=None):
+        """
+        Execute a command in the instance's working directory, killing it after timeout seconds.
+
+        :return: the exit code, 124 if the command timed out, and everything it wrote to stdout and
+            stderr
+        """
+
+
+class DockerSandbox(Sandbox):
+    """
+    Runs submissions in docker containers started from the code runner image, each with a runner
+    daemon inside.
+
+    :param image_name: docker image to start containers from
+    :param volumes: optional dict of volumes to mount in every container, in docker-py's format
+    """
+
+    def __init__(self, image_name="lovelace-code-test", volumes=None):
+        self.image_name = image_name
+        self.volumes = volumes
+        self._image_id = None
+        self._runner_tokens = {}  # container ID -> token its runner daemon expects
+
+    def prepare(self):
+        try:
+            self._image_id = docker_init(image_name=self.image_name)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+    def image_id(self):
+        return self._image_id
+
+    def create(self, name, profile):
+        # Each container's runner daemon only takes jobs from whoever knows its token.
+        token = secrets.token_hex(16)
+        try:
+            # Containers are started from the image built by prepare() even if the tag has been
+            # moved on since, so everything compiled in them matches image_id().
+            container_id, container_name = create_docker_container(
+                name=name,
+                image_name=self._image_id or self.image_name,
+                profile=profile,
+                volumes=self.volumes,
+                environment={"LOVELACE_RUNNER_TOKEN": token},
+            )
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+        self._runner_tokens[container_id] = token
+        return container_id, container_name
+
+    def remove(self, sandbox_id):
+        self._runner_tokens.pop(sandbox_id, None)
+        try:
+            remove_docker_container(sandbox_id)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+    def running(self, sandbox_id):
+        return docker_container_running(sandbox_id)
+
+    def runner_address(self, sandbox_id):
+        try:
+            container_ip = docker_container_ip(sandbox_id)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+        token = self._runner_tokens.get(sandbox_id)
+        if not container_ip or not token:
+            return None
+        return RunnerAddress(container_ip, RUNNER_PORT, token)
+
+    def push_files(self, sandbox_id, files, tgt_dir="/root"):
+        try:
+            docker_files_push(sandbox_id, files, tgt_dir)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+    def pull_files(self, sandbox_id, src_path):
+        try:
+            return docker_files_pull(sandbox_id, src_path)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+    def pull_file(self, sandbox_id, src_path, tgt_path):
+        try:
+            docker_file_pull(sandbox_id, src_path, tgt_path)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+    def execute(self, sandbox_id, cmd, timeout=30, env=None):
+        try:
+            return docker_execute(sandbox_id, cmd, timeout=timeout, env=env)
+        except docker.errors.APIError as e:
+            raise SandboxError(str(e))
+
+
+class LocalSandbox(Sandbox):
+    """
+    Runs submissions as processes on the engine's own machine, which is much faster than going
+    through docker. Each instance is a directory standing in for /root. Commands run in their own
+    session so they can be killed along with everything they started, with the instance's memory
+    limit applied through rlimits. CPU limits aren't applied and nothing is isolated from the engine
+    or the network, so only trusted code like our own reference solutions should be run this way.
+
+    :param directory: where to create the instance directories, a new temporary directory if not
+        given
+    :param mounts: optional dict mapping paths inside the instances to directories on the engine's
+        machine, like the volumes mounted in code runner containers
+    """
+
+    WORKDIR = "/root"
+
+    def __init__(self, directory=None, mounts=None):
+        self.directory = directory or tempfile.mkdtemp(prefix="lovelace-sandboxes-")
+        self.mounts = dict(mounts or {})
+        self._profiles = {}
+
+    def create(self, name, profile):
+        logger.info("Creating local sandbox {:s} with {}".format(name, profile))
+        os.makedirs(os.path.join(self.directory, name))
+        self._profiles[name] = profile
+        return name, name
+
+    def remove(self, sandbox_id):
+        logger.info("Clean up: deleting local sandbox {:s}".format(sandbox_id))
+        shutil.rmtree(os.path.join(self.directory, sandbox_id), ignore_errors=True)
+        self._profiles.pop(sandbox_id, None)
+
+    def running(self, sandbox_id):
+        return os.path.isdir(os.path.join(self.directory, sandbox_id))
+
+    def host_path(self, sandbox_id, path):
+        """
+        Where a path inside an instance is on the engine's machine, or None if it's outside of both
+        the instance's working directory and the mounts.
+        """
+        path = posixpath.normpath(posixpath.join(self.WORKDIR, path))
+        prefixes = dict(self.mounts, **{self.WORKDIR: os.path.join(self.directory, sandbox_id)})
+
+        for prefix, host_dir in prefixes.items():
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return os.path.join(host_dir, posixpath.relpath(path, prefix))
+
+        return None
+
+    def _host_path_or_raise(self, sandbox_id, path):
+        host_path = self.host_path(sandbox_id, path)
+        if host_path is None:
+            raise SandboxError("{:s} is outside of local sandbox {:s}".format(path, sandbox_id))
+        return host_path
+
+    def push_files(self, sandbox_id, files, tgt_dir="/root"):
+        logger.debug("Copying {:d} files into local sandbox {:s}".format(len(files), sandbox_id))
+
+        try:
+            for file_name, contents in files.items():
+                path = self._host_path_or_raise(sandbox_id, posixpath.join(tgt_dir, file_name))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if os.path.lexists(path):
+                    os.remove(path)
+
+                if isinstance(contents, bytes):
+                    with open(path, mode="wb") as f:
+                        f.write(contents)
+                elif isinstance(contents, Symlink):
+                    os.symlink(self._host_path_or_raise(sandbox_id, contents.target), path)
+                else:
+                    shutil.copyfile(contents, path)
+        except OSError as e:
+            raise SandboxError(str(e))
+
+    def pull_files(self, sandbox_id, src_path):
+        path = self._host_path_or_raise(sandbox_id, src_path)
+
+        try:
+            if not os.path.isdir(path):
+                with open(path, mode="rb") as f:
+                    return {os.path.basename(path): f.read()}
+
+            files = {}
+            for dir_path, _, file_names in os.walk(path):
+                for file_name in file_names:
+                    with open(os.path.join(dir_path, file_name), mode="rb") as f:
+                        files[file_name] = f.read()
+            return files
+        except OSError as e:
+            raise SandboxError(str(e))
+
+    def pull_file(self, sandbox_id, src_path, tgt_path):
+        try:
+            shutil.copyfile(self._host_path_or_raise(sandbox_id, src_path), tgt_path)
+        except OSError as e:
+            raise SandboxError(str(e))
+
+    def execute(self, sandbox_id, cmd, timeout=30, env=None):
+        # Paths in the command refer to the inside of the instance.
+        cmd = [
+            (self.host_path(sandbox_id, arg) or arg) if arg.startswith("/") else arg for arg in cmd
+        ]
+        profile = self._profiles.get(sandbox_id, DEFAULT_PROFILE)
+
+        logger.debug("Running command {} in local sandbox {:s}.".format(cmd, sandbox_id))
+
+        try:
+            process = subprocess.Popen(
+                cmd,
+                cwd=os.path.join(self.directory, sandbox_id),
+                env=dict(os.environ, **(env or {})),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                preexec_fn=lambda: set_rlimits(profile),
+                start_new_session=True,
+            )
+        except OSError as e:
+            raise SandboxError(str(e))
+
+        try:
+            stdout, _ = process.communicate(timeout=timeout)
+            exit_code = process.returncode
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            stdout, _ = process.communicate()
+            exit_code = 124
+
+        return exit_code, stdout.decode("utf8", errors="replace")
+
+
+def set_rlimits(profile):
+    """Apply the limits of a resource profile that rlimits can express to the current process."""
+    memory = memory_bytes(profile.memory)
+    resource.setrlimit(resource.RLIMIT_DATA, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def memory_bytes(memory):
+    """Convert a memory limit in docker's format, e.g. "512m", to bytes."""
+    units = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    memory = str(memory).lower()
+    if memory[-1] in units:
+        return int(float(memory[:-1]) * units[memory[-1]])
+    return int(memory)
+
+
+def sandbox_from_env(resource_store=None):
+    """
+    The sandbox backend picked by LOVELACE_SANDBOX: "docker" (the default) to run submissions in
+    code runner containers, or "local" to run them as processes next to the engine.
+    """
+    backend = os.environ.get("LOVELACE_SANDBOX", "docker")
+
+    if backend == "docker":
+        volumes = resource_store.container_volumes() if resource_store is not None else None
+        return DockerSandbox(volumes=volumes)
+    elif backend == "local":
+        mounts = {}
+        if resource_store is not None:
+            mounts[resource_store.mount_point] = resource_store.directory
+        return LocalSandbox(os.environ.get("LOVELACE_LOCAL_SANDBOX_DIR"), mounts)
+    else:
+        raise ValueError("Unknown sandbox backend LOVELACE_SANDBOX={:s}".format(backend))
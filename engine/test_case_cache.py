@@ -0,0 +1,193 @@
+import collections
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import uuid
+
+from engine.resource_store import file_digest
+
+logger = logging.getLogger(__name__)
+
+
+def problem_module_hash(problem):
+    """Hash the source of a problem module so cached test cases are dropped when it changes."""
+    with open(problem.__file__, mode="rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class TestCaseSet:
+    """
+    All the test cases for one submission.
+
+    The ID is a hash of the problem module, the test case inputs and the contents of the set's
+    dynamic resources so deterministic test case generators always produce a set with the same ID,
+    but sets whose inputs only name resource files never share an ID when the files differ.
+
+    :param resource_dir: directory the set's dynamic resources are kept in, None if it has none
+    """
+
+    def __init__(self, test_cases, problem_hash="", resource_dir=None):
+        self.test_cases = test_cases
+        self.resource_dir = resource_dir
+
+        try:
+            set_hash = hashlib.sha1(problem_hash.encode())
+            set_hash.update(pickle.dumps([tc.input_tuple() for tc in test_cases]))
+            if resource_dir is not None:
+                for file_name in sorted(os.listdir(resource_dir)):
+                    set_hash.update(file_name.encode() + b"\0")
+                    set_hash.update(file_digest(os.path.join(resource_dir, file_name)).encode())
+            self.id = set_hash.hexdigest()
+        except Exception:
+            self.id = uuid.uuid4().hex
+
+    def __len__(self):
+        return len(self.test_cases)
+
+
+class TestCaseCache:
+    """
+    A cache of pre-generated test case sets for each problem.
+
+    Sets are keyed by problem name and a hash of the problem module. Each set is handed out to exactly
+    one submission and is replaced by generating a new set in the background. Once more than
+    max_problems problems have been cached, the least recently used problem's sets are discarded.
+
+    :param generate: function that takes a problem module and returns a list of test cases
+    :param sets_per_problem: number of test case sets to keep ready for each problem
+    :param max_problems: maximum number of problems to keep test case sets for
+    :param discard: optional function called with (problem_name, test_case_set) for every set that
+        is evicted without being handed out, e.g. to clean up resources it generated
+    :param store_resources: optional function called with (problem_name, test_cases) as soon as a
+        set has been generated. Problems write their dynamic resources to the same files for every
+        set, so it moves them somewhere of the set's own and returns that directory, which is kept
+        as the set's resource_dir.
+    """
+
+    def __init__(
+        self, generate, sets_per_problem=2, max_problems=64, discard=None, store_resources=None
+    ):
+        self.generate = generate
+        self.sets_per_problem = sets_per_problem
+        self.max_problems = max_problems
+        self.discard = discard
+        self.store_resources = store_resources
+
+        self._sets = collections.OrderedDict()
+        self._refilling = set()
+        self._lock = threading.Lock()
+        # Sets for the same problem are generated one at a time so they don't overwrite each other's
+        # dynamic resources before they've been stored away.
+        self._generate_locks = collections.defaultdict(threading.Lock)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, problem_name, problem, problem_hash=None):
+        """
+        Return a test case set for the problem, generating it inline if none are ready.
+
+        :param problem_hash: hash of the problem module's source if already known, it's hashed
+            otherwise
+        """
+        key = (problem_name, problem_hash or problem_module_hash(problem))
+
+        with self._lock:
+            # Sets generated by an older version of the problem module are stale.
+            evicted = [
+                (k, self._sets.pop(k))
+                for k in list(self._sets)
+                if k[0] == problem_name and k != key
+            ]
+
+            sets = self._sets.setdefault(key, collections.deque())
+            self._sets.move_to_end(key)
+            test_case_set = sets.popleft() if sets else None
+            evicted += self._evict()
+
+        for evicted_key, evicted_sets in evicted:
+            self._discard(evicted_key, evicted_sets)
+
+        if test_case_set is not None:
+            self.hits += 1
+            logger.debug(
+                "Test case cache hit for {:s} (set {:s})".format(problem_name, test_case_set.id)
+            )
+        else:
+            self.misses += 1
+            logger.debug("Test case cache miss for {:s}".format(problem_name))
+            test_case_set = self._generate(key, problem)
+
+        if self.sets_per_problem > 0:
+            self._refill_in_background(key, problem)
+
+        return test_case_set
+
+    def _generate(self, key, problem):
+        problem_name, problem_hash = key
+
+        with self._lock:
+            generate_lock = self._generate_locks[problem_name]
+
+        with generate_lock:
+            test_cases = self.generate(problem)
+            resource_dir = None
+            if self.store_resources:
+                resource_dir = self.store_resources(problem_name, test_cases)
+
+        return TestCaseSet(test_cases, problem_hash=problem_hash, resource_dir=resource_dir)
+
+    def _evict(self):
+        evicted = []
+        while len(self._sets) > self.max_problems:
+            evicted.append(self._sets.popitem(last=False))
+        return evicted
+
+    def _discard(self, key, sets):
+        problem_name, _ = key
+        logger.debug("Evicting {:d} test case sets for {:s}".format(len(sets), problem_name))
+        if self.discard:
+            for test_case_set in sets:
+                self.discard(problem_name, test_case_set)
+
+    def _refill_in_background(self, key, problem):
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        threading.Thread(target=self._refill, args=(key, problem), daemon=True).start()
+
+    def _refill(self, key, problem):
+        problem_name, _ = key
+
+        try:
+            while True:
+                with self._lock:
+                    sets = self._sets.get(key)
+                    if sets is None or len(sets) >= self.sets_per_problem:
+                        return
+
+                logger.debug("Pre-generating a test case set for {:s}...".format(problem_name))
+                test_case_set = self._generate(key, problem)
+
+                with self._lock:
+                    sets = self._sets.get(key)
+                    if sets is not None:
+                        sets.append(test_case_set)
+
+                if sets is None:
+                    self._discard(key, [test_case_set])
+        except Exception:
+            logger.exception("Failed to pre-generate test cases for {:s}".format(problem_name))
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def stats(self):
+        with self._lock:
+            n_sets = sum(len(sets) for sets in self._sets.values())
+            n_problems = len(self._sets)
+        return {"hits": self.hits, "misses": self.misses, "problems": n_problems, "sets": n_sets}
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import time
 import hashlib
 import logging
@@ -60,3 +62,53 @@ def delete_file(filename):
     if os.path.isfile(filename):
         logger.debug("Deleting file: {:s}".format(filename))
         os.remove(filename)
+
+
+def write_file_atomic(filename, string):
+    """
+    Write a string to a file such that other threads or processes never see a partially written file.
+
+    :param filename: path of the file to write
+    :param string: the data to be saved
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(string)
+        os.replace(tmp_path, filename)
+    except Exception:
+        delete_file(tmp_path)
+        raise
+
+
+def link_file(src, dst):
+    """
+    Hard link dst to src so it doesn't have to be copied, or copy it if they're on different
+    filesystems.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def copy_file_atomic(src, dst):
+    """
+    Copy a file such that other threads or processes never see a partially written dst file.
+
+    :param src: path of the file to copy
+    :param dst: path to copy the file to
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dst)))
+    os.close(fd)
+
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except Exception:
+        delete_file(tmp_path)
+        raise
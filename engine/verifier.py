@@ -0,0 +1,193 @@
+"""
+Checks the outputs of the user's code against the expected outputs of all the test cases at once.
+
+Floating point outputs whose tolerances are declared by the problem module through ATOL and RTOL
+(either one number or a dict with a number for each output variable) are compared in one vectorized
+np.isclose pass for all the test cases whose outputs have the same shapes. Everything else, like
+integers, strings or outputs of the wrong shape, is checked one test case at a time by the problems
+package's own test_case_solution_correct.
+"""
+
+import copy
+import numbers
+import os
+
+import numpy as np
+
+
+def verify_batch(problems, problem, test_cases, user_outputs, work_dir=None):
+    """
+    Check whether the user's outputs are correct.
+
+    :param problems: the problems package
+    :param problem: the problem module
+    :param test_cases: the test cases the user's code was run on
+    :param user_outputs: tuple of the values the user's code returned for each test case, or None
+        for test cases that shouldn't be checked
+    :param work_dir: directory the run's dynamic resources and user generated files are in
+    :return: list with a (passed, expected output tuple, max error) tuple for each test case, or
+        None for the ones that weren't checked. The max error is the largest absolute difference
+        between any number in the user's output and the expected one, None if the outputs can't be
+        compared number by number.
+    """
+    results = [None] * len(test_cases)
+
+    # Test cases whose outputs have the same shapes are checked together.
+    groups = {}
+    for i, (tc, user_output) in enumerate(zip(test_cases, user_outputs)):
+        if user_output is None:
+            continue
+
+        expected_output = tc.output_tuple()
+        arrays = float_arrays(problem, expected_output, user_output)
+        if arrays is None:
+            results[i] = verify_one(problems, problem, tc, user_output, expected_output, work_dir)
+            continue
+
+        shapes = tuple(expected.shape for expected, _ in arrays)
+        groups.setdefault(shapes, []).append((i, expected_output, arrays))
+
+    for shapes, group in groups.items():
+        passed = np.ones(len(group), dtype=bool)
+        max_errors = np.zeros(len(group))
+
+        for j, var in enumerate(problem.OUTPUT_VARS):
+            atol, rtol = tolerances(problem, var)
+            expected = np.stack([arrays[j][0] for _, _, arrays in group])
+            user = np.stack([arrays[j][1] for _, _, arrays in group])
+
+            # Reduce over every axis but the first, which is the test case.
+            axes = tuple(range(1, expected.ndim))
+            passed &= np.isclose(user, expected, atol=atol, rtol=rtol).all(axis=axes)
+            if expected[0].size > 0:
+                max_errors = np.maximum(max_errors, np.abs(user - expected).max(axis=axes))
+
+        for (i, expected_output, _), case_passed, max_error in zip(group, passed, max_errors):
+            results[i] = (bool(case_passed), expected_output, finite_or_none(max_error))
+
+    return results
+
+
+def verify_one(problems, problem, tc, user_output, expected_output, work_dir=None):
+    """Check one test case with the problems package's own checker."""
+    checked_tc, checked_output = tc, user_output
+    if work_dir is not None:
+        file_paths = work_dir_paths(tc, work_dir)
+        if file_paths:
+            checked_tc = in_work_dir(tc, file_paths)
+            checked_output = tuple(replace_paths(value, file_paths) for value in user_output)
+
+    user_test_case = problem.ProblemTestCase(
+        None, problem.INPUT_VARS, checked_tc.input_tuple(), problem.OUTPUT_VARS, checked_output
+    )
+    passed, correct_test_case = problems.test_case.test_case_solution_correct(
+        checked_tc, user_test_case, problem.ATOL, problem.RTOL
+    )
+
+    # The response shows the file names the user's code was given, not where the engine kept them.
+    if correct_test_case is not checked_tc:
+        expected_output = correct_test_case.output_tuple()
+    return passed, expected_output, max_error(expected_output, user_output)
+
+
+def work_dir_paths(tc, work_dir):
+    """Map the name of each dynamic resource and user generated file of a test case to its path."""
+    file_names = list(tc.input.get("DYNAMIC_RESOURCES", []))
+    file_names += list(tc.output.get("USER_GENERATED_FILES", []))
+    return {file_name: os.path.join(work_dir, file_name) for file_name in file_names}
+
+
+def in_work_dir(tc, file_paths):
+    """
+    A copy of a test case that refers to its files by their paths in the run's work directory, so
+    the checker reads this run's files rather than those of another run of the same problem.
+    """
+    tc = copy.copy(tc)
+    tc.input = {k: replace_paths(v, file_paths) for k, v in tc.input.items()}
+    tc.output = {k: replace_paths(v, file_paths) for k, v in tc.output.items()}
+    return tc
+
+
+def replace_paths(value, file_paths):
+    if isinstance(value, str):
+        return file_paths.get(value, value)
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return [file_paths.get(v, v) for v in value]
+    return value
+
+
+def float_arrays(problem, expected_output, user_output):
+    """
+    Convert the outputs of a test case to arrays for a vectorized comparison.
+
+    :return: list of (expected, user) float arrays of the same shape for each output variable, or
+        None if any of them can't be compared that way
+    """
+    n_vars = len(problem.OUTPUT_VARS)
+    if len(expected_output) != n_vars or len(user_output) != n_vars:
+        return None
+
+    arrays = []
+    for var, expected, user in zip(problem.OUTPUT_VARS, expected_output, user_output):
+        if tolerances(problem, var) is None:
+            return None
+
+        expected = numeric_array(expected, kinds="f")
+        user = numeric_array(user, kinds="fiu")
+        if expected is None or user is None or expected.shape != user.shape:
+            return None
+
+        arrays.append((expected, user.astype(np.float64, copy=False)))
+
+    return arrays
+
+
+def numeric_array(value, kinds):
+    """Convert a number or a (nested) list of numbers to an array if its dtype is one of kinds."""
+    if isinstance(value, (dict, str, bytes)):
+        return None
+    try:
+        array = np.asarray(value)
+    except (ValueError, TypeError):
+        return None
+    return array if array.dtype.kind in kinds else None
+
+
+def tolerances(problem, var):
+    """
+    Absolute and relative tolerances for an output variable, or None if the problem module doesn't
+    declare either so its own checker decides how to compare it.
+    """
+    atol = tolerance(getattr(problem, "ATOL", None), var)
+    rtol = tolerance(getattr(problem, "RTOL", None), var)
+    if atol is None and rtol is None:
+        return None
+    return atol or 0, rtol or 0
+
+
+def tolerance(tol, var):
+    if isinstance(tol, dict):
+        tol = tol.get(var)
+    return tol if isinstance(tol, numbers.Real) and not isinstance(tol, bool) else None
+
+
+def max_error(expected_output, user_output):
+    """Largest absolute difference between the numbers in two outputs, None if they can't be."""
+    if len(expected_output) != len(user_output):
+        return None
+
+    error = 0.0
+    for expected, user in zip(expected_output, user_output):
+        expected = numeric_array(expected, kinds="fiu")
+        user = numeric_array(user, kinds="fiu")
+        if expected is None or user is None or expected.shape != user.shape:
+            return None
+        if expected.size > 0:
+            error = np.maximum(error, np.abs(user.astype(np.float64) - expected).max())
+
+    return finite_or_none(error)
+
+
+def finite_or_none(x):
+    # NaN and infinity aren't valid JSON.
+    return float(x) if np.isfinite(x) else None
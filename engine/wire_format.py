@@ -0,0 +1,250 @@
+"""
+Binary format for the test case inputs pushed into code runner containers and the results pulled back
+out. It's pushed into the container next to the run scripts.
+
+A file starts with the magic bytes b"LVLC" and a one byte format version, followed by a single value.
+Each value is a one byte type tag followed by its payload, all little-endian:
+
+    N            None
+    T, F         True, False
+    i            int64
+    I            uint32 length + decimal digits, for ints that don't fit in an int64
+    f            float64
+    c            two float64s, the real then the imaginary part of a complex number
+    s            uint32 length + UTF-8 bytes
+    b            uint32 length + raw bytes
+    l, t         uint32 length + that many values, for lists and tuples
+    d            uint32 length + that many key and value pairs
+    a            numpy array: uint8 length + numpy dtype string (e.g. "<f8"), uint8 number of
+                 dimensions, one uint64 per dimension, uint64 number of bytes, zero padding up to the
+                 next multiple of 8 bytes from the start of the file, then the array's bytes in C order
+
+Arrays are written straight from their memory and read back with np.frombuffer so they're never
+converted to and from lists. Unlike unpickling, decoding never runs any code so results can be read
+back from untrusted containers.
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = b"LVLC"
+VERSION = 1
+
+_HEADER = MAGIC + bytes([VERSION])
+
+_INT64 = struct.Struct("<q")
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+_FLOAT64 = struct.Struct("<d")
+_COMPLEX128 = struct.Struct("<dd")
+
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+
+class WireFormatError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def encode(value, default=None):
+    """
+    Encode a value in the wire format.
+
+    :param default: optional function called with any value that can't be encoded, returning a value
+        that can be encoded instead, like the default argument of json.dumps
+    :return: the encoded value as bytes
+    :raises WireFormatError: if the value, or something inside it, can't be encoded
+    """
+    chunks = [_HEADER]
+    _Encoder(chunks, default).encode(value)
+    return b"".join(chunks)
+
+
+def decode(data):
+    """
+    Decode a value encoded in the wire format. Arrays share memory with data, so they're only
+    writable if data is, e.g. a bytearray.
+
+    :raises WireFormatError: if data isn't a valid encoding of a value
+    """
+    data = memoryview(data)
+
+    if bytes(data[:4]) != MAGIC:
+        raise WireFormatError("Not in the wire format: bad magic bytes.")
+    if len(data) < 5 or data[4] != VERSION:
+        raise WireFormatError("Unsupported wire format version.")
+
+    decoder = _Decoder(data, offset=5)
+    try:
+        value = decoder.decode()
+    except (struct.error, ValueError, TypeError, IndexError, RecursionError) as e:
+        raise WireFormatError("Invalid wire format data: {}".format(e))
+
+    if decoder.offset != len(data):
+        raise WireFormatError("Invalid wire format data: trailing bytes.")
+
+    return value
+
+
+def read_file(path):
+    """Decode a file in the wire format. Arrays are read into writable memory."""
+    with open(path, mode="rb") as f:
+        return decode(bytearray(f.read()))
+
+
+def write_file(path, value, default=None):
+    with open(path, mode="wb") as f:
+        f.write(encode(value, default))
+
+
+class _Encoder:
+    def __init__(self, chunks, default=None):
+        self.chunks = chunks
+        self.default = default
+        self.size = len(_HEADER)
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+    def encode(self, value):
+        # bool is checked before int since it's a subclass of int.
+        if value is None:
+            self.write(b"N")
+        elif value is True or value is False or isinstance(value, np.bool_):
+            self.write(b"T" if value else b"F")
+        elif isinstance(value, (int, np.integer)):
+            value = int(value)
+            if _INT64_MIN <= value <= _INT64_MAX:
+                self.write(b"i" + _INT64.pack(value))
+            else:
+                self.write_sized(b"I", str(value).encode())
+        elif isinstance(value, (float, np.floating)):
+            self.write(b"f" + _FLOAT64.pack(value))
+        elif isinstance(value, (complex, np.complexfloating)):
+            self.write(b"c" + _COMPLEX128.pack(value.real, value.imag))
+        elif isinstance(value, str):
+            self.write_sized(b"s", value.encode())
+        elif isinstance(value, (bytes, bytearray)):
+            self.write_sized(b"b", bytes(value))
+        elif isinstance(value, list):
+            self.encode_items(b"l", value)
+        elif isinstance(value, tuple):
+            self.encode_items(b"t", value)
+        elif isinstance(value, dict):
+            self.write(b"d" + _UINT32.pack(len(value)))
+            for k, v in value.items():
+                self.encode(k)
+                self.encode(v)
+        elif isinstance(value, np.ndarray):
+            self.encode_array(value)
+        elif self.default is not None:
+            self.encode(self.default(value))
+        else:
+            raise WireFormatError("Cannot encode value of type {:}".format(type(value)))
+
+    def write_sized(self, tag, data):
+        self.write(tag + _UINT32.pack(len(data)))
+        self.write(data)
+
+    def encode_items(self, tag, items):
+        self.write(tag + _UINT32.pack(len(items)))
+        for item in items:
+            self.encode(item)
+
+    def encode_array(self, array):
+        # Arrays of Python objects don't have a memory layout worth sending.
+        if array.dtype.hasobject:
+            self.encode(array.tolist())
+            return
+        if array.dtype.fields is not None:
+            raise WireFormatError("Cannot encode structured arrays.")
+
+        # Not np.ascontiguousarray as that turns zero dimensional arrays into one dimensional ones.
+        if not array.flags.c_contiguous:
+            array = array.copy(order="C")
+        dtype = array.dtype.str.encode()
+
+        header = b"a" + bytes([len(dtype)]) + dtype + bytes([array.ndim])
+        header += b"".join(_UINT64.pack(n) for n in array.shape)
+        header += _UINT64.pack(array.nbytes)
+        self.write(header)
+
+        self.write(bytes(-self.size % 8))
+        self.write(array.reshape(-1).view(np.uint8))
+
+
+class _Decoder:
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def read(self, n):
+        if self.offset + n > len(self.data):
+            raise ValueError("unexpected end of data")
+        chunk = self.data[self.offset : self.offset + n]
+        self.offset += n
+        return chunk
+
+    def unpack(self, fmt):
+        (value,) = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return value
+
+    def decode(self):
+        tag = bytes(self.read(1))
+
+        if tag == b"N":
+            return None
+        elif tag == b"T":
+            return True
+        elif tag == b"F":
+            return False
+        elif tag == b"i":
+            return self.unpack(_INT64)
+        elif tag == b"I":
+            return int(bytes(self.read(self.unpack(_UINT32))).decode("ascii"))
+        elif tag == b"f":
+            return self.unpack(_FLOAT64)
+        elif tag == b"c":
+            real, imag = _COMPLEX128.unpack_from(self.data, self.offset)
+            self.offset += _COMPLEX128.size
+            return complex(real, imag)
+        elif tag == b"s":
+            return str(self.read(self.unpack(_UINT32)), "utf-8")
+        elif tag == b"b":
+            return bytes(self.read(self.unpack(_UINT32)))
+        elif tag == b"l":
+            return [self.decode() for _ in range(self.unpack(_UINT32))]
+        elif tag == b"t":
+            return tuple(self.decode() for _ in range(self.unpack(_UINT32)))
+        elif tag == b"d":
+            n = self.unpack(_UINT32)
+            items = {}
+            for _ in range(n):
+                k = self.decode()
+                items[k] = self.decode()
+            return items
+        elif tag == b"a":
+            return self.decode_array()
+        else:
+            raise ValueError("unknown type tag {!r}".format(tag))
+
+    def decode_array(self):
+        dtype = np.dtype(bytes(self.read(self.read(1)[0])).decode("ascii"))
+        if dtype.hasobject or dtype.fields is not None:
+            raise ValueError("unsupported array dtype {}".format(dtype))
+
+        shape = tuple(self.unpack(_UINT64) for _ in range(self.read(1)[0]))
+        nbytes = self.unpack(_UINT64)
+
+        count = 1
+        for n in shape:
+            count *= n
+        if count * dtype.itemsize != nbytes:
+            raise ValueError("array shape {} doesn't match its size".format(shape))
+
+        self.read(-self.offset % 8)
+        buffer = self.read(nbytes)
+        return np.frombuffer(buffer, dtype=dtype, count=count).reshape(shape)
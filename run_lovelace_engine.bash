@@ -3,8 +3,12 @@
 rm -f solutions && \
 rm -rf lovelace-solutions/ 
 
+# Problem resources are shared with the code runner containers through the lovelace-resources volume.
 docker build -t lovelace-engine . && \
-docker run -d -v /var/run/docker.sock:/var/run/docker.sock -p 14714:14714 lovelace-engine && \
+docker volume create lovelace-resources && \
+docker run -d -v /var/run/docker.sock:/var/run/docker.sock \
+    -v lovelace-resources:/lovelace-resources -e LOVELACE_RESOURCE_DIR=/lovelace-resources \
+    -p 14714:14714 lovelace-engine && \
 docker ps -a
 
 git clone https://github.com/project-lovelace/lovelace-solutions.git && \
@@ -0,0 +1,333 @@
+"""
+Load test the engine by replaying a corpus of submissions at a set concurrency and arrival rate.
+
+The corpus is every solution in LOVELACE_SOLUTIONS_DIR (or --solutions-dir) that has a problem in
+LOVELACE_PROBLEMS_DIR plus the dummy solutions, which include code that loops forever or blows
+through the memory limit. The latency percentiles, throughput and how long each stage of the engine
+took on average (scraped from GET /metrics before and after the run) are printed and saved as JSON
+so runs can be compared over time.
+
+    python scripts/benchmark.py --concurrency 4 --rate 2 --requests 200 --output bench.json
+
+With --local the submissions are sent to an engine started by the benchmark with gunicorn and
+LOVELACE_SANDBOX=local instead, which runs them as plain processes. That's handy for benchmarking
+the rest of the engine without docker's overhead, but the problems still need to be installed.
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import requests
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+repo_dir = os.path.join(cwd, "..")
+tests_dir = os.path.join(repo_dir, "tests")
+sys.path.insert(0, tests_dir)
+
+from helpers import ext2language, get_solution_filepaths  # noqa: E402
+
+# Problems the dummy solutions are submitted to.
+DUMMY_SOLUTION_PROBLEMS = {
+    "chaos_84.js": "chaos",
+    "infinite_loop.py": "scientific_temperatures",
+    "memory_explosion.py": "speed_of_light",
+}
+
+STAGE_METRIC = re.compile(
+    r'^lovelace_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', re.MULTILINE
+)
+
+
+class Submission:
+    def __init__(self, file_path, problem, language):
+        self.file_path = file_path
+        self.problem = problem
+        self.language = language
+
+        with open(file_path, "r") as f:
+            self.code = base64.b64encode(f.read().encode("utf-8")).decode("utf-8")
+
+    def payload(self):
+        return {"problem": self.problem, "language": self.language, "code": self.code}
+
+
+def load_corpus(solutions_dir=None, languages=("python", "javascript", "julia", "c")):
+    """The submissions to replay: the dummy solutions and every solution with a problem."""
+    corpus = []
+    for file_name, problem in DUMMY_SOLUTION_PROBLEMS.items():
+        language = ext2language[file_name.split(".")[-1]]
+        file_path = os.path.join(tests_dir, "dummy_solutions", file_name)
+        corpus.append(Submission(file_path, problem, language))
+
+    if solutions_dir:
+        os.environ["LOVELACE_SOLUTIONS_DIR"] = solutions_dir
+
+    if "LOVELACE_SOLUTIONS_DIR" not in os.environ:
+        print("LOVELACE_SOLUTIONS_DIR isn't set, only replaying the dummy solutions.")
+        return corpus
+
+    for language in languages:
+        for file_path in get_solution_filepaths(language):
+            problem = os.path.splitext(os.path.basename(file_path))[0].replace("-", "_")
+            corpus.append(Submission(file_path, problem, language))
+
+    return corpus
+
+
+def scrape_stage_times(engine_uri):
+    """Total seconds spent in and number of times through each stage so far, from GET /metrics."""
+    try:
+        metrics = requests.get(engine_uri + "/metrics").text
+    except requests.exceptions.ConnectionError:
+        return {}
+
+    stages = {}
+    for kind, stage, value in STAGE_METRIC.findall(metrics):
+        stages.setdefault(stage, {"sum": 0.0, "count": 0})[kind] = float(value)
+    return stages
+
+
+def stage_breakdown(before, after):
+    breakdown = {}
+    for stage, totals in sorted(after.items()):
+        count = totals["count"] - before.get(stage, {}).get("count", 0)
+        seconds = totals["sum"] - before.get(stage, {}).get("sum", 0.0)
+        if count > 0:
+            breakdown[stage] = {
+                "count": int(count),
+                "totalSeconds": seconds,
+                "meanSeconds": seconds / count,
+            }
+    return breakdown
+
+
+def submit(engine_uri, submission):
+    t1 = time.perf_counter()
+    try:
+        response = requests.post(engine_uri + "/submit", data=json.dumps(submission.payload()))
+        status = response.status_code
+        result = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        status, result = None, {}
+    latency = time.perf_counter() - t1
+
+    if status == 200:
+        outcome = "passed" if result.get("success") else "failed"
+    else:
+        outcome = "error"
+
+    return {
+        "file": os.path.basename(submission.file_path),
+        "problem": submission.problem,
+        "language": submission.language,
+        "status": status,
+        "outcome": outcome,
+        "latency": latency,
+    }
+
+
+def run_benchmark(engine_uri, corpus, n_requests, concurrency, rate=None, seed=0):
+    """
+    Send n_requests submissions picked from the corpus in turn. With a rate, submissions arrive
+    randomly (a Poisson process) at that many per second on average, otherwise each of the
+    concurrency workers sends its next submission as soon as its last one is done.
+
+    :return: the results dict that gets saved as JSON
+    """
+    rng = random.Random(seed)
+    stages_before = scrape_stage_times(engine_uri)
+
+    t_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        t_arrival = t_start
+        for i in range(n_requests):
+            if rate:
+                t_arrival += rng.expovariate(rate)
+                time.sleep(max(0, t_arrival - time.perf_counter()))
+            futures.append(executor.submit(submit, engine_uri, corpus[i % len(corpus)]))
+
+        submissions = [future.result() for future in futures]
+    duration = time.perf_counter() - t_start
+
+    stages_after = scrape_stage_times(engine_uri)
+
+    latencies = np.array([s["latency"] for s in submissions])
+    outcomes = {"passed": 0, "failed": 0, "error": 0}
+    for s in submissions:
+        outcomes[s["outcome"]] += 1
+
+    by_file = {}
+    for s in submissions:
+        by_file.setdefault(s["file"], []).append(s["latency"])
+
+    return {
+        "startedAt": datetime.datetime.now().isoformat(timespec="seconds"),
+        "engineUri": engine_uri,
+        "concurrency": concurrency,
+        "rate": rate,
+        "numRequests": n_requests,
+        "durationSeconds": duration,
+        "throughput": n_requests / duration,
+        "latency": latency_summary(latencies),
+        "outcomes": outcomes,
+        "stages": stage_breakdown(stages_before, stages_after),
+        "latencyByFile": {f: latency_summary(np.array(ls)) for f, ls in sorted(by_file.items())},
+        "submissions": submissions,
+    }
+
+
+def latency_summary(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "mean": latencies.mean(),
+        "max": latencies.max(),
+    }
+
+
+def print_results(results):
+    print(
+        "{:d} submissions in {:.2f} s ({:.2f} per second), concurrency {:d}, rate {}".format(
+            results["numRequests"],
+            results["durationSeconds"],
+            results["throughput"],
+            results["concurrency"],
+            results["rate"] or "unlimited",
+        )
+    )
+
+    outcomes = ", ".join("{:d} {:s}".format(n, k) for k, n in results["outcomes"].items())
+    print("Outcomes: {:s}".format(outcomes))
+
+    latency = results["latency"]
+    print(
+        "Latency: p50 {:.3f} s, p95 {:.3f} s, p99 {:.3f} s, max {:.3f} s".format(
+            latency["p50"], latency["p95"], latency["p99"], latency["max"]
+        )
+    )
+
+    for stage, times in results["stages"].items():
+        print("  {:20s} {:8d} x {:.4f} s".format(stage, times["count"], times["meanSeconds"]))
+
+
+class LocalEngine:
+    """
+    The real engine served by gunicorn the way the engine image serves it, but running submissions
+    with LOVELACE_SANDBOX=local so it needs no docker.
+
+    :param threads: number of gunicorn threads, and of sandboxes in the container pool
+    :param startup_timeout: seconds to wait for the engine to start answering requests
+    """
+
+    def __init__(self, threads=4, startup_timeout=300):
+        self.threads = threads
+        self.startup_timeout = startup_timeout
+
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            self.port = s.getsockname()[1]
+        self.uri = "http://localhost:{:d}".format(self.port)
+        self.process = None
+
+    def __enter__(self):
+        env = dict(
+            os.environ,
+            LOVELACE_SANDBOX="local",
+            LOVELACE_CONTAINER_POOL_SIZE=str(self.threads),
+        )
+        cmd = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--workers",
+            "1",
+            "--threads",
+            str(self.threads),
+            "--timeout",
+            "600",
+            "--preload",
+            "--bind",
+            "localhost:{:d}".format(self.port),
+            "engine.api:app",
+        ]
+        self.process = subprocess.Popen(cmd, cwd=repo_dir, env=env)
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Engine exited with code {:d}".format(self.process.returncode))
+            try:
+                requests.get(self.uri + "/metrics", timeout=1)
+                return self
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.5)
+
+        self.__exit__()
+        raise RuntimeError("Engine didn't start within {:d} s".format(self.startup_timeout))
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--engine-uri", default=os.environ.get("LOVELACE_ENGINE_URI", "http://localhost:14714")
+    )
+    parser.add_argument("--solutions-dir", help="defaults to LOVELACE_SOLUTIONS_DIR")
+    parser.add_argument("--languages", nargs="+", default=["python", "javascript", "julia", "c"])
+    parser.add_argument("--requests", type=int, default=100, help="number of submissions to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="most submissions in flight")
+    parser.add_argument(
+        "--rate", type=float, help="submissions per second, as fast as possible if unset"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to save the results to as JSON")
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="start an engine with LOVELACE_SANDBOX=local to benchmark instead",
+    )
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.solutions_dir, args.languages)
+
+    if args.local:
+        with LocalEngine(threads=args.concurrency) as engine:
+            results = run_benchmark(
+                engine.uri, corpus, args.requests, args.concurrency, args.rate, args.seed
+            )
+    else:
+        results = run_benchmark(
+            args.engine_uri, corpus, args.requests, args.concurrency, args.rate, args.seed
+        )
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Saved results to {:s}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -72,3 +72,27 @@ def submit_file(engine_submit_uri):
         return response.json()
 
     return _submit_solution
+
+
+@pytest.fixture()
+def submit_file_async(engine_uri, engine_submit_uri):
+    def _submit_solution(file_path, problem, language, wait=30):
+        with open(file_path, "r") as solution_file:
+            code = solution_file.read()
+        code_b64 = base64.b64encode(code.encode("utf-8")).decode("utf-8")
+
+        payload_dict = {"problem": problem, "language": language, "code": code_b64}
+        payload_json = json.dumps(payload_dict)
+
+        t1 = time.perf_counter()
+        job = requests.post(engine_submit_uri, params={"async": "true"}, data=payload_json).json()
+
+        job_uri = "{}/jobs/{}".format(engine_uri, job["jobId"])
+        while job["status"] not in ("done", "failed"):
+            job = requests.get(job_uri, params={"wait": wait}).json()
+        t2 = time.perf_counter()
+        print(f"{t2 - t1 : .6f} seconds ", end='')
+
+        return job
+
+    return _submit_solution
@@ -0,0 +1,19 @@
+import os
+import json
+
+import requests
+
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+
+
+def test_async_submission(submit_file_async):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    job = submit_file_async(filepath, problem="chaos", language="javascript")
+    assert job["status"] == "done", f"Failed. Engine output:\n{json.dumps(job, indent=4)}"
+    assert job["result"].get("success") is True, f"Failed. Engine output:\n{json.dumps(job, indent=4)}"
+
+
+def test_unknown_job_is_not_found(engine_uri):
+    resp = requests.get(engine_uri + "/jobs/not-a-real-job")
+    assert resp.status_code == 404
@@ -0,0 +1,32 @@
+import os
+import json
+import base64
+
+import requests
+
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+
+
+def encode_file(file_path):
+    with open(file_path, "r") as solution_file:
+        code = solution_file.read()
+    return base64.b64encode(code.encode("utf-8")).decode("utf-8")
+
+
+def test_batch_submission(engine_submit_uri):
+    code_b64 = encode_file(os.path.join(cwd, "dummy_solutions", "chaos_84.js"))
+
+    payloads = [
+        {"problem": "chaos", "language": "javascript", "code": code_b64},
+        {"problem": "chaos", "language": "javascript", "code": code_b64},
+        {"problem": "chaos", "language": "javascript", "code": ""},
+    ]
+
+    response = requests.post(engine_submit_uri + "/batch", data=json.dumps(payloads)).json()
+    results = response["results"]
+
+    assert len(results) == 3
+    for result in results[:2]:
+        assert result["result"].get("success") is True, f"Failed. Engine output:\n{json.dumps(result, indent=4)}"
+    assert "error" in results[2]["result"]
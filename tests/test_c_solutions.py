@@ -1,5 +1,10 @@
+import base64
 import json
+import os
+import uuid
+
 import pytest
+import requests
 
 from helpers import get_solution_filepaths, problem_name_id
 
@@ -23,3 +28,31 @@ def test_submit_file(solution_file, submit_solution):
     assert result.get("success") is True, "Failed. Engine output:\n{:}".format(
         json.dumps(result, indent=4)
     )
+
+
+@pytest.mark.c
+@pytest.mark.parametrize("solution_file", solution_files[:1], ids=problem_name_id)
+def test_resubmit_file_hits_compile_cache(solution_file, engine_uri, engine_submit_uri):
+    problem_name = os.path.basename(solution_file).split(".")[0]
+
+    # A comment no other submission has, so the first submission is compiled.
+    with open(solution_file, "r") as f:
+        code = "// {:s}\n".format(uuid.uuid4().hex) + f.read()
+
+    def submit(code_b64):
+        payload = {"problem": problem_name, "language": "c", "code": code_b64}
+        return requests.post(engine_submit_uri, data=json.dumps(payload)).json()
+
+    submit(base64.b64encode(code.encode("utf-8")).decode("utf-8"))
+    stats_before = requests.get(engine_uri + "/stats").json()
+
+    # The same code base64 encoded with line breaks is the same source to the compile cache, but a
+    # new submission to the result cache so the code has to be run again.
+    result = submit(base64.encodebytes(code.encode("utf-8")).decode("utf-8"))
+    stats_after = requests.get(engine_uri + "/stats").json()
+
+    assert result.get("success") is True, "Failed. Engine output:\n{:}".format(
+        json.dumps(result, indent=4)
+    )
+    assert stats_after["resultCache"]["hits"] == stats_before["resultCache"]["hits"]
+    assert stats_after["compileCache"]["hits"] == stats_before["compileCache"]["hits"] + 1
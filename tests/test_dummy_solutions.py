@@ -1,7 +1,8 @@
 import os
 import glob
 import json
-import pytest
+import base64
+import requests
 
 from helpers import filename_id, ext2language
 
@@ -17,10 +18,45 @@ def test_84(submit_file):
     assert result.get("success") is True, f"Failed. Engine output:\n{json.dumps(result, indent=4)}"
 
 
+def test_process_info_is_measured(submit_file):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    result = submit_file(filepath, problem="chaos", language="javascript")
+
+    for test_case in result["testCaseDetails"]:
+        process_info = test_case["processInfo"]
+        assert process_info["runtime"] > 0
+        assert process_info["cpu_time"] >= 0
+        assert process_info["max_mem_usage"] > 0
+
+
+def test_max_error_is_reported(submit_file):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    result = submit_file(filepath, problem="chaos", language="javascript")
+
+    for test_case in result["testCaseDetails"]:
+        assert test_case["passed"] is True
+        assert test_case["maxError"] is None or test_case["maxError"] >= 0
+
+
+def test_parallel_test_cases(engine_submit_uri):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    with open(filepath, "r") as solution_file:
+        code_b64 = base64.b64encode(solution_file.read().encode("utf-8")).decode("utf-8")
+
+    payload = {"problem": "chaos", "language": "javascript", "code": code_b64, "parallelism": 2}
+    result = requests.post(engine_submit_uri, data=json.dumps(payload)).json()
+    assert result.get("success") is True, f"Failed. Engine output:\n{json.dumps(result, indent=4)}"
+
+
 def test_infinite_loop_times_out(submit_file):
     filepath = os.path.join(cwd, "dummy_solutions", "infinite_loop.py")
-    with pytest.raises(Exception) as e_info:
-        result = submit_file(filepath, problem="scientific_temperatures", language="python")
+    result = submit_file(filepath, problem="scientific_temperatures", language="python")
+
+    assert result.get("success") is False, f"Failed. Engine output:\n{json.dumps(result, indent=4)}"
+    for test_case in result["testCaseDetails"]:
+        assert test_case["timedOut"] is True
+        assert test_case["passed"] is False
+        assert test_case["maxError"] is None
 
 
 # def test_memory_explosion_times_out(submit_file):
@@ -1,5 +1,6 @@
 import json
 import pytest
+import requests
 
 from helpers import get_solution_filepaths, problem_name_id
 
@@ -20,3 +21,17 @@ def test_submit_file(solution_file, submit_solution):
     assert result.get("success") is True, "Failed. Engine output:\n{:}".format(
         json.dumps(result, indent=4)
     )
+
+
+@pytest.mark.julia
+@pytest.mark.parametrize("solution_file", solution_files[:1], ids=problem_name_id)
+def test_julia_runs_in_its_own_containers(solution_file, submit_solution, engine_uri):
+    result = submit_solution(solution_file)
+
+    assert result.get("success") is True, "Failed. Engine output:\n{:}".format(
+        json.dumps(result, indent=4)
+    )
+
+    # Julia gets a bigger resource profile than the default so it needs containers of its own.
+    profiles = requests.get(engine_uri + "/stats").json()["containerPool"]["profiles"]
+    assert len(profiles) >= 2
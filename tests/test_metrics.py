@@ -0,0 +1,25 @@
+import os
+
+import requests
+
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+
+
+def test_metrics_count_submissions_and_time_stages(engine_uri, submit_file):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    result = submit_file(filepath, problem="chaos", language="javascript")
+    assert result["success"] is True
+
+    response = requests.get(engine_uri + "/metrics")
+    assert response.ok
+    assert response.headers["Content-Type"].startswith("text/plain")
+
+    metrics = response.text
+    assert 'lovelace_submissions_total{language="javascript",problem="chaos",outcome="passed"}' in metrics
+
+    for stage in ["problem_import", "generate_test_cases", "push", "execute", "pull", "verify"]:
+        assert 'lovelace_stage_duration_seconds_count{{stage="{}"}}'.format(stage) in metrics
+
+    assert 'lovelace_container_pool_containers{state="idle"}' in metrics
+    assert 'lovelace_cache_hit_ratio{cache="test_case"}' in metrics
@@ -0,0 +1,14 @@
+import requests
+
+
+def test_list_problems(engine_uri):
+    response = requests.get(engine_uri + "/problems")
+    assert response.ok
+
+    problems = {problem["name"]: problem for problem in response.json()["problems"]}
+    assert "chaos" in problems
+    assert "test_case" not in problems
+
+    chaos = problems["chaos"]
+    assert chaos["functionName"]
+    assert chaos["numTestCases"] == sum(t["multiplicity"] for t in chaos["testCaseTypes"])
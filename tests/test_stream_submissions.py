@@ -0,0 +1,60 @@
+import os
+import json
+import base64
+
+import requests
+
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+
+
+def stream_file(engine_submit_uri, file_path, problem, language, headers=None):
+    with open(file_path, "r") as solution_file:
+        code = solution_file.read()
+    code_b64 = base64.b64encode(code.encode("utf-8")).decode("utf-8")
+
+    payload_dict = {"problem": problem, "language": language, "code": code_b64}
+
+    return requests.post(
+        engine_submit_uri + "/stream", data=json.dumps(payload_dict), headers=headers, stream=True
+    )
+
+
+def test_stream_submission(engine_submit_uri):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    response = stream_file(engine_submit_uri, filepath, problem="chaos", language="javascript")
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+
+    events = [json.loads(line) for line in response.iter_lines() if line]
+
+    assert events[0]["event"] == "start"
+    assert events[-1]["event"] == "done", f"Failed. Engine output:\n{json.dumps(events, indent=4)}"
+    assert events[-1]["success"] is True
+
+    test_case_events = [e for e in events if e["event"] == "testCase"]
+    assert len(test_case_events) == events[0]["numTestCases"]
+    assert sorted(e["index"] for e in test_case_events) == list(range(events[0]["numTestCases"]))
+
+
+def test_stream_submission_as_server_sent_events(engine_submit_uri):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    response = stream_file(
+        engine_submit_uri,
+        filepath,
+        problem="chaos",
+        language="javascript",
+        headers={"Accept": "text/event-stream"},
+    )
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+
+    data_lines = [line for line in response.iter_lines(decode_unicode=True) if line.startswith("data: ")]
+    events = [json.loads(line[len("data: "):]) for line in data_lines]
+
+    assert events[-1]["event"] == "done", f"Failed. Engine output:\n{json.dumps(events, indent=4)}"
+    assert events[-1]["success"] is True
+
+
+def test_stream_submission_to_unknown_problem(engine_submit_uri):
+    filepath = os.path.join(cwd, "dummy_solutions", "chaos_84.js")
+    response = stream_file(engine_submit_uri, filepath, problem="not-a-problem", language="javascript")
+    assert response.status_code == 400